@@ -8,7 +8,7 @@ from datetime import datetime
 
 # Importa tus funciones
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from functions import connect_to_supabase, execute_query
+from functions import get_connection, execute_query, transaction, fetch_all, start_session, end_session, get_credential_service, archive_historicos, ARCHIVE_AFTER_DAYS, get_query_metrics, query_metrics_panel
 
 st.set_page_config(
     page_title="TissBank",
@@ -38,90 +38,100 @@ SUPERHOST_PHONE = "000000"
 SUPERHOST_PASSWORD = "mati123"
 SUPERHOST_HASH = hashlib.sha256(SUPERHOST_PASSWORD.encode()).hexdigest()
 
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
+# Médicos y hospitales en una sola consulta (vista de migrations/0004_credenciales.sql).
+# La clave se verifica fuera de la base, con scrypt en el pool de procesos de credentials.py.
+# Si un identificador existiera en ambos roles, se prueba primero el médico, como antes.
+LOGIN_QUERY = """
+    SELECT rol, id, nombre, apellido, password
+    FROM credenciales
+    WHERE identificador = %s
+    ORDER BY rol = 'Médico' DESC
+"""
+
+# Tabla de cada rol, para reemplazar los hashes del esquema anterior
+TABLA_ROL = {"Médico": "medico", "Hospital": "hospital"}
+
+def upgrade_password_hash(conn, cuenta, password):
+    # Reemplaza un hash SHA-256 (o scrypt de menor costo) por uno scrypt con el costo actual
+    credenciales = get_credential_service()
+    nuevo_hash = credenciales.hash_password(password)
+    # Si otro inicio de sesión ya reemplazó el hash, el UPDATE no toca filas y no se cuenta
+    query = f"UPDATE {TABLA_ROL[cuenta.rol]} SET password = %s WHERE id = %s AND password = %s RETURNING id"
+    with transaction(conn) as tx:
+        actualizadas = execute_query(query, conn=conn, params=(nuevo_hash, cuenta.id, cuenta.password))
+    if tx.committed and not actualizadas.empty:
+        credenciales.record_upgrade()
 
 def authenticate_user(identifier, password):
-    # SuperHost login hardcoded
-    if identifier == SUPERHOST_PHONE and hash_password(password) == SUPERHOST_HASH:
-        return True, "SuperHost", 0, "SuperHost"
-    conn = connect_to_supabase()
-    if conn is None:
-        st.error("No se pudo conectar a la base de datos para autenticación.")
-        return False, None, None, None
-
-    hashed_password = hash_password(password)
-    query_medico = "SELECT id, dni, nombre FROM medico WHERE dni = %s AND password = %s"
-    medico_data = execute_query(query_medico, conn=conn, params=(identifier, hashed_password), is_select=True)
-    if not medico_data.empty:
-        user_id = medico_data.iloc[0]['id']
-        user_name = medico_data.iloc[0]['nombre']
-        conn.close()
-        return True, "Médico", user_id, user_name
-
-    query_hospital = "SELECT id, telefono, nombre FROM hospital WHERE telefono = %s AND password = %s"
-    hospital_data = execute_query(query_hospital, conn=conn, params=(identifier, hashed_password), is_select=True)
-    if not hospital_data.empty:
-        user_id = hospital_data.iloc[0]['id']
-        user_name = hospital_data.iloc[0]['nombre']
-        conn.close()
-        return True, "Hospital", user_id, user_name
-    conn.close()
-    return False, None, None, None
+    credenciales = get_credential_service()
+    try:
+        # SuperHost login hardcoded
+        if identifier == SUPERHOST_PHONE and credenciales.verify(password, SUPERHOST_HASH):
+            return True, "SuperHost", 0, "SuperHost", ""
+        with get_connection() as conn:
+            if conn is None:
+                st.error("No se pudo conectar a la base de datos para autenticación.")
+                return False, None, None, None, None
+
+            for cuenta in fetch_all(LOGIN_QUERY, conn=conn, params=(identifier,)):
+                if credenciales.verify(password, cuenta.password):
+                    if credenciales.needs_upgrade(cuenta.password):
+                        upgrade_password_hash(conn, cuenta, password)
+                    return True, cuenta.rol, cuenta.id, cuenta.nombre, cuenta.apellido
+    except TimeoutError:
+        st.error("Hay demasiados inicios de sesión en curso. Intentá de nuevo en unos segundos.")
+    return False, None, None, None, None
 
 def register_user(role, data):
-    conn = connect_to_supabase()
-    if conn is None:
-        st.error("No se pudo conectar a la base de datos para el registro.")
-        return False
-
-    success = False
-    hashed_password = hash_password(data.get("password"))
-
-    if role == "Médico":
-        nombre = data.get("nombre")
-        apellido = data.get("apellido")
-        dni = data.get("dni")
-        if not all([nombre, apellido, dni, data.get("password")]):
-            st.warning("Por favor completá todos los campos del médico.")
-            conn.close()
+    with get_connection() as conn:
+        if conn is None:
+            st.error("No se pudo conectar a la base de datos para el registro.")
             return False
-        try:
-            check_query = "SELECT id FROM medico WHERE dni = %s"
-            existing_medico = execute_query(check_query, conn=conn, params=(dni,), is_select=True)
-            if not existing_medico.empty:
-                st.error("El DNI ya está registrado como médico.")
-                conn.close()
+
+        success = False
+
+        if role == "Médico":
+            nombre = data.get("nombre")
+            apellido = data.get("apellido")
+            dni = data.get("dni")
+            if not all([nombre, apellido, dni, data.get("password")]):
+                st.warning("Por favor completá todos los campos del médico.")
                 return False
-            dni_int = int(dni)
-            query = "INSERT INTO medico (nombre, apellido, dni, password) VALUES (%s, %s, %s, %s)"
-            success = execute_query(query, conn=conn, params=(nombre, apellido, dni_int, hashed_password), is_select=False)
-        except ValueError:
-            st.error("El DNI debe ser un número válido.")
-        except Exception as e:
-            st.error(f"Error al registrar médico: {e}")
-
-    elif role == "Hospital":
-        nombre = data.get("nombre")
-        direccion = data.get("direccion")
-        telefono = data.get("telefono")
-        if not all([nombre, direccion, telefono, data.get("password")]):
-            st.warning("Por favor completá todos los campos del hospital.")
-            conn.close()
-            return False
-        try:
-            check_query = "SELECT id FROM hospital WHERE telefono = %s"
-            existing_hospital = execute_query(check_query, conn=conn, params=(telefono,), is_select=True)
-            if not existing_hospital.empty:
-                st.error("El Teléfono ya está registrado como hospital.")
-                conn.close()
+            try:
+                check_query = "SELECT id FROM medico WHERE dni = %s"
+                existing_medico = execute_query(check_query, conn=conn, params=(dni,), is_select=True)
+                if not existing_medico.empty:
+                    st.error("El DNI ya está registrado como médico.")
+                    return False
+                dni_int = int(dni)
+                hashed_password = get_credential_service().hash_password(data.get("password"))
+                query = "INSERT INTO medico (nombre, apellido, dni, password) VALUES (%s, %s, %s, %s)"
+                success = execute_query(query, conn=conn, params=(nombre, apellido, dni_int, hashed_password), is_select=False)
+            except ValueError:
+                st.error("El DNI debe ser un número válido.")
+            except Exception as e:
+                st.error(f"Error al registrar médico: {e}")
+
+        elif role == "Hospital":
+            nombre = data.get("nombre")
+            direccion = data.get("direccion")
+            telefono = data.get("telefono")
+            if not all([nombre, direccion, telefono, data.get("password")]):
+                st.warning("Por favor completá todos los campos del hospital.")
                 return False
-            query = "INSERT INTO hospital (nombre, direccion, telefono, password) VALUES (%s, %s, %s, %s)"
-            success = execute_query(query, conn=conn, params=(nombre, direccion, telefono, hashed_password), is_select=False)
-        except Exception as e:
-            st.error(f"Error al registrar hospital: {e}")
-    conn.close()
-    return success
+            try:
+                check_query = "SELECT id FROM hospital WHERE telefono = %s"
+                existing_hospital = execute_query(check_query, conn=conn, params=(telefono,), is_select=True)
+                if not existing_hospital.empty:
+                    st.error("El Teléfono ya está registrado como hospital.")
+                    return False
+                hashed_password = get_credential_service().hash_password(data.get("password"))
+                # Coordenadas opcionales: sin ellas el hospital no aparece en el mapa de la red
+                query = "INSERT INTO hospital (nombre, direccion, telefono, password, lat, lon) VALUES (%s, %s, %s, %s, %s, %s)"
+                success = execute_query(query, conn=conn, params=(nombre, direccion, telefono, hashed_password, data.get("lat"), data.get("lon")), is_select=False)
+            except Exception as e:
+                st.error(f"Error al registrar hospital: {e}")
+        return success
 
 def show_login_form():
     st.subheader("Inicio de sesión")
@@ -131,13 +141,15 @@ def show_login_form():
         submitted = st.form_submit_button("Iniciar sesión")
         if submitted:
             if identifier and password:
-                is_authenticated, role, user_id, user_name = authenticate_user(identifier, password)
+                is_authenticated, role, user_id, user_name, user_apellido = authenticate_user(identifier, password)
                 if is_authenticated:
                     st.session_state["logged_in"] = True
                     st.session_state["user_identifier"] = identifier
                     st.session_state["role"] = role
                     st.session_state["user_id"] = user_id
                     st.session_state["user_name"] = user_name
+                    # Identidad verificada: los portales la leen del caché sin volver a consultar la base
+                    start_session({"rol": role, "id": int(user_id), "nombre": user_name, "apellido": user_apellido or ""})
                     if role == "SuperHost":
                         st.success("¡Bienvenido/a, Super Host (SuperHost)!")
                     elif role == "Médico":
@@ -158,6 +170,9 @@ def show_superhost_create_hospital_form():
         nombre = st.text_input("Nombre del Hospital")
         direccion = st.text_input("Dirección")
         telefono = st.text_input("Teléfono (Será usuario)", max_chars=15)
+        col_lat, col_lon = st.columns(2)
+        lat = col_lat.number_input("Latitud", min_value=-90.0, max_value=90.0, value=None, format="%.4f")
+        lon = col_lon.number_input("Longitud", min_value=-180.0, max_value=180.0, value=None, format="%.4f")
         password = st.text_input("Contraseña", type="password")
         confirm_password = st.text_input("Confirmar Contraseña", type="password")
         submit = st.form_submit_button("Registrar Hospital")
@@ -166,8 +181,10 @@ def show_superhost_create_hospital_form():
                 st.warning("Por favor completá todos los campos.")
             elif password != confirm_password:
                 st.error("Las contraseñas no coinciden.")
+            elif (lat is None) != (lon is None):
+                st.error("Indicá latitud y longitud, o dejá ambas vacías.")
             else:
-                data = {"nombre": nombre, "direccion": direccion, "telefono": telefono, "password": password}
+                data = {"nombre": nombre, "direccion": direccion, "telefono": telefono, "password": password, "lat": lat, "lon": lon}
                 if register_user("Hospital", data):
                     st.success("✅ Hospital registrado correctamente. Ya puede iniciar sesión.")
                 else:
@@ -215,8 +232,41 @@ else:
     if st.session_state["role"] == "SuperHost":
         st.success(f"Sesión activa como SuperHost.")
         show_superhost_create_hospital_form()
+        with st.expander("🔐 Métricas de inicio de sesión"):
+            metricas = get_credential_service().stats()
+            c1, c2, c3 = st.columns(3)
+            c1.metric("Verificaciones por minuto", f"{metricas['por_minuto']:.0f}")
+            c2.metric("Tiempo promedio por hash", f"{metricas['ms_hash_promedio']:.0f} ms")
+            c3.metric("Espera promedio en cola", f"{metricas['ms_espera_promedio']:.0f} ms")
+            st.caption(
+                f"Exitosas: {metricas['exitosas']} | Fallidas: {metricas['fallidas']} | "
+                f"Rechazadas por saturación: {metricas['rechazadas']} | Hashes actualizados: {metricas['actualizadas']} | "
+                f"Costo scrypt: N={metricas['costo']['n']}, r={metricas['costo']['r']}, p={metricas['costo']['p']}"
+            )
+        with st.expander("🗄️ Archivo histórico"):
+            st.caption("Mueve a las particiones de archivo los tejidos enviados o rechazados y las solicitudes resueltas antiguas. "
+                       "Los portales solo consultan lo vigente; la trazabilidad sigue mostrando todo.")
+            dias_archivo = st.number_input("Archivar lo resuelto hace más de (días)", min_value=30, value=ARCHIVE_AFTER_DAYS, step=30)
+            if st.button("Archivar históricos", use_container_width=True):
+                archivadas = archive_historicos(int(dias_archivo))
+                if archivadas is not None:
+                    st.success(f"Se archivaron {archivadas['tejidos']} tejidos y {archivadas['solicitud']} solicitudes.")
+        with st.expander("🐢 Consultas lentas"):
+            metrics = get_query_metrics()
+            st.caption(f"Consultas de este proceso que tardaron {metrics.slow_ms:.0f} ms o más, o que fallaron. Las más recientes primero.")
+            lentas = metrics.slow_log()
+            if lentas:
+                df_lentas = pd.DataFrame(lentas)
+                df_lentas["ts"] = pd.to_datetime(df_lentas["ts"], unit="s").dt.strftime("%Y-%m-%d %H:%M:%S")
+                st.dataframe(
+                    df_lentas[["ts", "pagina", "seccion", "linea", "ms", "filas", "consulta", "error"]].round({"ms": 1}),
+                    use_container_width=True, hide_index=True
+                )
+            else:
+                st.info("No hay consultas lentas registradas.")
         st.sidebar.markdown("---")
         if st.sidebar.button("Cerrar sesión", key="logout_button_superhost"):
+            end_session()
             for key in list(st.session_state.keys()):
                 st.session_state.pop(key, None)
             st.session_state["logged_in"] = False
@@ -226,6 +276,7 @@ else:
         st.page_link("pages/Portal_Médico.py", label="Ir a mi Dashboard de Médico", icon="🩺")
         st.sidebar.markdown("---")
         if st.sidebar.button("Cerrar sesión", key="logout_button_med"):
+            end_session()
             for key in list(st.session_state.keys()):
                 st.session_state.pop(key, None)
             st.session_state["logged_in"] = False
@@ -235,7 +286,10 @@ else:
         st.page_link("pages/Portal_Hospitalario.py", label="Ir a mi Dashboard de Hospital", icon="🏥")
         st.sidebar.markdown("---")
         if st.sidebar.button("Cerrar sesión", key="logout_button_hos"):
+            end_session()
             for key in list(st.session_state.keys()):
                 st.session_state.pop(key, None)
             st.session_state["logged_in"] = False
             st.rerun()
+
+query_metrics_panel()
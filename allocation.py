@@ -0,0 +1,223 @@
+# allocation.py
+
+import numpy as np
+import pandas as pd
+from geo import haversine_matrix
+
+# --- COMPATIBILIDAD DE TIPOS DE SANGRE ---
+BLOOD_TYPES = ["O-", "O+", "A-", "A+", "B-", "B+", "AB-", "AB+"]
+
+# Receptores compatibles para cada tipo de sangre del donante
+_COMPATIBLE_RECIPIENTS = {
+    "O-": BLOOD_TYPES,
+    "O+": ["O+", "A+", "B+", "AB+"],
+    "A-": ["A-", "A+", "AB-", "AB+"],
+    "A+": ["A+", "AB+"],
+    "B-": ["B-", "B+", "AB-", "AB+"],
+    "B+": ["B+", "AB+"],
+    "AB-": ["AB-", "AB+"],
+    "AB+": ["AB+"],
+}
+
+# BLOOD_COMPATIBLE[donante, receptor] es True si el donante puede donar al receptor
+BLOOD_COMPATIBLE = np.array(
+    [[receptor in _COMPATIBLE_RECIPIENTS[donante] for receptor in BLOOD_TYPES] for donante in BLOOD_TYPES]
+)
+
+# Pesos por defecto del costo de asignar un tejido a una solicitud
+DEFAULT_WEIGHTS = {
+    "distancia_km": 1.0,   # costo por km entre el hospital del tejido y el de la solicitud
+    "antiguedad_dias": 0.5,  # bonificación por día de antigüedad del tejido (se usan primero los más antiguos)
+}
+
+# Distancia asumida cuando no se conocen las coordenadas de un hospital
+UNKNOWN_DISTANCE_KM = 50.0
+
+
+def _blood_index(values):
+    """Índice de cada tipo de sangre en BLOOD_TYPES, -1 si es desconocido o nulo."""
+    lookup = {tipo: i for i, tipo in enumerate(BLOOD_TYPES)}
+    return np.array([lookup.get(v, -1) if isinstance(v, str) else -1 for v in values], dtype=int)
+
+
+def blood_compatibility(donor_types, recipient_types):
+    """
+    Matriz booleana (solicitudes x tejidos) de compatibilidad sanguínea.
+    Una solicitud sin tipo de sangre acepta cualquier tejido; una con tipo de sangre
+    solo acepta donantes compatibles con tipo de sangre conocido.
+    """
+    donors = _blood_index(donor_types)[None, :]
+    recipients = _blood_index(recipient_types)[:, None]
+    known = (donors >= 0) & (recipients >= 0)
+    compatible = BLOOD_COMPATIBLE[np.maximum(donors, 0), np.maximum(recipients, 0)] & known
+    return compatible | (recipients < 0)
+
+
+def min_cost_assignment(cost):
+    """
+    Asignación de costo mínimo sobre una matriz de costos de N x M (camino de aumento más
+    corto, variante del algoritmo húngaro). Cada fila se asigna a lo sumo a una columna y
+    viceversa; se asignan min(N, M) pares.
+
+    Cada paso de la búsqueda está vectorizado con NumPy, y las columnas empatadas en costo
+    reducido se exploran juntas: con costos muy repetidos (mismos hospitales, mismas
+    fechas) eso reduce la búsqueda a unas pocas iteraciones por fila.
+    Retorna dos arrays (filas, columnas) con los pares elegidos, ordenados por fila.
+    """
+    cost = np.asarray(cost, dtype=float)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    if n == 0:
+        return np.array([], dtype=int), np.array([], dtype=int)
+    # Tolerancia para considerar empatados dos costos reducidos
+    eps = 1e-9 * max(1.0, float(np.abs(cost).max()))
+
+    # Potenciales duales de filas (u) y columnas (v), y asignación en ambos sentidos
+    u = cost.min(axis=1)
+    v = np.zeros(m)
+    col4row = np.full(n, -1)
+    row4col = np.full(m, -1)
+    path = np.full(m, -1)
+
+    # Inicialización: cada fila toma una columna libre de costo mínimo, si la hay
+    tight = cost <= u[:, None] + eps
+    for i in range(n):
+        libres = np.flatnonzero(tight[i] & (row4col == -1))
+        if libres.size:
+            col4row[i] = libres[0]
+            row4col[libres[0]] = i
+    del tight
+
+    for cur in np.flatnonzero(col4row == -1):
+        shortest = np.full(m, np.inf)
+        remaining = np.arange(m)
+        scanned_rows = []
+        scanned_cols = np.zeros(m, dtype=bool)
+        min_val = 0.0
+        frontier = np.array([cur])
+        while True:
+            scanned_rows.append(frontier)
+            # Costos reducidos desde todas las filas de la frontera a las columnas no exploradas
+            reduced = min_val + cost[np.ix_(frontier, remaining)] - u[frontier][:, None] - v[remaining][None, :]
+            best = reduced.argmin(axis=0)
+            reduced = reduced[best, np.arange(remaining.size)]
+            dist = shortest[remaining]
+            better = reduced < dist
+            path[remaining[better]] = frontier[best[better]]
+            dist = np.where(better, reduced, dist)
+            shortest[remaining] = dist
+
+            min_val = dist.min()
+            ties = dist <= min_val + eps
+            tie_cols = remaining[ties]
+            free = tie_cols[row4col[tie_cols] == -1]
+            if free.size:
+                sink = free[0]
+                scanned_cols[sink] = True
+                break
+            scanned_cols[tie_cols] = True
+            frontier = row4col[tie_cols]
+            remaining = remaining[~ties]
+
+        # Actualizar los potenciales duales
+        rows = np.concatenate(scanned_rows)
+        others = rows[rows != cur]
+        u[cur] += min_val
+        u[others] += min_val - shortest[col4row[others]]
+        v[scanned_cols] -= min_val - shortest[scanned_cols]
+
+        # Aumentar la asignación a lo largo del camino encontrado
+        j = sink
+        while True:
+            i = path[j]
+            row4col[j] = i
+            col4row[i], j = j, col4row[i]
+            if i == cur:
+                break
+
+    rows = np.arange(n)
+    cols = col4row
+    if transposed:
+        order = np.argsort(cols)
+        return cols[order], rows[order]
+    return rows, cols
+
+
+def _coordinates(ids, hospitales):
+    """Coordenadas de cada hospital por id (NaN si no se conocen). Dos hospitales pueden llamarse igual."""
+    coords = hospitales.set_index("id")[["lat", "lon"]]
+    coords = coords[~coords.index.duplicated()]
+    found = coords.reindex(pd.Index(ids))
+    return found["lat"].to_numpy(dtype=float), found["lon"].to_numpy(dtype=float)
+
+
+def allocate(solicitudes, tejidos, hospitales, weights=None, max_distance_km=None, today=None):
+    """
+    Calcula la asignación óptima global de tejidos disponibles a solicitudes pendientes.
+
+    `solicitudes`: DataFrame con id, tipo, hospital_id (hospital destino), ubicacion (su nombre,
+                   para mostrar) y, opcionalmente, tipo_sangre del receptor.
+    `tejidos`: DataFrame con id, tipo, id_hospital, hospital (nombre), fecha_recoleccion y
+               tipo_sangre del donante.
+    `hospitales`: DataFrame con id, lat y lon de cada hospital.
+    `max_distance_km`: si se indica, no se sugieren traslados más largos.
+
+    Solo se emparejan tejidos del mismo tipo y compatibles en sangre; entre las asignaciones
+    posibles se maximiza la cantidad de solicitudes atendidas y luego se minimiza el costo
+    (distancia de traslado, priorizando los tejidos más antiguos).
+    Retorna un DataFrame con una fila por solicitud atendida. Los hospitales se identifican
+    por id (hospital_destino_id, hospital_origen_id); los nombres son solo para mostrar.
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    today = pd.Timestamp.now().normalize() if today is None else pd.Timestamp(today)
+    columns = ["solicitud_id", "tejido_id", "tipo", "hospital_destino_id", "hospital_destino",
+               "hospital_origen_id", "hospital_origen", "distancia_km", "antiguedad_dias", "costo"]
+    if solicitudes.empty or tejidos.empty:
+        return pd.DataFrame(columns=columns)
+
+    req_lat, req_lon = _coordinates(solicitudes["hospital_id"].astype(object), hospitales)
+    tej_lat, tej_lon = _coordinates(tejidos["id_hospital"].astype(object), hospitales)
+    edad = (today - pd.to_datetime(tejidos["fecha_recoleccion"]).dt.tz_localize(None)).dt.days.to_numpy(dtype=float)
+    edad = np.nan_to_num(edad, nan=0.0)
+    req_sangre = solicitudes["tipo_sangre"].to_numpy(dtype=object) if "tipo_sangre" in solicitudes else [None] * len(solicitudes)
+    tej_sangre = tejidos["tipo_sangre"].to_numpy(dtype=object)
+    req_tipo = solicitudes["tipo"].astype(object).to_numpy()
+    tej_tipo = tejidos["tipo"].astype(object).to_numpy()
+
+    results = []
+    # Solo se pueden emparejar tejidos del mismo tipo: se resuelve un problema por tipo
+    for tipo in np.intersect1d(req_tipo, tej_tipo):
+        ri = np.nonzero(req_tipo == tipo)[0]
+        ti = np.nonzero(tej_tipo == tipo)[0]
+
+        distancia = haversine_matrix(req_lat[ri], req_lon[ri], tej_lat[ti], tej_lon[ti])
+        distancia = np.where(np.isnan(distancia), UNKNOWN_DISTANCE_KM, distancia)
+        feasible = blood_compatibility(tej_sangre[ti], np.asarray(req_sangre, dtype=object)[ri])
+        if max_distance_km is not None:
+            feasible &= distancia <= max_distance_km
+
+        costo = weights["distancia_km"] * distancia + weights["antiguedad_dias"] * (edad[ti].max() - edad[ti])[None, :]
+        # Penalización mayor que cualquier suma de costos factibles: primero se maximizan las asignaciones
+        big = (costo[feasible].max() + 1) * (len(ri) + 1) if feasible.any() else 1.0
+        rows, cols = min_cost_assignment(np.where(feasible, costo, big))
+        ok = feasible[rows, cols]
+        rows, cols = rows[ok], cols[ok]
+
+        results.append(pd.DataFrame({
+            "solicitud_id": solicitudes["id"].to_numpy()[ri[rows]],
+            "tejido_id": tejidos["id"].to_numpy()[ti[cols]],
+            "tipo": tipo,
+            "hospital_destino_id": solicitudes["hospital_id"].to_numpy()[ri[rows]],
+            "hospital_destino": solicitudes["ubicacion"].to_numpy()[ri[rows]],
+            "hospital_origen_id": tejidos["id_hospital"].to_numpy()[ti[cols]],
+            "hospital_origen": tejidos["hospital"].to_numpy()[ti[cols]],
+            "distancia_km": distancia[rows, cols],
+            "antiguedad_dias": edad[ti[cols]],
+            "costo": costo[rows, cols],
+        }))
+
+    if not results:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(results, ignore_index=True)[columns]
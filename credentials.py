@@ -0,0 +1,148 @@
+# credentials.py
+
+import base64
+import hashlib
+import hmac
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Costo por defecto de scrypt: N=2^14, r=8, p=1 usa 16 MiB de memoria por hash
+DEFAULT_COST = {"n": 2 ** 14, "r": 8, "p": 1}
+SALT_BYTES = 16
+KEY_BYTES = 32
+# Ventana (en segundos) sobre la que se calcula el caudal de inicios de sesión
+THROUGHPUT_WINDOW = 60
+
+
+def _scrypt(password, salt, n, r, p):
+    # Se ejecuta en los procesos del pool: solo depende de hashlib
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 2 ** 20, dklen=KEY_BYTES)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip("=")
+
+
+def _unb64(text):
+    return base64.b64decode(text + "=" * (-len(text) % 4))
+
+
+def is_legacy_hash(stored):
+    """True si `stored` es un SHA-256 sin sal (64 caracteres hexadecimales) del esquema anterior."""
+    return isinstance(stored, str) and len(stored) == 64 and all(c in "0123456789abcdef" for c in stored.lower())
+
+
+def parse_hash(stored):
+    """Descompone `scrypt$n$r$p$sal$hash`. Retorna (costo, sal, hash) o None si no tiene ese formato."""
+    try:
+        scheme, n, r, p, salt, key = stored.split("$")
+        if scheme != "scrypt":
+            return None
+        return {"n": int(n), "r": int(r), "p": int(p)}, _unb64(salt), _unb64(key)
+    except (AttributeError, ValueError):
+        return None
+
+
+class CredentialService:
+    """
+    Hashing y verificación de claves con scrypt en un pool de procesos acotado, para que
+    los inicios de sesión no bloqueen el hilo que ejecuta la página.
+    `workers`: procesos del pool. `max_pending`: verificaciones en espera antes de rechazar
+    nuevas (evita colas ilimitadas durante picos de inicios de sesión).
+    `cost`: parámetros n, r y p de scrypt para los hashes nuevos.
+    """
+
+    def __init__(self, workers=2, max_pending=32, cost=None, wait_timeout=10):
+        self.cost = {**DEFAULT_COST, **(cost or {})}
+        self.wait_timeout = wait_timeout
+        # spawn: el proceso de Streamlit tiene varios hilos, no es seguro hacer fork
+        self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self._slots = threading.BoundedSemaphore(workers + max_pending)
+        self._lock = threading.Lock()
+        self._recent = deque()  # instantes de las verificaciones de la última ventana
+        self._stats = {"verificaciones": 0, "exitosas": 0, "fallidas": 0, "rechazadas": 0,
+                       "actualizadas": 0, "hashes": 0, "segundos_hash": 0.0, "segundos_espera": 0.0}
+
+    def _run(self, password, salt, cost):
+        """Calcula scrypt en el pool. Lanza TimeoutError si la cola está llena."""
+        queued = time.monotonic()
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            with self._lock:
+                self._stats["rechazadas"] += 1
+            raise TimeoutError("Demasiadas verificaciones de clave en curso")
+        try:
+            started = time.monotonic()
+            key = self._executor.submit(_scrypt, password, salt, cost["n"], cost["r"], cost["p"]).result()
+            finished = time.monotonic()
+        finally:
+            self._slots.release()
+        with self._lock:
+            self._stats["hashes"] += 1
+            self._stats["segundos_espera"] += started - queued
+            self._stats["segundos_hash"] += finished - started
+        return key
+
+    def hash_password(self, password):
+        """Hash nuevo con sal aleatoria, en formato `scrypt$n$r$p$sal$hash`."""
+        salt = os.urandom(SALT_BYTES)
+        key = self._run(password, salt, self.cost)
+        return f"scrypt${self.cost['n']}${self.cost['r']}${self.cost['p']}${_b64(salt)}${_b64(key)}"
+
+    def needs_upgrade(self, stored):
+        """True si el hash es del esquema anterior o usa un costo menor que el configurado."""
+        parsed = parse_hash(stored)
+        if parsed is None:
+            return True
+        cost = parsed[0]
+        return any(cost[k] < self.cost[k] for k in ("n", "r", "p"))
+
+    def verify(self, password, stored):
+        """
+        Verifica `password` contra el hash guardado (scrypt o SHA-256 del esquema anterior).
+        Retorna True si coincide. Lanza TimeoutError si el pool está saturado.
+        """
+        parsed = parse_hash(stored)
+        if parsed is not None:
+            cost, salt, key = parsed
+            ok = hmac.compare_digest(self._run(password, salt, cost), key)
+        elif is_legacy_hash(stored):
+            ok = hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), stored.lower())
+        else:
+            ok = False
+        self._record(ok)
+        return ok
+
+    def record_upgrade(self):
+        with self._lock:
+            self._stats["actualizadas"] += 1
+
+    def _record(self, ok):
+        now = time.monotonic()
+        with self._lock:
+            self._stats["verificaciones"] += 1
+            self._stats["exitosas" if ok else "fallidas"] += 1
+            self._recent.append(now)
+            while self._recent and self._recent[0] < now - THROUGHPUT_WINDOW:
+                self._recent.popleft()
+
+    def stats(self):
+        """Contadores acumulados, caudal de la última ventana y tiempos promedio por hash."""
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0] < now - THROUGHPUT_WINDOW:
+                self._recent.popleft()
+            stats = dict(self._stats)
+            recientes = len(self._recent)
+        hashes = max(1, stats["hashes"])
+        stats["por_minuto"] = recientes * 60 / THROUGHPUT_WINDOW
+        stats["ms_hash_promedio"] = 1000 * stats.pop("segundos_hash") / hashes
+        stats["ms_espera_promedio"] = 1000 * stats.pop("segundos_espera") / hashes
+        stats["costo"] = dict(self.cost)
+        return stats
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -1,10 +1,30 @@
 # functions.py
 
+import hashlib
+import hmac
+import io
+import json
 import os
+import re
+import secrets
+import select
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
 import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
 import pandas as pd
 from dotenv import load_dotenv
 import streamlit as st # Importa streamlit aquí para usar st.error
+import migrate
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from credentials import CredentialService
+from query_metrics import QueryMetrics, caller_location
 
 load_dotenv() # Cargar variables de entorno del archivo .env
 
@@ -25,50 +45,961 @@ print(f"PORT LEÍDO: {port}")
 print("--- FIN DEL DIAGNÓSTICO ---")
 # --- FIN DEL CÓDIGO DE DIAGNÓSTICO ---
 
+# --- POOL DE CONEXIONES ---
+class ConnectionPool:
+    """
+    Pool de conexiones psycopg2 thread-safe, compartido por todas las sesiones del proceso.
+    Mantiene entre `minconn` y `maxconn` conexiones abiertas, verifica la salud de las
+    conexiones inactivas al prestarlas y cierra las que superan `max_idle` segundos sin uso.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, max_idle=300, checkout_timeout=10,
+                 health_check_after=30, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Tamaños de pool inválidos: se requiere 0 <= minconn <= maxconn y maxconn >= 1.")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.max_idle = max_idle
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self._connect_kwargs = connect_kwargs
+        self._idle = []  # Lista de (conexión, momento en que se devolvió), la más reciente al final
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        for _ in range(minconn):
+            self._idle.append((self._dial(), time.monotonic()))
+        # Hilo que cierra las conexiones inactivas por encima del mínimo
+        self._reaper = threading.Thread(target=self._reap_loop, name="supabase-pool-reaper", daemon=True)
+        self._reaper.start()
+
+    def _dial(self):
+        return psycopg2.connect(**self._connect_kwargs)
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, conn, idle_since):
+        if conn.closed:
+            return False
+        if time.monotonic() - idle_since < self.health_check_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def getconn(self, timeout=None):
+        """Presta una conexión sana del pool, abriendo una nueva si hace falta y hay lugar."""
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise psycopg2.pool.PoolError("El pool de conexiones está cerrado.")
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                    self._in_use += 1
+                    break
+                if self._in_use + len(self._idle) < self.maxconn:
+                    conn, idle_since = None, None
+                    self._in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise psycopg2.pool.PoolError(f"No hay conexiones libres en el pool (máximo {self.maxconn}).")
+                self._cond.wait(remaining)
+
+        # La verificación y el dial se hacen fuera del lock para no bloquear a otras sesiones
+        try:
+            if conn is not None and not self._is_healthy(conn, idle_since):
+                self._discard(conn)
+                conn = None
+            if conn is None:
+                conn = self._dial()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, close=False):
+        """Devuelve una conexión al pool. Si quedó en una transacción abierta, se revierte."""
+        if not close and not conn.closed:
+            try:
+                if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                close = True
+        with self._cond:
+            self._in_use -= 1
+            if close or conn.closed or self._closed:
+                self._discard(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Context manager: `with pool.connection() as conn:` presta una conexión y la devuelve al salir."""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def reap_idle(self):
+        """Cierra las conexiones inactivas por más de `max_idle` segundos, respetando `minconn`."""
+        now = time.monotonic()
+        expired = []
+        with self._cond:
+            keep = []
+            # Las más antiguas están al principio de la lista
+            for conn, idle_since in self._idle:
+                surplus = len(self._idle) - len(expired) > self.minconn
+                if surplus and now - idle_since > self.max_idle:
+                    expired.append(conn)
+                else:
+                    keep.append((conn, idle_since))
+            self._idle = keep
+        for conn in expired:
+            self._discard(conn)
+        return len(expired)
+
+    def _reap_loop(self):
+        interval = max(1, self.max_idle / 2)
+        while not self._stop.wait(interval):
+            self.reap_idle()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._cond.notify_all()
+        self._stop.set()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"en_uso": self._in_use, "inactivas": len(self._idle), "maximo": self.maxconn}
+
+
+class PooledConnection:
+    """
+    Envoltorio de una conexión prestada por el pool. Se usa igual que una conexión de
+    psycopg2, pero `close()` la devuelve al pool en lugar de cerrar el socket.
+    """
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("La conexión ya fue devuelta al pool.")
+        return getattr(self._conn, name)
+
+    @property
+    def closed(self):
+        return 1 if self._conn is None else self._conn.closed
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.putconn(conn)
+
+    def __del__(self):
+        # Red de seguridad para páginas que terminan con st.stop() sin llegar a conn.close()
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _get_db_settings():
+    settings = {
+        "host": os.getenv("SUPABASE_DB_HOST"),
+        "database": os.getenv("SUPABASE_DB_NAME"),
+        "user": os.getenv("SUPABASE_DB_USER"),
+        "password": os.getenv("SUPABASE_DB_PASSWORD"),
+        "port": os.getenv("SUPABASE_DB_PORT"),
+    }
+    if not all(settings.values()):
+        return None
+    settings["sslmode"] = "require"
+    return settings
+
+
+@st.cache_resource
+def get_pool():
+    """
+    Crea (una sola vez por proceso del servidor) el pool de conexiones a Supabase.
+    El tamaño y los tiempos se configuran con variables de entorno opcionales.
+    """
+    settings = _get_db_settings()
+    if settings is None:
+        raise RuntimeError("Una o más variables de entorno de Supabase no están definidas.")
+    return ConnectionPool(
+        minconn=int(os.getenv("SUPABASE_POOL_MIN", "1")),
+        maxconn=int(os.getenv("SUPABASE_POOL_MAX", "10")),
+        max_idle=float(os.getenv("SUPABASE_POOL_MAX_IDLE", "300")),
+        checkout_timeout=float(os.getenv("SUPABASE_POOL_TIMEOUT", "10")),
+        health_check_after=float(os.getenv("SUPABASE_POOL_HEALTH_CHECK", "30")),
+        **settings
+    )
+
+
 def connect_to_supabase():
     """
-    Establece una conexión con la base de datos Supabase usando psycopg2.
-    Retorna el objeto de conexión si es exitoso, None en caso contrario.
+    Presta una conexión del pool compartido con la base de datos Supabase.
+    Retorna la conexión si es exitoso, None en caso contrario.
+    Llamar a `conn.close()` devuelve la conexión al pool.
+    La primera conexión del proceso aplica antes las migraciones pendientes (ver ensure_schema),
+    sin importar por qué página se entró a la app.
     """
     try:
-        # Re-leemos las variables aquí para asegurarnos de que la función las usa.
-        db_host = os.getenv("SUPABASE_DB_HOST")
-        db_name = os.getenv("SUPABASE_DB_NAME")
-        db_user = os.getenv("SUPABASE_DB_USER")
-        db_password = os.getenv("SUPABASE_DB_PASSWORD")
-        db_port = os.getenv("SUPABASE_DB_PORT")
-        
         # Verificación para asegurarnos de que las variables no son None
-        if not all([db_host, db_name, db_user, db_password, db_port]):
+        if _get_db_settings() is None:
             st.error("Una o más variables de entorno de Supabase no están definidas.")
             return None
-
-        conn = psycopg2.connect(
-            host=db_host,
-            database=db_name,
-            user=db_user,
-            password=db_password,
-            port=db_port,
-            sslmode="require"
-
-        )
-        return conn
+        ensure_schema()
+        pool = get_pool()
+        return PooledConnection(pool, pool.getconn())
     except Exception as e:
         # Usamos st.error para mostrar el error en la interfaz de Streamlit
         st.error(f"Error al conectar con Supabase: {e}")
         return None
 
-def execute_query(query, conn=None, params=None, is_select=True):
+
+@contextmanager
+def get_connection():
+    """
+    Context manager sobre el pool: `with get_connection() as conn:`.
+    Entrega None si no se pudo obtener una conexión (el error ya se mostró con st.error).
+    """
+    conn = connect_to_supabase()
+    try:
+        yield conn
+    finally:
+        if conn is not None:
+            conn.close()
+
+# --- MIGRACIONES AL ARRANCAR ---
+@st.cache_resource(show_spinner="Actualizando el esquema de la base de datos...")
+def _startup_migrations():
+    # Conexión propia fuera del pool: el runner cambia autocommit mientras aplica
+    conn = psycopg2.connect(**_get_db_settings())
+    try:
+        return [f"{m.version}_{m.nombre}" for m in migrate.apply_migrations(conn)]
+    finally:
+        conn.close()
+
+
+# Meses de tejidos_eventos (migrations/0011_tejidos_eventos.sql) que se crean por adelantado
+EVENT_PARTITION_MONTHS = int(os.getenv("EVENT_PARTITION_MONTHS", "12"))
+
+
+@st.cache_resource(show_spinner=False)
+def _particiones_tejidos_eventos(mes):
+    # Una vez por proceso y por mes (`mes` es solo la clave del caché). Conexión propia, como las migraciones.
+    conn = psycopg2.connect(**_get_db_settings())
+    try:
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT crear_particiones_tejidos_eventos(current_date, (current_date + make_interval(months => %s))::date)",
+                (EVENT_PARTITION_MONTHS,)
+            )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def ensure_schema():
+    """
+    Aplica una vez por proceso las migraciones pendientes de migrations/ (ver migrate.py).
+    La llama connect_to_supabase, así que corre antes de la primera consulta de cualquier página;
+    las llamadas siguientes solo leen el resultado guardado por st.cache_resource.
+    Se desactiva con MIGRATE_ON_STARTUP=0, por ejemplo si las aplica un paso de despliegue.
+    Si falla muestra el error y se vuelve a intentar en la próxima ejecución de la página.
+
+    Además, una vez por mes, crea las particiones mensuales de tejidos_eventos de los próximos
+    EVENT_PARTITION_MONTHS meses, así no hace falta pg_cron. Esto corre aunque las migraciones
+    estén desactivadas; si falla solo se registra en el log, porque los eventos igual caen en la
+    partición por defecto.
+    Retorna los nombres de las migraciones aplicadas en este proceso.
+    """
+    if _get_db_settings() is None:
+        return []
+    aplicadas = []
+    if os.getenv("MIGRATE_ON_STARTUP", "1").lower() not in ("0", "false", "no"):
+        try:
+            aplicadas = _startup_migrations()
+        except (migrate.MigrationError, psycopg2.Error) as e:
+            st.error(f"No se pudieron aplicar las migraciones de la base de datos: {e}")
+            return []
+    try:
+        _particiones_tejidos_eventos(time.strftime("%Y-%m"))
+    except psycopg2.Error as e:
+        print(f"No se pudieron crear las particiones de tejidos_eventos: {e}")
+    return aplicadas
+
+# --- CACHÉ DE CONSULTAS CON INVALIDACIÓN POR TABLA ---
+_TABLES_READ_RE = re.compile(r"\b(?:FROM|JOIN)\s+(?:ONLY\s+)?([A-Za-z_][\w.]*)", re.IGNORECASE)
+_TABLES_WRITTEN_RE = re.compile(
+    r"\b(?:INSERT\s+INTO|(?<!FOR )UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?|COPY)\s+(?:ONLY\s+)?([A-Za-z_][\w.]*)",
+    re.IGNORECASE
+)
+_SQL_KEYWORDS = {"set", "skip", "of", "nowait", "select", "lateral", "unnest"}
+
+
+def _table_names(regex, query):
+    names = set()
+    for match in regex.findall(query):
+        name = match.lower().split(".")[-1]  # public.tejidos -> tejidos
+        if name not in _SQL_KEYWORDS:
+            names.add(name)
+    return names
+
+
+def tables_read(query):
+    """Tablas que aparecen en cláusulas FROM/JOIN de la consulta."""
+    return _table_names(_TABLES_READ_RE, query)
+
+
+def tables_written(query):
+    """Tablas modificadas por la sentencia (INSERT/UPDATE/DELETE/TRUNCATE/COPY)."""
+    return _table_names(_TABLES_WRITTEN_RE, query)
+
+
+class QueryCache:
+    """
+    Caché de resultados thread-safe con expiración (TTL), desalojo LRU y etiquetas por tabla.
+    Cada entrada se asocia a las tablas de las que depende, y `invalidate(tabla)` descarta
+    solo esas entradas en lugar de vaciar todo el caché.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # clave -> (valor, vence, tablas)
+        self._by_table = {}  # tabla -> conjunto de claves
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _drop(self, key):
+        _, _, tables = self._entries.pop(key)
+        for table in tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, value, tables, ttl=None):
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, expires, frozenset(tables))
+            for table in tables:
+                self._by_table.setdefault(table, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, *tables):
+        """Descarta las entradas que dependen de alguna de las tablas indicadas. Retorna cuántas."""
+        with self._lock:
+            keys = set()
+            for table in tables:
+                keys |= self._by_table.get(table, set())
+            for key in keys:
+                self._drop(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_table.clear()
+
+
+@st.cache_resource
+def get_query_cache():
+    """Caché de consultas compartido por todas las sesiones del proceso."""
+    return QueryCache(
+        maxsize=int(os.getenv("QUERY_CACHE_MAXSIZE", "256")),
+        ttl=float(os.getenv("QUERY_CACHE_TTL", "300")),
+    )
+
+
+def invalidate_tables(*tables):
+    """Invalida las consultas cacheadas que leen alguna de estas tablas."""
+    if tables:
+        get_query_cache().invalidate(*tables)
+
+
+def cached_query(query, conn=None, params=None, tables=None, ttl=None, typed=False):
+    """
+    Igual que `execute_query` para un SELECT, pero guarda el resultado en el caché compartido.
+    `tables`: tablas de las que depende el resultado. Si no se indican, se deducen de FROM/JOIN.
+    Las escrituras hechas con `execute_query` invalidan automáticamente las tablas que tocan.
+    Retorna una copia del DataFrame, para que quien llama pueda modificarla sin afectar al caché.
+    """
+    if _active_transaction(conn) is not None:
+        # Dentro de una transacción se pueden ver cambios sin confirmar: no se usa el caché
+        return execute_query(query, conn=conn, params=params, is_select=True, typed=typed)
+    cache = get_query_cache()
+    key = (query, repr(params), typed)
+    df = cache.get(key)
+    if df is None:
+        df = execute_query(query, conn=conn, params=params, is_select=True, typed=typed)
+        if df.empty and not len(df.columns):
+            # Error de consulta: no se cachea
+            return df
+        cache.set(key, df, tables if tables is not None else tables_read(query), ttl)
+    return df.copy()
+
+
+# --- INVALIDACIÓN POR LISTEN/NOTIFY ---
+# Canales emitidos por los triggers de migrations/0001_notificar_cambios.sql y 0005_identidad_sesion.sql
+LISTEN_TABLES = ("tejidos", "solicitud", "medico", "hospital")
+
+
+class ChangeListener(threading.Thread):
+    """
+    Hilo (uno por proceso) que escucha los canales `cambios_<tabla>` de Postgres con una
+    conexión dedicada. Las notificaciones (una por sentencia, ver
+    migrations/0015_notificar_por_sentencia.sql) se agrupan durante `debounce` segundos desde
+    la primera: por cada grupo se invalida una vez el caché de cada tabla y se incrementa una
+    vez su número de versión, y los suscriptores registrados con `subscribe` reciben cada payload.
+    """
+
+    def __init__(self, cache, tables=LISTEN_TABLES, poll_timeout=5, retry_delay=5, debounce=0.5):
+        super().__init__(name="supabase-change-listener", daemon=True)
+        self.cache = cache
+        self.tables = tuple(tables)
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self.debounce = debounce
+        self._versions = {table: 0 for table in self.tables}
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def subscribe(self, callback):
+        """Registra `callback(payload)`, llamado con el dict de cada notificación recibida."""
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def versions(self, tables):
+        """Tupla con la versión actual de cada tabla; cambia cuando llega una notificación."""
+        with self._lock:
+            return tuple(self._versions.get(table, 0) for table in tables)
+
+    def stop(self):
+        self._stop.set()
+
+    @staticmethod
+    def _parse(notify):
+        try:
+            payload = json.loads(notify.payload)
+        except ValueError:
+            payload = {}
+        payload["tabla"] = payload.get("tabla") or notify.channel[len("cambios_"):]
+        return payload
+
+    def _dispatch(self, payloads):
+        tables = list(dict.fromkeys(payload["tabla"] for payload in payloads))
+        self.cache.invalidate(*tables)
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+            subscribers = list(self._subscribers)
+        for payload in payloads:
+            for callback in subscribers:
+                try:
+                    callback(payload)
+                except Exception as e:
+                    print(f"Error en suscriptor de cambios: {e}")
+
+    def _listen(self):
+        conn = psycopg2.connect(**_get_db_settings())
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                for table in self.tables:
+                    cur.execute(f"LISTEN cambios_{table}")
+            # Lo que cambió mientras no escuchábamos ya no es confiable en el caché
+            self.cache.invalidate(*self.tables)
+            pendientes, limite = [], None
+            while not self._stop.is_set():
+                timeout = self.poll_timeout if limite is None else max(0.0, limite - time.monotonic())
+                if select.select([conn], [], [], timeout) != ([], [], []):
+                    conn.poll()
+                    while conn.notifies:
+                        pendientes.append(self._parse(conn.notifies.pop(0)))
+                    if pendientes and limite is None:
+                        limite = time.monotonic() + self.debounce
+                if limite is not None and time.monotonic() >= limite:
+                    self._dispatch(pendientes)
+                    pendientes, limite = [], None
+        finally:
+            conn.close()
+
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                print(f"Listener de cambios desconectado, reintentando en {self.retry_delay}s: {e}")
+                self._stop.wait(self.retry_delay)
+
+
+@st.cache_resource
+def get_change_listener():
+    """
+    Inicia (una sola vez por proceso) el hilo que escucha los cambios en la base de datos.
+    Retorna None si faltan las variables de entorno de Supabase.
+    """
+    if _get_db_settings() is None:
+        return None
+    listener = ChangeListener(get_query_cache())
+    listener.start()
+    return listener
+
+
+def watch_tables(*tables, interval=3):
+    """
+    Refresca la página de la sesión actual cuando otra sesión modifica alguna de las tablas.
+    Compara en memoria (sin consultar la base) la versión de las tablas que mantiene el
+    listener; al detectar un cambio vuelve a ejecutar la página completa.
+    """
+    listener = get_change_listener()
+    if listener is None:
+        return
+    state_key = "_versiones_" + "_".join(tables)
+    st.session_state[state_key] = listener.versions(tables)
+
+    @st.fragment(run_every=interval)
+    def _watch():
+        current = listener.versions(tables)
+        if current != st.session_state.get(state_key):
+            st.session_state[state_key] = current
+            st.rerun(scope="app")
+
+    _watch()
+
+
+# --- CREDENCIALES ---
+@st.cache_resource
+def get_credential_service():
+    """
+    Pool de procesos (uno por servidor) que calcula los hashes scrypt de las claves.
+    El costo y el tamaño del pool se ajustan con variables de entorno.
+    """
+    return CredentialService(
+        workers=int(os.getenv("CREDENTIALS_WORKERS", 2)),
+        max_pending=int(os.getenv("CREDENTIALS_MAX_PENDING", 32)),
+        cost={
+            "n": int(os.getenv("SCRYPT_N", 2 ** 14)),
+            "r": int(os.getenv("SCRYPT_R", 8)),
+            "p": int(os.getenv("SCRYPT_P", 1)),
+        },
+    )
+
+
+# --- CACHÉ DE IDENTIDAD DE SESIÓN ---
+# Tabla de la que sale cada rol: un cambio en esa tabla invalida las identidades del usuario
+_ROLE_TABLES = {"medico": "Médico", "hospital": "Hospital"}
+
+
+class IdentityCache:
+    """
+    Identidades de las sesiones iniciadas, guardadas en el servidor (una instancia por proceso).
+    Al iniciar sesión se emite un token `<sid>.<firma HMAC>` que queda en session_state; las
+    páginas lo presentan para obtener la identidad sin consultar la base de datos.
+    Una identidad expira a los `ttl` segundos, al cerrar sesión o cuando cambia el perfil.
+    """
+
+    def __init__(self, secret, ttl=8 * 3600):
+        self.secret = secret
+        self.ttl = ttl
+        self._entries = {}  # sid -> (identidad, vencimiento)
+        self._lock = threading.Lock()
+
+    def _sign(self, sid):
+        return hmac.new(self.secret, sid.encode(), hashlib.sha256).hexdigest()
+
+    def _sid(self, token):
+        """sid del token si la firma es válida, o None."""
+        if not token or "." not in token:
+            return None
+        sid, firma = token.rsplit(".", 1)
+        return sid if hmac.compare_digest(firma, self._sign(sid)) else None
+
+    def issue(self, identity):
+        """Guarda `identity` (dict con rol, id, nombre, ...) y retorna el token firmado."""
+        sid = secrets.token_urlsafe(16)
+        now = time.monotonic()
+        with self._lock:
+            self._entries = {k: v for k, v in self._entries.items() if v[1] > now}
+            self._entries[sid] = (dict(identity), now + self.ttl)
+        return f"{sid}.{self._sign(sid)}"
+
+    def get(self, token):
+        """Copia de la identidad asociada al token, o None si es inválido, venció o fue revocado."""
+        sid = self._sid(token)
+        if sid is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(sid)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._entries[sid]
+                return None
+            return dict(entry[0])
+
+    def revoke(self, token):
+        sid = self._sid(token)
+        if sid is not None:
+            with self._lock:
+                self._entries.pop(sid, None)
+
+    def invalidate_user(self, rol, user_id):
+        """Descarta todas las identidades de un usuario (por ejemplo, si cambió su perfil)."""
+        with self._lock:
+            self._entries = {
+                sid: entry for sid, entry in self._entries.items()
+                if not (entry[0].get("rol") == rol and entry[0].get("id") == user_id)
+            }
+
+    def invalidate_role(self, rol):
+        """Descarta las identidades de todos los usuarios de un rol."""
+        with self._lock:
+            self._entries = {sid: entry for sid, entry in self._entries.items() if entry[0].get("rol") != rol}
+
+    def on_change(self, payload):
+        """
+        Suscriptor del ChangeListener: invalida a los usuarios cuyas filas se modificaron.
+        `ids` en null significa que la sentencia tocó demasiadas filas para listarlas.
+        """
+        rol = _ROLE_TABLES.get(payload.get("tabla"))
+        if rol is None:
+            return
+        if "ids" not in payload:
+            # Formato por fila de 0001_notificar_cambios.sql
+            if payload.get("id") is not None:
+                self.invalidate_user(rol, int(payload["id"]))
+        elif payload["ids"] is None:
+            self.invalidate_role(rol)
+        else:
+            for user_id in payload["ids"]:
+                self.invalidate_user(rol, int(user_id))
+
+
+@st.cache_resource
+def get_identity_cache():
+    """
+    Caché de identidades compartido por todas las sesiones del proceso.
+    La clave de firma sale de SESSION_SECRET; si no está definida se genera una al azar
+    (las sesiones no sobreviven a un reinicio, lo que es aceptable).
+    """
+    secret = os.getenv("SESSION_SECRET")
+    secret = secret.encode() if secret else secrets.token_bytes(32)
+    cache = IdentityCache(secret, ttl=int(os.getenv("SESSION_TTL", 8 * 3600)))
+    listener = get_change_listener()
+    if listener is not None:
+        listener.subscribe(cache.on_change)
+    return cache
+
+
+def start_session(identity):
+    """Registra la identidad del usuario que inició sesión y guarda el token en session_state."""
+    st.session_state["session_token"] = get_identity_cache().issue(identity)
+
+
+def current_identity():
+    """Identidad de la sesión actual según el caché, o None si hay que volver a verificarla."""
+    return get_identity_cache().get(st.session_state.get("session_token"))
+
+
+def end_session():
+    """Revoca la identidad de la sesión actual (al cerrar sesión)."""
+    get_identity_cache().revoke(st.session_state.pop("session_token", None))
+
+
+# --- MÉTRICAS DE CONSULTAS ---
+# Sentencias de la ejecución actual de la página que se guardan para el resumen (ver query_metrics_panel)
+MAX_CONSULTAS_RERUN = 1000
+
+
+@st.cache_resource
+def get_query_metrics():
+    """
+    Métricas de las consultas del proceso (ver query_metrics.py). El umbral de consulta lenta,
+    el tamaño del registro y la exportación en formato Prometheus se ajustan con variables de entorno.
+    """
+    metrics = QueryMetrics(
+        slow_ms=float(os.getenv("QUERY_SLOW_MS", 500)),
+        slow_log_size=int(os.getenv("QUERY_SLOW_LOG_SIZE", 200)),
+        export_path=os.getenv("QUERY_METRICS_FILE") or None,
+    )
+    port = os.getenv("QUERY_METRICS_PORT")
+    if port:
+        try:
+            metrics.serve(int(port), host=os.getenv("QUERY_METRICS_HOST", "127.0.0.1"))
+        except OSError as e:
+            print(f"No se pudo abrir el puerto de métricas {port}: {e}")
+    return metrics
+
+
+def _result_bytes(result):
+    """Tamaño en memoria de un resultado ya decodificado (DataFrame o lista de filas)."""
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=False, deep=True).sum())
+    return sum(sys.getsizeof(value) for row in result for value in row)
+
+
+@contextmanager
+def measure_query(query):
+    """
+    Mide una sentencia: quien llama completa `filas` y `bytes` en el dict que entrega.
+    Al salir registra la duración, el origen (página, sección y línea) y el error, si lo hubo.
+    Lo usan los helpers de este módulo; quien ejecute con su propio cursor (p. ej. COPY en
+    intake.py) envuelve cada sentencia con él para que cuente en las métricas.
+    """
+    medida = {"filas": 0, "bytes": 0}
+    origen = caller_location()
+    inicio = time.perf_counter()
+    error = None
+    try:
+        yield medida
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        entry = get_query_metrics().record(query, time.perf_counter() - inicio, medida["filas"], medida["bytes"], origen, error)
+        if get_script_run_ctx() is not None:
+            consultas = st.session_state.setdefault("consultas_rerun", [])
+            if len(consultas) < MAX_CONSULTAS_RERUN:
+                consultas.append(entry)
+
+
+def _query_error(query, error):
+    """st.error con el origen de la consulta; el texto completo queda en el registro de consultas lentas."""
+    pagina, seccion, linea = caller_location()
+    donde = f"{pagina}:{linea}" + (f" ({seccion})" if seccion else "")
+    st.error(f"Error al ejecutar la consulta en {donde} '{query[:50]}...': {error}")
+
+
+def query_metrics_panel():
+    """
+    Resumen en la barra lateral de las consultas de esta ejecución de la página, de la más
+    lenta a la más rápida. Se llama al final de cada página y se muestra con QUERY_METRICS_PANEL=1.
+    Vacía el resumen para la próxima ejecución.
+    """
+    consultas = st.session_state.pop("consultas_rerun", [])
+    if os.getenv("QUERY_METRICS_PANEL", "0").lower() not in ("1", "true", "yes") or not consultas:
+        return
+    df = pd.DataFrame(consultas)
+    with st.sidebar.expander(f"⏱️ Consultas de esta ejecución ({len(df)})"):
+        c1, c2 = st.columns(2)
+        c1.metric("Tiempo total", f"{df['ms'].sum():.0f} ms")
+        c2.metric("Datos decodificados", f"{df['bytes'].sum() / 1024:.0f} KiB")
+        st.dataframe(
+            df.sort_values("ms", ascending=False)[["ms", "filas", "bytes", "seccion", "linea", "consulta", "error"]].round({"ms": 1}),
+            use_container_width=True, hide_index=True
+        )
+
+# --- DECODIFICACIÓN TIPADA DE RESULTADOS ---
+# OIDs de los tipos de Postgres (ver pg_type) que se decodifican a dtypes compactos
+_PG_INT_OIDS = {20: "Int64", 21: "Int16", 23: "Int32"}
+_PG_FLOAT_OIDS = {700: "Float32", 701: "Float64"}
+_PG_BOOL_OID = 16
+_PG_TEXT_OIDS = {18, 19, 25, 1042, 1043}  # char, name, text, bpchar, varchar
+_PG_TIMESTAMP_OIDS = {1114, 1184}  # timestamp, timestamptz
+
+# Una columna de texto se guarda como `category` si tiene a lo sumo esta proporción de valores distintos
+CATEGORY_MAX_RATIO = 0.5
+
+
+def _decode_column(type_code, values):
+    if type_code in _PG_INT_OIDS:
+        return pd.array(values, dtype=_PG_INT_OIDS[type_code])
+    if type_code in _PG_FLOAT_OIDS:
+        return pd.array(values, dtype=_PG_FLOAT_OIDS[type_code])
+    if type_code == _PG_BOOL_OID:
+        return pd.array(values, dtype="boolean")
+    if type_code in _PG_TIMESTAMP_OIDS:
+        return pd.to_datetime(pd.Series(values, dtype=object))
+    if type_code in _PG_TEXT_OIDS:
+        column = pd.Series(values, dtype=object)
+        # Columnas tipo "enum" (estado, tipo, tipo_sangre, sexo, hospital...): pocos valores distintos
+        if len(column) > 1 and column.nunique(dropna=True) <= len(column) * CATEGORY_MAX_RATIO:
+            return column.astype("category")
+        return column
+    return pd.Series(values, dtype=object)
+
+
+def decode_typed(description, rows):
+    """
+    Arma un DataFrame columna por columna a partir de `cur.description` y las filas del cursor,
+    usando el OID de tipo de cada columna: enteros a dtypes enteros nulables, timestamps a
+    datetime64 y columnas de texto con pocos valores distintos a `category`.
+    """
+    columns = list(zip(*rows)) if rows else [()] * len(description)
+    # Se indexa por posición para no perder columnas con nombres repetidos (ej. SELECT t.*, ...)
+    data = {i: _decode_column(desc[1], list(values)) for i, (desc, values) in enumerate(zip(description, columns))}
+    df = pd.DataFrame(data, columns=range(len(description)))
+    df.columns = [desc[0] for desc in description]
+    return df
+
+# --- TRANSACCIONES EXPLÍCITAS ---
+ISOLATION_LEVELS = ("READ COMMITTED", "REPEATABLE READ", "SERIALIZABLE")
+
+# Transacción abierta en el hilo actual (Streamlit ejecuta cada sesión en su propio hilo)
+_transaction_state = threading.local()
+
+
+class Transaction:
+    """
+    Estado de una transacción abierta con `transaction()`.
+    `failed` pasa a True si falla alguna consulta; también puede marcarse a mano para
+    que el bloque termine en ROLLBACK. `committed` indica si se confirmó al salir.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.failed = False
+        self.committed = False
+        self.tables = set()  # tablas escritas, se invalidan en el caché después del COMMIT
+
+
+def _active_transaction(conn):
+    """La transacción abierta en este hilo, si `conn` es su conexión o no se indicó conexión."""
+    tx = getattr(_transaction_state, "tx", None)
+    if tx is not None and (conn is None or conn is tx.conn):
+        return tx
+    return None
+
+
+@contextmanager
+def transaction(conn=None, isolation_level=None, statement_timeout=None):
+    """
+    Agrupa varias llamadas a `execute_query` (y a `execute_many`, `fetch_one`, `fetch_all`,
+    `stream_query` y los helpers de aprobación y rechazo de solicitudes) en una sola transacción con un único COMMIT o ROLLBACK al salir del bloque:
+
+        with transaction(conn) as tx:
+            execute_query(..., conn=conn, is_select=False)
+            execute_query(..., conn=conn, is_select=False)
+        if tx.committed: ...
+
+    Dentro del bloque esas funciones no confirman por su cuenta; si una consulta falla,
+    las siguientes no se ejecutan (retornan como en un error) y al salir se revierte todo.
+    `isolation_level`: uno de ISOLATION_LEVELS. `statement_timeout`: límite en
+    milisegundos para cada sentencia de la transacción.
+    Un `transaction()` anidado se une a la transacción exterior.
+    """
+    outer = getattr(_transaction_state, "tx", None)
+    if outer is not None:
+        yield outer
+        return
+    if isolation_level is not None and isolation_level.upper() not in ISOLATION_LEVELS:
+        raise ValueError(f"Nivel de aislamiento inválido: {isolation_level}")
+
+    _conn = conn if conn is not None else connect_to_supabase()
+    tx = Transaction(_conn)
+    if _conn is None:
+        tx.failed = True
+        yield tx
+        return
+
+    _transaction_state.tx = tx
+    try:
+        try:
+            if _conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                # Cierra la transacción implícita que dejaron las lecturas anteriores en esta conexión
+                _conn.rollback()
+            with _conn.cursor() as cur:
+                if isolation_level is not None:
+                    cur.execute(f"SET TRANSACTION ISOLATION LEVEL {isolation_level.upper()}")
+                if statement_timeout is not None:
+                    cur.execute("SELECT set_config('statement_timeout', %s, true)", (str(int(statement_timeout)),))
+        except Exception as e:
+            st.error(f"No se pudo iniciar la transacción: {e}")
+            tx.failed = True
+        yield tx
+    except Exception:
+        tx.failed = True
+        raise
+    finally:
+        _transaction_state.tx = None
+        try:
+            if tx.failed:
+                _conn.rollback()
+            else:
+                _conn.commit()
+                tx.committed = True
+        except Exception as e:
+            st.error(f"Error al confirmar la transacción: {e}")
+            _conn.rollback()
+        finally:
+            if conn is None:
+                _conn.close()
+        if tx.committed:
+            invalidate_tables(*tx.tables)
+
+
+def execute_query(query, conn=None, params=None, is_select=True, chunk_size=None, as_rows=False, typed=False):
     """
     Ejecuta una consulta SQL en la base de datos Supabase.
     `query`: La cadena SQL a ejecutar.
-    `conn`: Una conexión a la base de datos (opcional). Si no se proporciona, se crea una nueva.
+    `conn`: Una conexión a la base de datos (opcional). Si no se proporciona, se toma una del pool.
     `params`: Una tupla o lista de parámetros para la consulta (opcional).
     `is_select`: Booleano, True si es una consulta SELECT, False para INSERT/UPDATE/DELETE.
+    `chunk_size`: Entero (opcional). Activa el modo streaming para consultas SELECT.
+    `as_rows`: En modo streaming, entrega listas de tuplas en lugar de DataFrames.
+    `typed`: Si es True, arma el DataFrame columna por columna con dtypes compactos
+             según el tipo de Postgres de cada columna (ver `decode_typed`).
 
     Si is_select es True, retorna un DataFrame con los resultados.
+    Si además se indica chunk_size, retorna un generador que entrega DataFrames de hasta
+    chunk_size filas leídos con un cursor del lado del servidor (ver `stream_query`).
     Si is_select es False, retorna True si la operación fue exitosa, False en caso contrario.
     """
+    tx = _active_transaction(conn)
+    if tx is not None:
+        if tx.failed:
+            # Una consulta anterior de la transacción falló: no tiene sentido seguir
+            return pd.DataFrame() if is_select else False
+        conn = tx.conn
+
+    if is_select and chunk_size:
+        return stream_query(query, conn=conn, params=params, chunk_size=chunk_size, as_rows=as_rows, typed=typed)
+
     _conn = conn # Usar la conexión provista o None
     if _conn is None:
         _conn = connect_to_supabase()
@@ -77,24 +1008,860 @@ def execute_query(query, conn=None, params=None, is_select=True):
             return pd.DataFrame() if is_select else False
 
     try:
-        with _conn.cursor() as cur:
+        with measure_query(query) as medida, _conn.cursor() as cur:
             if params is not None: # Usar 'is not None' para manejar correctamente tuplas vacías o None
                 cur.execute(query, params)
             else:
                 cur.execute(query)
 
             if is_select:
-                column_names = [desc[0] for desc in cur.description]
                 data = cur.fetchall()
-                return pd.DataFrame(data, columns=column_names)
-            else:
+            elif tx is None:
                 _conn.commit() # Confirmar cambios para INSERT, UPDATE, DELETE
+            # INSERT ... RETURNING también llega por acá: invalidar lo que dependa de esas tablas
+            if tx is None:
+                invalidate_tables(*tables_written(query))
+            else:
+                tx.tables.update(tables_written(query)) # Se invalidan después del COMMIT
+            if not is_select:
+                medida["filas"] = max(cur.rowcount, 0)
                 return True
+            if typed:
+                df = decode_typed(cur.description, data)
+            else:
+                column_names = [desc[0] for desc in cur.description]
+                df = pd.DataFrame(data, columns=column_names)
+            medida["filas"], medida["bytes"] = len(df), _result_bytes(df)
+            return df
     except Exception as e:
-        st.error(f"Error al ejecutar la consulta '{query[:50]}...': {e}") # Muestra parte de la query para debug
-        _conn.rollback() # Revertir cambios en caso de error para operaciones no-SELECT
+        _query_error(query, e) # Muestra el origen y parte de la query para debug
+        if tx is None:
+            _conn.rollback() # Revertir cambios en caso de error para operaciones no-SELECT
+        else:
+            tx.failed = True # transaction() revierte todo al salir del bloque
         return pd.DataFrame() if is_select else False
     finally:
-        # Solo cerrar la conexión si fue creada dentro de esta función y no fue proporcionada externamente
+        # Solo devolver la conexión al pool si fue tomada dentro de esta función y no fue proporcionada externamente
+        if conn is None and _conn is not None:
+            _conn.close()
+
+
+def stream_query(query, conn=None, params=None, chunk_size=2000, as_rows=False, typed=False):
+    """
+    Generador que ejecuta un SELECT con un cursor con nombre (del lado del servidor) y
+    entrega los resultados en lotes de `chunk_size` filas, sin materializar la consulta completa.
+    Entrega DataFrames, o listas de tuplas si `as_rows` es True. Nunca entrega lotes vacíos.
+    Con `typed` cada lote se decodifica con `decode_typed`.
+    """
+    tx = _active_transaction(conn)
+    if tx is not None:
+        if tx.failed:
+            return
+        conn = tx.conn
+    _conn = conn
+    if _conn is None:
+        _conn = connect_to_supabase()
+        if _conn is None:
+            return
+
+    try:
+        # Los cursores con nombre viven dentro de la transacción actual de la conexión
+        # La medición abarca toda la lectura, incluido el tiempo que quien consume procesa cada lote
+        with measure_query(query) as medida, _conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+            cur.itersize = chunk_size
+            if params is not None:
+                cur.execute(query, params)
+            else:
+                cur.execute(query)
+
+            column_names = None
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                if as_rows:
+                    lote = rows
+                elif typed:
+                    lote = decode_typed(cur.description, rows)
+                else:
+                    # En cursores con nombre, description solo está disponible después del primer FETCH
+                    if column_names is None:
+                        column_names = [desc[0] for desc in cur.description]
+                    lote = pd.DataFrame(rows, columns=column_names)
+                medida["filas"] += len(rows)
+                medida["bytes"] += _result_bytes(lote)
+                yield lote
+    except Exception as e:
+        _query_error(query, e)
+        if tx is None:
+            _conn.rollback()
+        else:
+            tx.failed = True
+    finally:
+        if conn is None and _conn is not None:
+            _conn.close()
+
+
+def query_csv(query, conn=None, params=None, chunk_size=5000):
+    """
+    Resultado completo de un SELECT como texto CSV (con encabezado), para exportaciones.
+    Lee por lotes con `execute_query(..., chunk_size=...)` y escribe cada lote apenas llega,
+    así nunca hay en memoria más de un lote como DataFrame, por grande que sea la consulta.
+    Retorna "" si no hay filas o la consulta falla al empezar (el error ya se mostró con st.error).
+    """
+    buffer = io.StringIO()
+    for i, lote in enumerate(execute_query(query, conn=conn, params=params, chunk_size=chunk_size)):
+        lote.to_csv(buffer, header=i == 0, index=False)
+    return buffer.getvalue()
+
+
+# Sentencias con un único `VALUES %s` se paginan con execute_values (una sentencia por lote)
+_VALUES_PLACEHOLDER_RE = re.compile(r"\bVALUES\s+%s", re.IGNORECASE)
+
+
+def execute_many(query, params_seq, conn=None, page_size=500, savepoints=False, template=None):
+    """
+    Ejecuta una sentencia de escritura para muchas tuplas de parámetros en pocos viajes
+    a la base, con un solo COMMIT al final.
+
+    Si la sentencia tiene `VALUES %s` (INSERT ... VALUES %s, o UPDATE ... FROM (VALUES %s)),
+    cada lote de `page_size` tuplas se envía como una sola sentencia con execute_values
+    (`template` permite indicar casts, p. ej. "(%s::int, %s)"). Si no, se usa execute_batch.
+    `savepoints`: si es True, cada lote va en su propio SAVEPOINT; un lote que falla se
+    revierte y se informa, y los demás se confirman igual. Si es False, un error revierte todo.
+
+    Retorna un dict con `filas` (filas afectadas; con execute_batch, sentencias ejecutadas),
+    `lotes` y `lotes_fallidos` (índices de los lotes revertidos), o None si todo falló.
+    """
+    params_seq = list(params_seq)
+    result = {"filas": 0, "lotes": 0, "lotes_fallidos": []}
+    if not params_seq:
+        return result
+
+    tx = _active_transaction(conn)
+    if tx is not None:
+        if tx.failed:
+            return None
+        conn = tx.conn
+    _conn = conn
+    if _conn is None:
+        _conn = connect_to_supabase()
+        if _conn is None:
+            return None
+
+    use_values = _VALUES_PLACEHOLDER_RE.search(query) is not None
+    try:
+        with measure_query(query) as medida, _conn.cursor() as cur:
+            for lote, start in enumerate(range(0, len(params_seq), page_size)):
+                chunk = params_seq[start:start + page_size]
+                result["lotes"] += 1
+                if savepoints:
+                    cur.execute("SAVEPOINT lote")
+                try:
+                    if use_values:
+                        psycopg2.extras.execute_values(cur, query, chunk, template=template, page_size=len(chunk))
+                        result["filas"] += cur.rowcount
+                    else:
+                        psycopg2.extras.execute_batch(cur, query, chunk, page_size=len(chunk))
+                        result["filas"] += len(chunk)
+                except Exception as e:
+                    if not savepoints:
+                        raise
+                    cur.execute("ROLLBACK TO SAVEPOINT lote")
+                    result["lotes_fallidos"].append(lote)
+                    st.warning(f"Se revirtió el lote {lote + 1} ({len(chunk)} filas): {e}")
+                else:
+                    if savepoints:
+                        cur.execute("RELEASE SAVEPOINT lote")
+            medida["filas"] = result["filas"]
+        if tx is None:
+            _conn.commit()
+    except Exception as e:
+        _query_error(query, e)
+        if tx is None:
+            _conn.rollback()
+        else:
+            tx.failed = True
+        return None
+    finally:
+        if conn is None and _conn is not None:
+            _conn.close()
+
+    if tx is None:
+        invalidate_tables(*tables_written(query))
+    else:
+        tx.tables.update(tables_written(query))
+    return result
+
+
+def _fetch(query, conn, params, one):
+    tx = _active_transaction(conn)
+    if tx is not None:
+        if tx.failed:
+            return None if one else []
+        conn = tx.conn
+    _conn = conn
+    if _conn is None:
+        _conn = connect_to_supabase()
+        if _conn is None:
+            return None if one else []
+    try:
+        with measure_query(query) as medida, _conn.cursor(cursor_factory=psycopg2.extras.NamedTupleCursor) as cur:
+            cur.execute(query, params)
+            filas = [cur.fetchone()] if one else cur.fetchall()
+            filas = [f for f in filas if f is not None]
+            medida["filas"], medida["bytes"] = len(filas), _result_bytes(filas)
+            return (filas[0] if filas else None) if one else filas
+    except Exception as e:
+        _query_error(query, e)
+        if tx is None:
+            _conn.rollback()
+        else:
+            tx.failed = True
+        return None if one else []
+    finally:
+        if conn is None and _conn is not None:
+            _conn.close()
+
+
+def fetch_one(query, conn=None, params=None):
+    """
+    Ejecuta un SELECT y retorna solo la primera fila como namedtuple (acceso por atributo:
+    `fila.nombre`), o None si no hay filas o la consulta falla. Evita armar un DataFrame
+    para consultas de una sola fila, como el inicio de sesión.
+    """
+    return _fetch(query, conn, params, one=True)
+
+
+def fetch_all(query, conn=None, params=None):
+    """Como `fetch_one`, pero retorna la lista de todas las filas (vacía si falla)."""
+    return _fetch(query, conn, params, one=False)
+
+
+# --- PAGINACIÓN POR CLAVE ---
+# Por debajo de este número de filas estimadas se hace un COUNT(*) exacto
+EXACT_COUNT_BELOW = 10000
+
+
+def count_rows(query, conn=None, params=None, exact_below=EXACT_COUNT_BELOW):
+    """
+    Cantidad de filas de `query` sin traerlas. Usa la estimación del planificador
+    (EXPLAIN, no ejecuta la consulta); si es chica, la confirma con un COUNT(*) exacto.
+    Retorna (cantidad, es_exacta), o (None, False) si falla.
+    """
+    plan = fetch_one("EXPLAIN (FORMAT JSON) " + query, conn=conn, params=params)
+    if plan is None:
+        return None, False
+    plan = json.loads(plan[0]) if isinstance(plan[0], str) else plan[0]
+    estimate = int(plan[0]["Plan"]["Plan Rows"])
+    if estimate >= exact_below:
+        return estimate, False
+    exact = fetch_one(f"SELECT COUNT(*) FROM ({query}) AS q", conn=conn, params=params)
+    return (exact[0], True) if exact is not None else (estimate, False)
+
+
+def keyset_page(query, keys, conn=None, params=None, after=None, page_size=50, descending=False, typed=False):
+    """
+    Una página de `query` ordenada por las columnas `keys` (nombres de columnas del
+    resultado, sin valores nulos, la última única). En lugar de OFFSET se continúa desde
+    la clave de la última fila de la página anterior (`after`), así cada página cuesta lo
+    mismo sin importar cuán lejos esté y solo viajan las filas visibles.
+    `query` no debe tener ORDER BY ni LIMIT.
+
+    Retorna (DataFrame de hasta page_size filas, clave para pedir la página siguiente o
+    None si es la última).
+    """
+    columns = ", ".join(f"q.{k}" for k in keys)
+    op, direction = ("<", "DESC") if descending else (">", "ASC")
+    sql = f"SELECT * FROM ({query}) AS q"
+    page_params = list(params or ())
+    if after is not None:
+        sql += f" WHERE ({columns}) {op} ({', '.join(['%s'] * len(keys))})"
+        page_params.extend(after)
+    sql += f" ORDER BY {', '.join(f'q.{k} {direction}' for k in keys)} LIMIT %s"
+    page_params.append(page_size + 1)  # una fila de más indica si hay página siguiente
+
+    df = execute_query(sql, conn=conn, params=tuple(page_params), is_select=True, typed=typed)
+    if len(df) <= page_size:
+        return df, None
+    df = df.iloc[:page_size]
+    # Columna por columna: tolist() de una Series de un solo tipo devuelve tipos nativos de Python.
+    # La fila completa con claves de tipos mixtos queda como Series object con escalares numpy
+    # (numpy.int64, numpy.int32) que psycopg2 no sabe adaptar.
+    return df, tuple(df[k].iloc[-1:].tolist()[0] for k in keys)
+
+
+def keyset_paginator(state_key, query, keys, conn=None, params=None, descending=False, typed=False, page_sizes=(25, 50, 100, 250)):
+    """
+    Controles de paginación (tamaño de página, anterior y siguiente) para `keyset_page`.
+    Las claves de las páginas visitadas se guardan en session_state bajo `state_key` y se
+    reinician cuando cambian la consulta, los parámetros o el tamaño de página.
+    Retorna (DataFrame de la página actual, número de página, total de filas, total exacto).
+    """
+    c1, c2, c3, c4 = st.columns([2, 1, 1, 3])
+    page_size = c1.selectbox("Filas por página", page_sizes, index=1 if len(page_sizes) > 1 else 0, key=f"{state_key}_tamano")
+    firma = (query, repr(params), page_size)
+    state = st.session_state.get(state_key)
+    if state is None or state["firma"] != firma:
+        state = {"firma": firma, "cursores": [None], "siguiente": None}
+        st.session_state[state_key] = state
+
+    df, state["siguiente"] = keyset_page(
+        query, keys, conn=conn, params=params, after=state["cursores"][-1],
+        page_size=page_size, descending=descending, typed=typed
+    )
+    total, exacto = count_rows(query, conn=conn, params=params)
+    pagina = len(state["cursores"])
+
+    def _anterior():
+        state["cursores"].pop()
+
+    def _siguiente():
+        state["cursores"].append(state["siguiente"])
+
+    c2.button("◀ Anterior", key=f"{state_key}_anterior", on_click=_anterior, disabled=pagina == 1, use_container_width=True)
+    c3.button("Siguiente ▶", key=f"{state_key}_siguiente", on_click=_siguiente, disabled=state["siguiente"] is None, use_container_width=True)
+    if total is not None:
+        paginas = max(1, -(-total // page_size))
+        c4.markdown(f"Página **{pagina}** de {'' if exacto else '~'}{paginas} · {'' if exacto else '~'}{total:,} filas".replace(",", "."))
+    return df, pagina, total, exacto
+
+
+# --- APROBACIÓN DE SOLICITUDES ---
+_APPROVE_SOLICITUD_SQL = """
+    WITH sol AS (
+        SELECT id, tipo, tejido_id FROM solicitud
+        WHERE id = %(solicitud_id)s AND estado = 'pendiente' AND NOT archivado
+        FOR UPDATE
+    ),
+    elegido AS (
+        SELECT id FROM tejidos
+        WHERE tipo = (SELECT tipo FROM sol) AND estado = 'Disponible' AND NOT archivado AND {filtro_tejido}
+        -- Primero el tejido que pidió el médico, si sigue disponible; si no, el más antiguo
+        ORDER BY id IS NOT DISTINCT FROM (SELECT tejido_id FROM sol) DESC, fecha_recoleccion ASC, id ASC
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    ),
+    reservado AS (
+        UPDATE tejidos t
+        SET estado = 'Reservado', fecha_de_estado = NOW()
+        FROM elegido
+        WHERE t.id = elegido.id AND NOT t.archivado
+        RETURNING t.id
+    ),
+    aprobada AS (
+        UPDATE solicitud s
+        SET estado = 'aprobada', tejido_reservado_id = reservado.id
+        FROM reservado, sol
+        WHERE s.id = sol.id AND NOT s.archivado
+        RETURNING s.tejido_reservado_id
+    )
+    SELECT EXISTS (SELECT 1 FROM sol), (SELECT tejido_reservado_id FROM aprobada)
+"""
+
+
+def approve_solicitud(solicitud_id, hospital_id, conn=None, tejido_id=None):
+    """
+    Aprueba una solicitud pendiente en una sola transacción y un solo viaje a la base:
+    bloquea la solicitud, toma el tejido que pidió el médico si sigue 'Disponible' en el
+    hospital, o si no el más antiguo del tipo pedido (FOR UPDATE SKIP LOCKED, para que
+    aprobaciones concurrentes no se bloqueen ni reserven el mismo tejido), lo pasa a
+    'Reservado' y lo vincula a la solicitud.
+    Si se indica `tejido_id` (por ejemplo, una sugerencia de allocation.allocate), se
+    reserva ese tejido, esté en el hospital que esté, siempre que siga disponible.
+
+    Retorna una tupla (resultado, tejido_id), donde resultado es 'aprobada', 'sin_stock'
+    (no hay tejido disponible), 'no_pendiente' (ya fue procesada) o 'error'.
+    Dentro de `transaction()` no confirma por su cuenta: se confirma al salir del bloque.
+    """
+    tx = _active_transaction(conn)
+    if tx is not None:
+        if tx.failed:
+            return "error", None
+        conn = tx.conn
+    _conn = conn
+    if _conn is None:
+        _conn = connect_to_supabase()
+        if _conn is None:
+            return "error", None
+
+    filtro_tejido = "id_hospital = %(hospital_id)s" if tejido_id is None else "id = %(tejido_id)s"
+    query = _APPROVE_SOLICITUD_SQL.format(filtro_tejido=filtro_tejido)
+    try:
+        with measure_query(query) as medida, _conn.cursor() as cur:
+            cur.execute(query, {"solicitud_id": solicitud_id, "hospital_id": hospital_id, "tejido_id": tejido_id})
+            pendiente, tejido_id = cur.fetchone()
+            medida["filas"] = int(tejido_id is not None)
+        if tx is None:
+            _conn.commit()
+    except Exception as e:
+        _query_error(query, e)
+        if tx is None:
+            _conn.rollback()
+        else:
+            tx.failed = True
+        return "error", None
+    finally:
+        if conn is None and _conn is not None:
+            _conn.close()
+
+    if not pendiente:
+        return "no_pendiente", None
+    if tejido_id is None:
+        return "sin_stock", None
+    if tx is None:
+        invalidate_tables("tejidos", "solicitud")
+    else:
+        tx.tables.update(("tejidos", "solicitud")) # Se invalidan después del COMMIT
+    return "aprobada", tejido_id
+
+
+_APPROVE_SOLICITUDES_SQL = """
+    WITH pedidas AS (
+        SELECT DISTINCT unnest(%(ids)s::int[]) AS id
+    ),
+    bloqueadas AS (
+        SELECT id, tipo, tejido_id, fecha_solicitud FROM solicitud
+        WHERE id = ANY(%(ids)s::int[]) AND estado = 'pendiente' AND NOT archivado
+        ORDER BY id
+        FOR UPDATE
+    ),
+    -- Tejidos que pidieron los médicos y siguen disponibles en el hospital. Con SKIP LOCKED,
+    -- los que ya tomó otra aprobación en curso se omiten y la solicitud recibe uno del stock
+    pedidos AS (
+        SELECT id, tipo FROM tejidos
+        WHERE id IN (SELECT tejido_id FROM bloqueadas)
+          AND estado = 'Disponible' AND NOT archivado AND id_hospital = %(hospital_id)s
+        FOR UPDATE SKIP LOCKED
+    ),
+    -- Si dos solicitudes piden el mismo tejido, se lo lleva la más antigua
+    directas AS (
+        SELECT DISTINCT ON (p.id) b.id AS solicitud_id, p.id AS tejido_id
+        FROM bloqueadas b JOIN pedidos p ON p.id = b.tejido_id AND p.tipo = b.tipo
+        ORDER BY p.id, b.fecha_solicitud, b.id
+    ),
+    sol AS (
+        SELECT id, tipo, row_number() OVER (PARTITION BY tipo ORDER BY fecha_solicitud, id) AS n
+        FROM bloqueadas
+        WHERE id NOT IN (SELECT solicitud_id FROM directas)
+    ),
+    -- Por tipo se bloquean solo los tejidos necesarios, los más antiguos que no tenga bloqueados
+    -- otra aprobación en curso: dos lotes concurrentes no compiten por el mismo tejido
+    stock AS (
+        SELECT c.id, d.tipo, row_number() OVER (PARTITION BY d.tipo ORDER BY c.fecha_recoleccion, c.id) AS n
+        FROM (SELECT tipo, count(*) AS cantidad FROM sol GROUP BY tipo) d
+        CROSS JOIN LATERAL (
+            SELECT t.id, t.fecha_recoleccion FROM tejidos t
+            WHERE t.tipo = d.tipo AND t.estado = 'Disponible' AND NOT t.archivado AND t.id_hospital = %(hospital_id)s
+              AND t.id NOT IN (SELECT tejido_id FROM directas)
+            ORDER BY t.fecha_recoleccion, t.id
+            LIMIT d.cantidad
+            FOR UPDATE SKIP LOCKED
+        ) c
+    ),
+    pares AS (
+        SELECT solicitud_id, tejido_id FROM directas
+        UNION ALL
+        SELECT sol.id, stock.id
+        FROM sol JOIN stock USING (tipo, n)
+    ),
+    reservados AS (
+        UPDATE tejidos t
+        SET estado = 'Reservado', fecha_de_estado = NOW()
+        FROM pares
+        WHERE t.id = pares.tejido_id AND t.estado = 'Disponible' AND NOT t.archivado
+        RETURNING t.id
+    ),
+    aprobadas AS (
+        UPDATE solicitud s
+        SET estado = 'aprobada', tejido_reservado_id = pares.tejido_id
+        FROM pares JOIN reservados ON reservados.id = pares.tejido_id
+        WHERE s.id = pares.solicitud_id AND NOT s.archivado
+        RETURNING s.id, s.tejido_reservado_id
+    )
+    SELECT p.id AS solicitud_id,
+           CASE WHEN a.id IS NOT NULL THEN 'aprobada'
+                WHEN b.id IS NOT NULL THEN 'sin_stock'
+                ELSE 'no_pendiente' END AS resultado,
+           a.tejido_reservado_id AS tejido_id
+    FROM pedidas p
+    LEFT JOIN bloqueadas b ON b.id = p.id
+    LEFT JOIN aprobadas a ON a.id = p.id
+    ORDER BY p.id
+"""
+
+_REJECT_SOLICITUDES_SQL = """
+    WITH pedidas AS (
+        SELECT DISTINCT unnest(%(ids)s::int[]) AS id
+    ),
+    rechazadas AS (
+        UPDATE solicitud SET estado = 'rechazada'
+        WHERE id = ANY(%(ids)s::int[]) AND estado = 'pendiente' AND NOT archivado
+        RETURNING id
+    )
+    SELECT p.id AS solicitud_id,
+           CASE WHEN r.id IS NOT NULL THEN 'rechazada' ELSE 'no_pendiente' END AS resultado,
+           NULL::int AS tejido_id
+    FROM pedidas p LEFT JOIN rechazadas r ON r.id = p.id
+    ORDER BY p.id
+"""
+
+
+def _process_solicitudes(sql, params, conn):
+    vacio = pd.DataFrame(columns=["solicitud_id", "resultado", "tejido_id"])
+    tx = _active_transaction(conn)
+    if tx is not None:
+        if tx.failed:
+            return vacio
+        conn = tx.conn
+    _conn = conn
+    if _conn is None:
+        _conn = connect_to_supabase()
+        if _conn is None:
+            return vacio
+
+    try:
+        with measure_query(sql) as medida, _conn.cursor() as cur:
+            cur.execute(sql, params)
+            result = decode_typed(cur.description, cur.fetchall())
+            medida["filas"], medida["bytes"] = len(result), _result_bytes(result)
+        if tx is None:
+            _conn.commit()
+    except Exception as e:
+        _query_error(sql, e)
+        if tx is None:
+            _conn.rollback()
+        else:
+            tx.failed = True
+        return vacio
+    finally:
         if conn is None and _conn is not None:
-            _conn.close()
\ No newline at end of file
+            _conn.close()
+
+    if tx is None:
+        invalidate_tables("tejidos", "solicitud")
+    else:
+        tx.tables.update(("tejidos", "solicitud")) # Se invalidan después del COMMIT
+    return result
+
+
+def approve_solicitudes(solicitud_ids, hospital_id, conn=None):
+    """
+    Aprueba un lote de solicitudes en una sola transacción y una sola sentencia.
+    Cada solicitud recibe el tejido que pidió el médico si sigue disponible en el hospital;
+    el resto, dentro de cada tipo, reciben por antigüedad los tejidos disponibles más antiguos.
+    Los tejidos se bloquean con FOR UPDATE SKIP LOCKED, como en `approve_solicitud`, así dos
+    aprobaciones concurrentes no eligen el mismo. Las que no alcanzan stock quedan pendientes.
+
+    Retorna un DataFrame con una fila por solicitud: solicitud_id, resultado
+    ('aprobada', 'sin_stock' o 'no_pendiente') y tejido_id reservado.
+    """
+    ids = [int(i) for i in solicitud_ids]
+    return _process_solicitudes(_APPROVE_SOLICITUDES_SQL, {"ids": ids, "hospital_id": hospital_id}, conn)
+
+
+def reject_solicitudes(solicitud_ids, conn=None):
+    """
+    Rechaza un lote de solicitudes pendientes en una sola sentencia.
+    Retorna un DataFrame con solicitud_id y resultado ('rechazada' o 'no_pendiente').
+    """
+    ids = [int(i) for i in solicitud_ids]
+    return _process_solicitudes(_REJECT_SOLICITUDES_SQL, {"ids": ids}, conn)
+
+
+# --- BÚSQUEDA DE DONANTES Y MÉDICOS ---
+# Tablas de personas que se pueden buscar por nombre o DNI (índices en migrations/0008_busqueda_personas.sql)
+PERSONAS_BUSCABLES = ("donante", "medico")
+_PERSONAS_COLUMNAS = ["id", "nombre", "apellido", "dni"]
+
+
+def _like_escape(texto):
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def buscar_personas(tabla, texto, conn=None, limit=20):
+    """
+    Búsqueda incremental en `donante` o `medico`. Si `texto` son solo dígitos busca por
+    prefijo de DNI; si no, cada palabra tiene que aparecer en el nombre completo (índice de
+    trigramas) y los resultados se ordenan por similitud. Retorna a lo sumo `limit` filas
+    con id, nombre, apellido y dni, o un DataFrame vacío si el texto tiene menos de 2 caracteres.
+    """
+    if tabla not in PERSONAS_BUSCABLES:
+        raise ValueError(f"No se puede buscar en la tabla {tabla!r}")
+    texto = " ".join((texto or "").split())
+    if len(texto) < 2:
+        return pd.DataFrame(columns=_PERSONAS_COLUMNAS)
+
+    if texto.isdigit():
+        query = f"""
+            SELECT id, nombre, apellido, dni FROM {tabla}
+            WHERE dni::text LIKE %(prefijo)s
+            ORDER BY dni::text
+            LIMIT %(limit)s
+        """
+        params = {"prefijo": texto + "%", "limit": int(limit)}
+    else:
+        palabras = texto.split()
+        filtros = " AND ".join(f"(nombre || ' ' || apellido) ILIKE %(p{i})s" for i in range(len(palabras)))
+        query = f"""
+            SELECT id, nombre, apellido, dni FROM {tabla}
+            WHERE {filtros}
+            ORDER BY similarity(nombre || ' ' || apellido, %(texto)s) DESC, apellido, nombre
+            LIMIT %(limit)s
+        """
+        params = {f"p{i}": f"%{_like_escape(p)}%" for i, p in enumerate(palabras)}
+        params.update(texto=texto, limit=int(limit))
+    return cached_query(query, conn=conn, params=params, tables=(tabla,))
+
+
+def personas_por_dni(tabla, dnis, conn=None):
+    """id y dni de las personas de `tabla` cuyos DNI están en `dnis` (sin pasar por el caché)."""
+    if tabla not in PERSONAS_BUSCABLES:
+        raise ValueError(f"No se puede buscar en la tabla {tabla!r}")
+    dnis = sorted({int(d) for d in dnis})
+    if not dnis:
+        return pd.DataFrame(columns=["id", "dni"])
+    df = execute_query(f"SELECT id, dni FROM {tabla} WHERE dni = ANY(%s)", conn, (dnis,))
+    return df if not df.empty else pd.DataFrame(columns=["id", "dni"])
+
+
+# --- FILTROS DE TEXTO CON ÍNDICE ---
+# Los filtros "contiene" se escriben como ILIKE '%palabra%' por cada palabra, que Postgres
+# resuelve con índices de trigramas (pg_trgm). Cuando el texto está en una tabla de catálogo
+# se busca ahí y la tabla grande se filtra por clave, en lugar de aplicar el ILIKE después del JOIN.
+
+def contains_predicate(texto, column, lookup=None):
+    """
+    Predicado "`column` contiene todas las palabras de `texto`", como (sql, params), o None si
+    el texto está vacío. `lookup`: (columna_externa, tabla, clave) para resolver la búsqueda en
+    otra tabla, p. ej. contains_predicate(texto, "nombre", ("t.id_hospital", "hospital", "id"))
+    genera `t.id_hospital IN (SELECT id FROM hospital WHERE nombre ILIKE %s)`.
+    """
+    palabras = (texto or "").split()
+    if not palabras:
+        return None
+    sql = " AND ".join(f"{column} ILIKE %s" for _ in palabras)
+    params = [f"%{_like_escape(p)}%" for p in palabras]
+    if lookup is not None:
+        columna_externa, tabla, clave = lookup
+        sql = f"{columna_externa} IN (SELECT {clave} FROM {tabla} WHERE {sql})"
+    return sql, params
+
+
+def equals_predicate(column, value):
+    """Predicado `column = value` como (sql, params), o None si `value` está vacío."""
+    if value is None or value == "":
+        return None
+    return f"{column} = %s", [value]
+
+
+def where_clause(*predicates):
+    """
+    Une con AND los predicados de contains_predicate/equals_predicate (se ignoran los None).
+    Retorna (sql, params); `sql` empieza con " AND " para agregarlo después de un WHERE.
+    """
+    predicates = [p for p in predicates if p is not None]
+    sql = "".join(f" AND {clause}" for clause, _ in predicates)
+    params = [param for _, values in predicates for param in values]
+    return sql, params
+
+
+# --- RESUMEN DE DISPONIBILIDAD ---
+# Conteos de tejidos mantenidos por triggers en resumen_disponibilidad (migrations/0010_resumen_disponibilidad.sql)
+RESUMEN_COLUMNAS = ("id_hospital", "tipo", "estado", "tipo_sangre")
+# El resumen cambia con cada escritura en tejidos y con los cambios de grupo sanguíneo de un donante
+_RESUMEN_TABLAS = ("resumen_disponibilidad", "tejidos", "donante")
+
+
+def get_resumen_disponibilidad(conn=None, group_by=("estado", "tipo"), hospital_id=None, estados=None):
+    """
+    Cantidad de tejidos agrupada por `group_by` (columnas de RESUMEN_COLUMNAS, u "hospital"
+    para el nombre del hospital), leída del resumen en O(grupos) en lugar de contar tejidos.
+    `hospital_id` y `estados` filtran el resumen. Con `group_by` vacío retorna una sola fila
+    con el total. Retorna las columnas agrupadas y `cantidad`, sin grupos vacíos.
+    """
+    columnas, tablas = [], _RESUMEN_TABLAS
+    for col in group_by:
+        if col == "hospital":
+            columnas.append("h.nombre AS hospital")
+            tablas = _RESUMEN_TABLAS + ("hospital",)
+        elif col in RESUMEN_COLUMNAS:
+            columnas.append(f"r.{col}")
+        else:
+            raise ValueError(f"No se puede agrupar el resumen por {col!r}")
+    join = "JOIN hospital h ON h.id = r.id_hospital" if "hospital" in group_by else ""
+    filtros_sql, params = where_clause(
+        equals_predicate("r.id_hospital", hospital_id),
+        ("r.estado = ANY(%s)", [list(estados)]) if estados else None,
+    )
+    if columnas:
+        posiciones = ", ".join(str(i + 1) for i in range(len(columnas)))
+        query = f"""
+            SELECT {", ".join(columnas)}, SUM(r.cantidad)::bigint AS cantidad
+            FROM resumen_disponibilidad r {join}
+            WHERE TRUE {filtros_sql}
+            GROUP BY {posiciones}
+            HAVING SUM(r.cantidad) > 0
+            ORDER BY {posiciones}
+        """
+    else:
+        query = f"SELECT COALESCE(SUM(r.cantidad), 0)::bigint AS cantidad FROM resumen_disponibilidad r WHERE TRUE {filtros_sql}"
+    return cached_query(query, conn=conn, params=tuple(params), tables=tablas, typed=True)
+
+
+# --- HISTORIAL DE ESTADOS ---
+# Eventos escritos por trigger en tejidos_eventos (migrations/0011_tejidos_eventos.sql)
+_EVENTOS_TABLAS = ("tejidos_eventos", "tejidos", "hospital")
+
+
+def get_historial_tejido(tejido_id, desde=None, conn=None):
+    """
+    Timeline de estados de un tejido, del más antiguo al más reciente: ts, estado_anterior,
+    estado y hospital. `desde` (p. ej. su fecha de recolección) limita las particiones que se
+    recorren; sin él se consulta el índice de cada partición mensual.
+    """
+    filtros_sql, params = where_clause(
+        equals_predicate("e.tejido_id", int(tejido_id)),
+        ("e.ts >= %s", [desde]) if desde is not None else None,
+    )
+    query = f"""
+        SELECT e.ts, e.estado_anterior, e.estado, h.nombre AS hospital
+        FROM tejidos_eventos e
+        LEFT JOIN hospital h ON h.id = e.id_hospital
+        WHERE TRUE {filtros_sql}
+        ORDER BY e.ts
+    """
+    return cached_query(query, conn=conn, params=tuple(params), tables=_EVENTOS_TABLAS)
+
+
+def get_movimientos_hospital(hospital_id, conn=None, limit=50):
+    """Últimos `limit` eventos de los tejidos de un hospital, del más reciente al más antiguo."""
+    query = """
+        SELECT e.ts, e.tejido_id, e.estado_anterior, e.estado
+        FROM tejidos_eventos e
+        WHERE e.id_hospital = %s
+        ORDER BY e.ts DESC
+        LIMIT %s
+    """
+    return cached_query(query, conn=conn, params=(int(hospital_id), int(limit)), tables=_EVENTOS_TABLAS)
+
+
+# --- ARCHIVO HISTÓRICO ---
+# tejidos y solicitud se particionan en vigentes / archivo (migrations/0012_particiones_archivo.sql).
+# Las consultas de los portales filtran `NOT archivado` para recorrer solo la partición vigente.
+ARCHIVE_AFTER_DAYS = 365
+
+
+def archive_historicos(dias=ARCHIVE_AFTER_DAYS, conn=None, lote=5000):
+    """
+    Mueve a las particiones de archivo los tejidos en estado final y las solicitudes resueltas
+    de hace más de `dias` días, en lotes de `lote` filas por tabla (una transacción por lote).
+    Retorna un dict con las filas archivadas por tabla, o None si falló.
+    """
+    movidas = {"tejidos": 0, "solicitud": 0}
+    while True:
+        with transaction(conn) as tx:
+            lote_df = execute_query("SELECT tabla, filas FROM archivar_historicos(%s, %s)", conn, (int(dias), int(lote)))
+        if not tx.committed:
+            return None
+        filas = dict(zip(lote_df["tabla"], lote_df["filas"].astype(int)))
+        for tabla, n in filas.items():
+            movidas[tabla] += n
+        if max(filas.values(), default=0) < lote:
+            break
+    # La función se llama desde un SELECT: invalidar a mano lo que dependa de estas tablas
+    invalidate_tables("tejidos", "solicitud")
+    return movidas
+
+
+# --- RED DE HOSPITALES ---
+# Coordenadas e índice espacial: migrations/0003_hospital_coordenadas.sql
+_HOSPITALES_SQL = """
+    SELECT id, nombre AS name, direccion AS address, lat, lon
+    FROM hospital
+    WHERE lat IS NOT NULL AND lon IS NOT NULL
+    ORDER BY nombre
+"""
+
+
+def get_hospitales(conn=None):
+    """
+    Hospitales de la red con coordenadas: DataFrame con id, name, address, lat y lon.
+    Se guarda en el caché compartido; al registrar un hospital la escritura invalida la tabla.
+    """
+    return cached_query(_HOSPITALES_SQL, conn=conn, tables=("hospital",))
+
+
+def distancia_hospitales(origen_id, destino_id, conn=None):
+    """Distancia en línea recta (km) entre dos hospitales, o None si alguno no tiene coordenadas."""
+    fila = fetch_one("""
+        SELECT earth_distance(ll_to_earth(o.lat, o.lon), ll_to_earth(d.lat, d.lon)) / 1000 AS distancia_km
+        FROM hospital o, hospital d
+        WHERE o.id = %s AND d.id = %s
+          AND o.lat IS NOT NULL AND o.lon IS NOT NULL AND d.lat IS NOT NULL AND d.lon IS NOT NULL
+    """, conn=conn, params=(int(origen_id), int(destino_id)))
+    return None if fila is None else float(fila.distancia_km)
+
+
+def fuentes_cercanas(hospital_id, conn=None, estados=("Disponible",)):
+    """
+    Para cada tipo de tejido, el hospital más cercano a `hospital_id` que tiene stock en `estados`.
+    Por tipo es una búsqueda KNN con el índice GiST limitada a los hospitales con stock (leído
+    del resumen de disponibilidad). Retorna tipo, hospital, disponibles y distancia_km,
+    ordenados por distancia.
+    """
+    query = """
+        WITH ref AS (
+            SELECT ll_to_earth(lat, lon) AS punto
+            FROM hospital
+            WHERE id = %(hospital_id)s AND lat IS NOT NULL AND lon IS NOT NULL
+        ),
+        stock AS (
+            SELECT id_hospital, tipo, SUM(cantidad)::bigint AS disponibles
+            FROM resumen_disponibilidad
+            WHERE estado = ANY(%(estados)s) AND id_hospital IS NOT NULL AND tipo IS NOT NULL
+            GROUP BY id_hospital, tipo
+            HAVING SUM(cantidad) > 0
+        )
+        SELECT t.tipo, c.hospital, c.disponibles, c.distancia_km
+        FROM (SELECT DISTINCT tipo FROM stock) t
+        CROSS JOIN ref
+        CROSS JOIN LATERAL (
+            SELECT h.nombre AS hospital, s.disponibles,
+                   earth_distance(ref.punto, ll_to_earth(h.lat, h.lon)) / 1000 AS distancia_km
+            FROM hospital h
+            JOIN stock s ON s.id_hospital = h.id AND s.tipo = t.tipo
+            WHERE h.lat IS NOT NULL AND h.lon IS NOT NULL
+            ORDER BY ll_to_earth(h.lat, h.lon) <-> ref.punto
+            LIMIT 1
+        ) c
+        ORDER BY c.distancia_km, t.tipo
+    """
+    params = {"hospital_id": int(hospital_id), "estados": list(estados)}
+    return cached_query(query, conn=conn, params=params, tables=_RESUMEN_TABLAS + ("hospital",), typed=True)
+
+
+def hospitales_cercanos(lat, lon, conn=None, k=10, radius_km=None):
+    """
+    Hospitales más cercanos a un punto, resueltos en Postgres con el índice GiST de
+    earthdistance: los `k` más cercanos o, si se indica `radius_km`, los que están dentro
+    del radio (hasta `k`). Retorna id, name, address, lat, lon y distancia_km, ordenados por distancia.
+    """
+    filtro_radio = ""
+    if radius_km is not None:
+        # earth_box usa el índice; earth_distance descarta las esquinas de la caja
+        filtro_radio = """
+          AND earth_box(ll_to_earth(%(lat)s, %(lon)s), %(radio_m)s) @> ll_to_earth(lat, lon)
+          AND earth_distance(ll_to_earth(%(lat)s, %(lon)s), ll_to_earth(lat, lon)) <= %(radio_m)s
+        """
+    query = f"""
+        SELECT id, nombre AS name, direccion AS address, lat, lon,
+               earth_distance(ll_to_earth(%(lat)s, %(lon)s), ll_to_earth(lat, lon)) / 1000 AS distancia_km
+        FROM hospital
+        WHERE lat IS NOT NULL AND lon IS NOT NULL {filtro_radio}
+        ORDER BY ll_to_earth(lat, lon) <-> ll_to_earth(%(lat)s, %(lon)s)
+        LIMIT %(k)s
+    """
+    params = {"lat": float(lat), "lon": float(lon), "k": int(k),
+              "radio_m": None if radius_km is None else float(radius_km) * 1000}
+    return cached_query(query, conn=conn, params=params, tables=("hospital",), typed=True)
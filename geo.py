@@ -0,0 +1,24 @@
+# geo.py
+# Distancias vectorizadas entre conjuntos de puntos (las usa allocation.allocate).
+# Las consultas de la red (k más cercanos, radio y fuente más cercana por tipo de tejido) se
+# resuelven en Postgres con el índice de earthdistance: hospitales_cercanos, fuentes_cercanas y
+# distancia_hospitales en functions.py. Así no se arma una matriz N x N por proceso.
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371  # Radio de la Tierra en km
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2):
+    """
+    Distancias haversine (en km) entre todos los pares de dos conjuntos de puntos.
+    `lat1`, `lon1`: coordenadas de los N orígenes. `lat2`, `lon2`: coordenadas de los M destinos.
+    Retorna una matriz NumPy de N x M calculada en una sola pasada vectorizada.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=float))[:, None]
+    lon1 = np.radians(np.asarray(lon1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(lat2, dtype=float))[None, :]
+    lon2 = np.radians(np.asarray(lon2, dtype=float))[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
@@ -0,0 +1,200 @@
+# intake.py
+
+import io
+from datetime import datetime
+import pandas as pd
+import streamlit as st
+from functions import connect_to_supabase, invalidate_tables, measure_query
+from allocation import BLOOD_TYPES
+
+# --- CARGA MASIVA DE TEJIDOS ---
+# Columnas del archivo. Las de donante nuevo solo hacen falta si el DNI no está registrado.
+REQUIRED_COLUMNS = ["tipo", "dni_donante", "dni_medico", "fecha_recoleccion"]
+OPTIONAL_COLUMNS = ["estado", "condicion_recoleccion", "nombre_donante", "apellido_donante", "sexo", "tipo_sangre"]
+NEW_DONOR_COLUMNS = ["nombre_donante", "apellido_donante", "sexo", "tipo_sangre"]
+INTAKE_STATES = ["Disponible", "En Cuarentena"]
+SEXOS = ["Masculino", "Femenino"]
+DONOR_COLUMNS = ["nombre", "apellido", "dni", "sexo", "tipo_sangre"]
+
+
+def intake_template():
+    """Planilla de ejemplo (CSV) con las columnas que acepta la carga masiva."""
+    ejemplo = pd.DataFrame([{
+        "tipo": "PIEL", "dni_donante": 30123456, "dni_medico": 25123456, "fecha_recoleccion": "2025-01-31",
+        "estado": "Disponible", "condicion_recoleccion": "óptima", "nombre_donante": "Juan",
+        "apellido_donante": "Pérez", "sexo": "Masculino", "tipo_sangre": "O+",
+    }], columns=REQUIRED_COLUMNS + OPTIONAL_COLUMNS)
+    return ejemplo.to_csv(index=False)
+
+
+def read_intake_file(uploaded_file):
+    """
+    Lee un CSV o Excel subido con st.file_uploader. Las columnas se leen como texto, salvo las
+    celdas de fecha de Excel, que llegan como fechas y no dependen del formato regional.
+    """
+    if uploaded_file.name.lower().endswith((".xlsx", ".xls")):
+        df = pd.read_excel(uploaded_file, dtype=object)
+        df = df.apply(lambda col: col.map(lambda v: v if pd.isna(v) or isinstance(v, datetime) else str(v)))
+    else:
+        df = pd.read_csv(uploaded_file, dtype=str, sep=None, engine="python")
+    df.columns = [str(c).strip().lower() for c in df.columns]
+    return df
+
+
+def _dni(values):
+    return pd.to_numeric(values, errors="coerce").astype("Int64")
+
+
+def _fechas(values):
+    """
+    Fechas de recolección: primero ISO 8601 (AAAA-MM-DD, el formato de la planilla de ejemplo y
+    el de las celdas de fecha de Excel) y solo las que no lo son, con el día primero (DD/MM/AAAA).
+    """
+    fechas = pd.to_datetime(values, errors="coerce", format="ISO8601")
+    resto = fechas.isna() & values.notna()
+    if resto.any():
+        fechas[resto] = pd.to_datetime(values[resto], errors="coerce", format="mixed", dayfirst=True)
+    return fechas
+
+
+def referenced_dnis(df, column):
+    """DNIs válidos y distintos de una columna del archivo, para buscar solo esas personas."""
+    if column not in df.columns:
+        return []
+    return _dni(df[column]).dropna().unique().tolist()
+
+
+def _ids_por_dni(df):
+    """Serie id indexada por DNI, para traducir DNIs a ids con un solo `map`."""
+    return df.assign(dni=_dni(df["dni"])).drop_duplicates("dni").set_index("dni")["id"]
+
+
+def validate_intake(df, tipos, medicos, donantes, today=None):
+    """
+    Valida en bloque (sin recorrer filas) un archivo de carga masiva.
+    `tipos`, `medicos`, `donantes`: DataFrames de detalles_tejido (tipo), medico (id, dni)
+    y donante (id, dni) contra los que se comprueban las referencias.
+
+    Retorna (validos, rechazados). `validos` tiene las columnas listas para cargar,
+    incluidos id_medico e id_donante (nulo si es un donante nuevo). `rechazados` es el
+    archivo original de las filas con errores, con su número de fila y el motivo.
+    """
+    today = pd.Timestamp.now().normalize() if today is None else pd.Timestamp(today)
+    faltantes = [c for c in REQUIRED_COLUMNS if c not in df.columns]
+    if faltantes:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(faltantes)}")
+
+    data = df.reindex(columns=REQUIRED_COLUMNS + OPTIONAL_COLUMNS).astype("string")
+    texto = data.apply(lambda col: col.str.strip()).replace("", pd.NA)
+    # Código de tipo tal como está en detalles_tejido, sin importar mayúsculas en el archivo
+    codigos = pd.Series(tipos["tipo"].to_numpy(), index=tipos["tipo"].str.upper())
+    data["tipo"] = texto["tipo"].str.upper().map(codigos[~codigos.index.duplicated()])
+    data["estado"] = texto["estado"].fillna(INTAKE_STATES[0])
+    data["condicion_recoleccion"] = texto["condicion_recoleccion"]
+    for col in NEW_DONOR_COLUMNS:
+        data[col] = texto[col]
+    data["tipo_sangre"] = data["tipo_sangre"].str.upper()
+    data["dni_donante"] = _dni(texto["dni_donante"])
+    data["dni_medico"] = _dni(texto["dni_medico"])
+    data["fecha_recoleccion"] = _fechas(texto["fecha_recoleccion"])
+
+    data["id_medico"] = data["dni_medico"].map(_ids_por_dni(medicos))
+    data["id_donante"] = data["dni_donante"].map(_ids_por_dni(donantes))
+    donante_nuevo = data["id_donante"].isna() & data["dni_donante"].notna()
+
+    reglas = [
+        (data["tipo"].isna(), "Tipo de tejido desconocido"),
+        (data["dni_medico"].isna(), "DNI de médico inválido"),
+        (data["dni_medico"].notna() & data["id_medico"].isna(), "Médico no registrado"),
+        (data["fecha_recoleccion"].isna(), "Fecha de recolección inválida"),
+        (data["fecha_recoleccion"] > today, "Fecha de recolección futura"),
+        (~data["estado"].isin(INTAKE_STATES), f"Estado inválido (use {' o '.join(INTAKE_STATES)})"),
+        (data["dni_donante"].isna(), "DNI de donante inválido"),
+        (donante_nuevo & data[NEW_DONOR_COLUMNS].isna().any(axis=1),
+         "Donante no registrado: faltan nombre, apellido, sexo o tipo de sangre"),
+        (donante_nuevo & data["sexo"].notna() & ~data["sexo"].isin(SEXOS), "Sexo inválido"),
+        (donante_nuevo & data["tipo_sangre"].notna() & ~data["tipo_sangre"].isin(BLOOD_TYPES), "Tipo de sangre inválido"),
+    ]
+    motivo = pd.Series("", index=data.index)
+    for mask, texto_motivo in reglas:
+        mask = mask.fillna(False).astype(bool)
+        motivo[mask] = motivo[mask] + "; " + texto_motivo
+    motivo = motivo.str.lstrip("; ")
+    rechazada = motivo != ""
+
+    rechazados = df[rechazada].copy()
+    rechazados.insert(0, "fila", rechazados.index + 2)  # fila 1: encabezados
+    rechazados["motivo"] = motivo[rechazada]
+    return data[~rechazada].reset_index(drop=True), rechazados.reset_index(drop=True)
+
+
+def _copy(cur, table, columns, df):
+    buffer = io.StringIO()
+    df[columns].to_csv(buffer, header=False, index=False, date_format="%Y-%m-%d")
+    buffer.seek(0)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    with measure_query(sql) as medida:
+        cur.copy_expert(sql, buffer)
+        medida["filas"], medida["bytes"] = max(cur.rowcount, 0), buffer.tell()
+
+
+def load_intake(validos, hospital_id, conn=None):
+    """
+    Carga las filas validadas en una sola transacción usando COPY FROM STDIN:
+    primero los donantes nuevos y luego todos los tejidos. Si algo falla no se carga nada.
+    Retorna un dict con la cantidad de tejidos y donantes nuevos cargados, o None si falló.
+    """
+    if validos.empty:
+        return {"tejidos": 0, "donantes": 0}
+    _conn = conn
+    if _conn is None:
+        _conn = connect_to_supabase()
+        if _conn is None:
+            return None
+
+    validos = validos.copy()
+    nuevos = validos[validos["id_donante"].isna()].drop_duplicates("dni_donante").rename(columns={
+        "nombre_donante": "nombre", "apellido_donante": "apellido", "dni_donante": "dni"
+    })
+    try:
+        with _conn.cursor() as cur:
+            if not nuevos.empty:
+                # donante.dni no es único: los ids salen del RETURNING de las filas insertadas,
+                # no de buscar por DNI, que podría devolver otro donante con el mismo DNI
+                cur.execute(
+                    "CREATE TEMP TABLE donantes_carga (nombre text, apellido text, dni bigint, sexo text, tipo_sangre text) "
+                    "ON COMMIT DROP"
+                )
+                _copy(cur, "donantes_carga", DONOR_COLUMNS, nuevos)
+                sql = f"""
+                    INSERT INTO donante ({", ".join(DONOR_COLUMNS)})
+                    SELECT {", ".join(DONOR_COLUMNS)} FROM donantes_carga
+                    RETURNING dni, id
+                """
+                with measure_query(sql) as medida:
+                    cur.execute(sql)
+                    ids_nuevos = dict(cur.fetchall())
+                    medida["filas"] = len(ids_nuevos)
+                faltan = validos["id_donante"].isna()
+                validos.loc[faltan, "id_donante"] = validos.loc[faltan, "dni_donante"].astype(int).map(ids_nuevos)
+
+            # Misma marca de tiempo que NOW() para todas las filas de la transacción
+            cur.execute("SELECT now()")
+            validos["fecha_de_estado"] = cur.fetchone()[0].isoformat()
+            validos["id_hospital"] = hospital_id
+            validos["id_donante"] = validos["id_donante"].astype("Int64")
+            validos["id_medico"] = validos["id_medico"].astype("Int64")
+            _copy(cur, "tejidos", ["tipo", "id_donante", "id_medico", "id_hospital", "fecha_recoleccion",
+                                   "condicion_recoleccion", "estado", "fecha_de_estado"], validos)
+        _conn.commit()
+    except Exception as e:
+        st.error(f"Error en la carga masiva, no se registró ningún tejido: {e}")
+        _conn.rollback()
+        return None
+    finally:
+        if conn is None and _conn is not None:
+            _conn.close()
+
+    # COPY no pasa por execute_query: invalidar a mano las consultas cacheadas
+    invalidate_tables("tejidos", "donante")
+    return {"tejidos": len(validos), "donantes": len(nuevos)}
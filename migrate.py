@@ -0,0 +1,215 @@
+# migrate.py
+
+"""
+Aplica en orden las migraciones de `migrations/` que todavía no se aplicaron y registra
+cada una en la tabla schema_migrations. La app lo ejecuta al arrancar (ver ensure_schema
+en functions.py) y también se puede usar desde la línea de comandos:
+
+    python migrate.py              # aplica las pendientes
+    python migrate.py status       # aplicadas, pendientes y modificadas desde que se aplicaron
+    python migrate.py up --dry-run # muestra lo que aplicaría sin tocar la base
+    python migrate.py baseline 0014 # registra hasta la 0014 como aplicadas, sin ejecutarlas
+"""
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+import time
+from collections import namedtuple
+from pathlib import Path
+import psycopg2
+import psycopg2.extensions
+from dotenv import load_dotenv
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent / "migrations"
+_FILENAME_RE = re.compile(r"^(\d{4})_(\w+)\.sql$")
+# El runner envuelve cada archivo en una transacción junto con su registro: no pueden tener la suya
+_TRANSACTION_RE = re.compile(r"^\s*(BEGIN|START\s+TRANSACTION|COMMIT|ROLLBACK)\s*;", re.IGNORECASE | re.MULTILINE)
+
+Migration = namedtuple("Migration", ["version", "nombre", "path", "checksum"])
+
+
+class MigrationError(RuntimeError):
+    """Una migración falló. Sus cambios se revirtieron y las siguientes no se aplicaron."""
+
+    def __init__(self, migration, error):
+        super().__init__(f"La migración {migration.version}_{migration.nombre} falló: {error}")
+        self.migration = migration
+        self.error = error
+
+
+def discover(directory=MIGRATIONS_DIR):
+    """Migraciones `NNNN_nombre.sql` de `directory`, ordenadas por versión."""
+    migrations = {}
+    for path in sorted(Path(directory).glob("*.sql")):
+        match = _FILENAME_RE.match(path.name)
+        if match is None:
+            continue
+        version, nombre = match.groups()
+        if version in migrations:
+            raise ValueError(f"Hay dos migraciones con la versión {version}: {migrations[version].path.name} y {path.name}")
+        contenido = path.read_bytes()
+        if _TRANSACTION_RE.search(contenido.decode("utf-8")):
+            raise ValueError(f"{path.name} tiene su propio BEGIN/COMMIT; el runner ya aplica cada migración en una transacción")
+        checksum = hashlib.sha256(contenido).hexdigest()
+        migrations[version] = Migration(version, nombre, path, checksum)
+    return [migrations[v] for v in sorted(migrations)]
+
+
+def _ensure_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version text PRIMARY KEY,
+            nombre text NOT NULL,
+            checksum text NOT NULL,
+            aplicada_en timestamptz NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def status(conn, directory=MIGRATIONS_DIR):
+    """
+    Estado de cada migración: 'aplicada', 'pendiente' o 'modificada' (el archivo cambió
+    después de aplicarse). Retorna una lista de dicts con version, nombre, estado y aplicada_en.
+    """
+    with conn.cursor() as cur:
+        _ensure_table(cur)
+        cur.execute("SELECT version, checksum, aplicada_en FROM schema_migrations")
+        aplicadas = {version: (checksum, fecha) for version, checksum, fecha in cur.fetchall()}
+    conn.commit()
+
+    filas = []
+    for m in discover(directory):
+        checksum, fecha = aplicadas.get(m.version, (None, None))
+        if checksum is None:
+            estado = "pendiente"
+        elif checksum != m.checksum:
+            estado = "modificada"
+        else:
+            estado = "aplicada"
+        filas.append({"version": m.version, "nombre": m.nombre, "estado": estado, "aplicada_en": fecha})
+    return filas
+
+
+def apply_migrations(conn, directory=MIGRATIONS_DIR, dry_run=False, log=print):
+    """
+    Aplica las migraciones pendientes, cada una en su propia transacción junto con su registro
+    en schema_migrations: si falla, no queda aplicada a medias y se lanza MigrationError.
+    Un advisory lock evita que dos procesos que arrancan a la vez apliquen la misma migración.
+    Retorna la lista de migraciones aplicadas (o que se aplicarían, con `dry_run`).
+    """
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+    autocommit = conn.autocommit
+    # Cada archivo se envía como una sola cadena junto con su registro: Postgres la ejecuta
+    # en una única transacción implícita (discover rechaza archivos con BEGIN/COMMIT propios)
+    conn.autocommit = True
+    aplicadas = []
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_lock(hashtext('schema_migrations'))")
+            try:
+                _ensure_table(cur)
+                cur.execute("SELECT version, checksum FROM schema_migrations")
+                registradas = dict(cur.fetchall())
+                for m in discover(directory):
+                    if m.version in registradas:
+                        if registradas[m.version] != m.checksum:
+                            log(f"Aviso: {m.path.name} cambió después de aplicarse; no se vuelve a aplicar.")
+                        continue
+                    if dry_run:
+                        log(f"Pendiente: {m.path.name}")
+                        aplicadas.append(m)
+                        continue
+                    registro = cur.mogrify(
+                        "INSERT INTO schema_migrations (version, nombre, checksum) VALUES (%s, %s, %s)",
+                        (m.version, m.nombre, m.checksum),
+                    ).decode()
+                    inicio = time.monotonic()
+                    try:
+                        cur.execute(m.path.read_text(encoding="utf-8") + "\n;\n" + registro)
+                    except psycopg2.Error as e:
+                        raise MigrationError(m, e) from e
+                    log(f"Aplicada: {m.path.name} ({time.monotonic() - inicio:.1f} s)")
+                    aplicadas.append(m)
+            finally:
+                cur.execute("SELECT pg_advisory_unlock(hashtext('schema_migrations'))")
+    finally:
+        conn.autocommit = autocommit
+    return aplicadas
+
+
+def baseline(conn, hasta, directory=MIGRATIONS_DIR, log=print):
+    """
+    Registra como aplicadas, sin ejecutarlas, las migraciones hasta la versión `hasta` inclusive.
+    Para bases en las que los scripts se aplicaron a mano antes de existir el runner.
+    Retorna la lista de migraciones registradas.
+    """
+    registradas = []
+    with conn.cursor() as cur:
+        _ensure_table(cur)
+        for m in discover(directory):
+            if m.version > hasta:
+                break
+            cur.execute(
+                "INSERT INTO schema_migrations (version, nombre, checksum) VALUES (%s, %s, %s) "
+                "ON CONFLICT (version) DO NOTHING",
+                (m.version, m.nombre, m.checksum),
+            )
+            if cur.rowcount:
+                log(f"Registrada sin ejecutar: {m.path.name}")
+                registradas.append(m)
+    conn.commit()
+    return registradas
+
+
+def _connect_from_env():
+    load_dotenv()
+    settings = {
+        "host": os.getenv("SUPABASE_DB_HOST"),
+        "database": os.getenv("SUPABASE_DB_NAME"),
+        "user": os.getenv("SUPABASE_DB_USER"),
+        "password": os.getenv("SUPABASE_DB_PASSWORD"),
+        "port": os.getenv("SUPABASE_DB_PORT"),
+    }
+    faltantes = [k for k, v in settings.items() if not v]
+    if faltantes:
+        raise SystemExit(f"Faltan variables de conexión en el entorno o en .env: {', '.join(faltantes)}")
+    return psycopg2.connect(sslmode="require", **settings)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Migraciones de la base de datos del banco de tejidos.")
+    parser.add_argument("comando", nargs="?", choices=["up", "status", "baseline"], default="up")
+    parser.add_argument("version", nargs="?", help="Con baseline: última versión ya aplicada a mano (p. ej. 0014)")
+    parser.add_argument("--dry-run", action="store_true", help="Muestra las migraciones pendientes sin aplicarlas")
+    args = parser.parse_args(argv)
+    if args.comando == "baseline" and not (args.version and re.fullmatch(r"\d{4}", args.version)):
+        parser.error("baseline necesita la última versión aplicada, con cuatro dígitos (p. ej. 0014)")
+
+    conn = _connect_from_env()
+    try:
+        if args.comando == "status":
+            for fila in status(conn):
+                fecha = fila["aplicada_en"].strftime("%Y-%m-%d %H:%M") if fila["aplicada_en"] else ""
+                print(f"{fila['version']}  {fila['estado']:<10}  {fecha:<16}  {fila['nombre']}")
+            return 0
+        if args.comando == "baseline":
+            if not baseline(conn, args.version):
+                print("No había migraciones por registrar.")
+            return 0
+        aplicadas = apply_migrations(conn, dry_run=args.dry_run)
+        if not aplicadas:
+            print("La base está al día.")
+        return 0
+    except MigrationError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,56 @@
+-- 0000_esquema_base.sql
+-- Tablas que usa la app, tal como estaban antes de las migraciones siguientes (que agregan
+-- columnas, índices, triggers y el particionado). En una base existente no cambia nada.
+
+CREATE TABLE IF NOT EXISTS hospital (
+    id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    nombre text NOT NULL,
+    direccion text,
+    -- Sin teléfono ni clave el hospital forma parte de la red pero no puede iniciar sesión
+    telefono text,
+    password text
+);
+
+CREATE TABLE IF NOT EXISTS medico (
+    id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    nombre text NOT NULL,
+    apellido text NOT NULL,
+    dni bigint NOT NULL,
+    password text NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS donante (
+    id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    nombre text NOT NULL,
+    apellido text NOT NULL,
+    dni bigint NOT NULL,
+    sexo text,
+    tipo_sangre text
+);
+
+CREATE TABLE IF NOT EXISTS detalles_tejido (
+    tipo text PRIMARY KEY,
+    descripcion text
+);
+
+CREATE TABLE IF NOT EXISTS tejidos (
+    id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    tipo text REFERENCES detalles_tejido (tipo),
+    id_donante integer REFERENCES donante (id),
+    id_medico integer REFERENCES medico (id),
+    id_hospital integer REFERENCES hospital (id),
+    fecha_recoleccion date,
+    condicion_recoleccion text,
+    estado text NOT NULL DEFAULT 'Disponible',
+    fecha_de_estado timestamptz DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS solicitud (
+    id integer GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    medico_id integer NOT NULL REFERENCES medico (id),
+    tipo text,
+    -- Nombre del hospital destino (0013 agrega hospital_id)
+    ubicacion text,
+    estado text NOT NULL DEFAULT 'pendiente',
+    fecha_solicitud timestamptz NOT NULL DEFAULT now()
+);
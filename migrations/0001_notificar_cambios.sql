@@ -0,0 +1,38 @@
+-- 0001_notificar_cambios.sql
+-- Notificaciones LISTEN/NOTIFY ante cambios en tejidos y solicitud.
+-- Cada fila modificada emite un NOTIFY en el canal `cambios_<tabla>` con un payload JSON
+-- (tabla, operación, id y, si existen, id_hospital / ubicacion). La app escucha estos
+-- canales para invalidar su caché y refrescar las sesiones afectadas.
+
+CREATE OR REPLACE FUNCTION notificar_cambio() RETURNS trigger AS $$
+DECLARE
+    fila jsonb;
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        fila := to_jsonb(OLD);
+    ELSE
+        fila := to_jsonb(NEW);
+    END IF;
+    PERFORM pg_notify(
+        'cambios_' || TG_TABLE_NAME,
+        jsonb_build_object(
+            'tabla', TG_TABLE_NAME,
+            'op', TG_OP,
+            'id', fila -> 'id',
+            'id_hospital', fila -> 'id_hospital',
+            'ubicacion', fila -> 'ubicacion'
+        )::text
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tejidos_notificar_cambio ON tejidos;
+CREATE TRIGGER tejidos_notificar_cambio
+    AFTER INSERT OR UPDATE OR DELETE ON tejidos
+    FOR EACH ROW EXECUTE FUNCTION notificar_cambio();
+
+DROP TRIGGER IF EXISTS solicitud_notificar_cambio ON solicitud;
+CREATE TRIGGER solicitud_notificar_cambio
+    AFTER INSERT OR UPDATE OR DELETE ON solicitud
+    FOR EACH ROW EXECUTE FUNCTION notificar_cambio();
@@ -0,0 +1,10 @@
+-- 0002_aprobacion_atomica.sql
+-- Soporte para la aprobación de solicitudes en una única sentencia (ver approve_solicitud en functions.py).
+
+-- Tejido reservado al aprobar la solicitud
+ALTER TABLE solicitud ADD COLUMN IF NOT EXISTS tejido_reservado_id integer;
+
+-- Búsqueda del tejido disponible más antiguo de un tipo en un hospital
+CREATE INDEX IF NOT EXISTS tejidos_disponibles_idx
+    ON tejidos (id_hospital, tipo, fecha_recoleccion, id)
+    WHERE estado = 'Disponible';
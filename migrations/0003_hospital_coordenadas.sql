@@ -0,0 +1,55 @@
+-- 0003_hospital_coordenadas.sql
+-- Coordenadas de los hospitales en la base de datos, con índice espacial para búsquedas
+-- por radio y de vecinos más cercanos (ver get_hospitales y hospitales_cercanos en functions.py).
+
+CREATE EXTENSION IF NOT EXISTS cube;
+CREATE EXTENSION IF NOT EXISTS earthdistance;
+
+ALTER TABLE hospital ADD COLUMN IF NOT EXISTS lat double precision;
+ALTER TABLE hospital ADD COLUMN IF NOT EXISTS lon double precision;
+
+-- Índice GiST sobre el punto en la esfera: sirve para earth_box (radio) y para ORDER BY <-> (más cercanos)
+CREATE INDEX IF NOT EXISTS hospital_ubicacion_idx
+    ON hospital USING gist (ll_to_earth(lat, lon))
+    WHERE lat IS NOT NULL AND lon IS NOT NULL;
+
+-- Carga inicial: los hospitales que antes estaban fijos en el código de los portales.
+-- Los que ya existen (por nombre) reciben sus coordenadas; los que faltan se agregan a la
+-- red sin teléfono ni clave, de modo que aparecen en el mapa pero no pueden iniciar sesión.
+DO $$
+DECLARE
+    h record;
+BEGIN
+    FOR h IN
+        SELECT * FROM (VALUES
+            ('Hospital Italiano', 'Tte. Gral. Juan Domingo Perón 4190, CABA', -34.6066, -58.4250),
+            ('Hospital Alemán', 'Av. Pueyrredón 1640, CABA', -34.5938, -58.4033),
+            ('Hospital Británico', 'Perdriel 74, CABA', -34.6284, -58.3840),
+            ('Hospital Garrahan', 'Pichincha 1890, CABA', -34.6293, -58.3908),
+            ('Hospital Fernández', 'Av. Cerviño 3356, CABA', -34.5822, -58.4111),
+            ('Hospital de Clínicas', 'Av. Córdoba 2351, CABA', -34.5989, -58.4005),
+            ('Sanatorio Güemes', 'Francisco Acuña de Figueroa 1240, CABA', -34.5983, -58.4214),
+            ('FLENI', 'Montañeses 2325, CABA', -34.5501, -58.4485),
+            ('Hospital Austral', 'Av. J. D. Perón 1500, Pilar', -34.4528, -58.9133),
+            ('Hospital Argerich', 'Pi y Margall 750, CABA', -34.6241, -58.3662),
+            ('Hospital Rivadavia', 'Av. Gral. Las Heras 2670, CABA', -34.5880, -58.3990),
+            ('Hospital Durand', 'Av. Díaz Vélez 5044, CABA', -34.6112, -58.4442),
+            ('Hospital Santojanni', 'Pilar 950, CABA', -34.6465, -58.5134),
+            ('Sanatorio Finochietto', 'Av. Córdoba 2678, CABA', -34.6043, -58.4045),
+            ('Fundación Favaloro', 'Av. Belgrano 1746, CABA', -34.6120, -58.3900)
+        ) AS v (nombre, direccion, lat, lon)
+    LOOP
+        UPDATE hospital
+        SET lat = h.lat, lon = h.lon, direccion = COALESCE(direccion, h.direccion)
+        WHERE nombre = h.nombre AND lat IS NULL;
+
+        IF NOT EXISTS (SELECT 1 FROM hospital WHERE nombre = h.nombre) THEN
+            BEGIN
+                INSERT INTO hospital (nombre, direccion, lat, lon) VALUES (h.nombre, h.direccion, h.lat, h.lon);
+            EXCEPTION WHEN not_null_violation THEN
+                RAISE NOTICE 'No se pudo agregar % (columnas obligatorias sin valor); cargue sus coordenadas al darlo de alta.', h.nombre;
+            END;
+        END IF;
+    END LOOP;
+END
+$$;
@@ -0,0 +1,17 @@
+-- 0004_credenciales.sql
+-- Inicio de sesión en una sola consulta para médicos y hospitales (ver authenticate_user en Inicio.py).
+
+-- Índices de búsqueda por identificador de usuario. Las expresiones ::text coinciden con
+-- la columna `identificador` de la vista, así cada rama del UNION ALL usa su índice.
+CREATE UNIQUE INDEX IF NOT EXISTS medico_dni_login_idx ON medico ((dni::text));
+CREATE UNIQUE INDEX IF NOT EXISTS hospital_telefono_login_idx ON hospital ((telefono::text));
+
+-- Credenciales de ambos roles con el mismo formato. Se recrea en lugar de CREATE OR REPLACE:
+-- en una base donde ya corrieron 0005/0006 la vista tiene más columnas y no se pueden quitar.
+DROP VIEW IF EXISTS credenciales;
+CREATE VIEW credenciales AS
+    SELECT 'Médico'::text AS rol, id, dni::text AS identificador, nombre, password
+    FROM medico
+    UNION ALL
+    SELECT 'Hospital'::text AS rol, id, telefono::text AS identificador, nombre, password
+    FROM hospital;
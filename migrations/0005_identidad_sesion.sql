@@ -0,0 +1,21 @@
+-- 0005_identidad_sesion.sql
+-- Invalidación de las identidades de sesión cacheadas (ver IdentityCache en functions.py).
+
+-- Cambios en los perfiles: mismo formato de NOTIFY que 0001_notificar_cambios.sql
+DROP TRIGGER IF EXISTS medico_notificar_cambio ON medico;
+CREATE TRIGGER medico_notificar_cambio
+    AFTER UPDATE OR DELETE ON medico
+    FOR EACH ROW EXECUTE FUNCTION notificar_cambio();
+
+DROP TRIGGER IF EXISTS hospital_notificar_cambio ON hospital;
+CREATE TRIGGER hospital_notificar_cambio
+    AFTER INSERT OR UPDATE OR DELETE ON hospital
+    FOR EACH ROW EXECUTE FUNCTION notificar_cambio();
+
+-- El login devuelve también el apellido, que se guarda en la identidad de la sesión
+CREATE OR REPLACE VIEW credenciales AS
+    SELECT 'Médico'::text AS rol, id, dni::text AS identificador, nombre, password, apellido::text AS apellido
+    FROM medico
+    UNION ALL
+    SELECT 'Hospital'::text AS rol, id, telefono::text AS identificador, nombre, password, NULL::text AS apellido
+    FROM hospital;
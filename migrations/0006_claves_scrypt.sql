@@ -0,0 +1,16 @@
+-- 0006_claves_scrypt.sql
+-- Hashes scrypt con sal (`scrypt$n$r$p$sal$hash`, ver credentials.py). Son más largos que los
+-- SHA-256 anteriores, que se reemplazan al iniciar sesión.
+
+-- La vista depende de las columnas: se recrea alrededor del cambio de tipo
+DROP VIEW IF EXISTS credenciales;
+
+ALTER TABLE medico ALTER COLUMN password TYPE text;
+ALTER TABLE hospital ALTER COLUMN password TYPE text;
+
+CREATE VIEW credenciales AS
+    SELECT 'Médico'::text AS rol, id, dni::text AS identificador, nombre, password, apellido::text AS apellido
+    FROM medico
+    UNION ALL
+    SELECT 'Hospital'::text AS rol, id, telefono::text AS identificador, nombre, password, NULL::text AS apellido
+    FROM hospital;
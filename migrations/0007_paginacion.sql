@@ -0,0 +1,4 @@
+-- 0007_paginacion.sql
+-- Paginación por clave del inventario de cada hospital (ver keyset_page en functions.py):
+-- WHERE id_hospital = ... AND id < ... ORDER BY id DESC LIMIT n se resuelve recorriendo este índice.
+CREATE INDEX IF NOT EXISTS tejidos_hospital_id_idx ON tejidos (id_hospital, id);
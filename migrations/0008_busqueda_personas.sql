@@ -0,0 +1,18 @@
+-- 0008_busqueda_personas.sql
+-- Búsqueda incremental de donantes y médicos en el formulario de registro (ver buscar_personas
+-- en functions.py). Las expresiones indexadas tienen que coincidir con las de la consulta.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Nombre completo: ILIKE '%texto%' por cada palabra buscada se resuelve con el índice de trigramas
+CREATE INDEX IF NOT EXISTS donante_nombre_trgm_idx
+    ON donante USING gin ((nombre || ' ' || apellido) gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS medico_nombre_trgm_idx
+    ON medico USING gin ((nombre || ' ' || apellido) gin_trgm_ops);
+
+-- DNI por prefijo: LIKE '123%' solo usa un btree con text_pattern_ops (independiente de la collation)
+CREATE INDEX IF NOT EXISTS donante_dni_prefijo_idx ON donante ((dni::text) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS medico_dni_prefijo_idx ON medico ((dni::text) text_pattern_ops);
+
+-- Búsqueda exacta por DNI de la carga masiva (personas_por_dni)
+CREATE INDEX IF NOT EXISTS donante_dni_idx ON donante (dni);
@@ -0,0 +1,15 @@
+-- 0009_busqueda_tejidos.sql
+-- Filtros de texto de "Ver Tejidos" en el portal médico (ver contains_predicate en functions.py):
+-- el texto se busca en los catálogos con índices de trigramas y tejidos se filtra por clave.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS detalles_tejido_tipo_trgm_idx
+    ON detalles_tejido USING gin (tipo gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS detalles_tejido_descripcion_trgm_idx
+    ON detalles_tejido USING gin (descripcion gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS hospital_nombre_trgm_idx
+    ON hospital USING gin (nombre gin_trgm_ops);
+
+-- t.tipo IN (...) se resuelve con este índice; t.id_hospital IN (...) usa tejidos_hospital_id_idx (0007)
+CREATE INDEX IF NOT EXISTS tejidos_tipo_idx ON tejidos (tipo, id);
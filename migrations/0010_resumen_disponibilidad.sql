@@ -0,0 +1,105 @@
+-- 0010_resumen_disponibilidad.sql
+-- Conteo de tejidos por hospital, tipo, estado y grupo sanguíneo del donante, mantenido por
+-- triggers (ver get_resumen_disponibilidad en functions.py). Los contadores y gráficos de los
+-- portales leen esta tabla en lugar de contar las filas de tejidos.
+
+CREATE TABLE IF NOT EXISTS resumen_disponibilidad (
+    id_hospital integer,
+    tipo text,
+    estado text,
+    tipo_sangre text,
+    cantidad bigint NOT NULL DEFAULT 0,
+    -- Tejidos sin hospital o sin donante forman su propio grupo (NULL)
+    CONSTRAINT resumen_disponibilidad_clave UNIQUE NULLS NOT DISTINCT (id_hospital, tipo, estado, tipo_sangre)
+);
+
+-- Triggers por sentencia con tablas de transición: una carga masiva o una actualización en
+-- lote suma sus deltas agrupados en una sola sentencia, no una por fila. Las filas se
+-- actualizan en el orden de la clave para que dos transacciones no se bloqueen mutuamente.
+CREATE OR REPLACE FUNCTION actualizar_resumen_disponibilidad() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO resumen_disponibilidad AS r (id_hospital, tipo, estado, tipo_sangre, cantidad)
+        SELECT n.id_hospital, n.tipo, n.estado, d.tipo_sangre, count(*)
+        FROM nuevos n LEFT JOIN donante d ON d.id = n.id_donante
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (id_hospital, tipo, estado, tipo_sangre) DO UPDATE SET cantidad = r.cantidad + EXCLUDED.cantidad;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO resumen_disponibilidad AS r (id_hospital, tipo, estado, tipo_sangre, cantidad)
+        SELECT v.id_hospital, v.tipo, v.estado, d.tipo_sangre, -count(*)
+        FROM viejos v LEFT JOIN donante d ON d.id = v.id_donante
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (id_hospital, tipo, estado, tipo_sangre) DO UPDATE SET cantidad = r.cantidad + EXCLUDED.cantidad;
+    ELSE
+        -- UPDATE: solo cambian los grupos con delta neto distinto de cero (p. ej. no un cambio de fecha)
+        INSERT INTO resumen_disponibilidad AS r (id_hospital, tipo, estado, tipo_sangre, cantidad)
+        SELECT c.id_hospital, c.tipo, c.estado, d.tipo_sangre, sum(c.delta)
+        FROM (
+            SELECT id_hospital, tipo, estado, id_donante, 1 AS delta FROM nuevos
+            UNION ALL
+            SELECT id_hospital, tipo, estado, id_donante, -1 AS delta FROM viejos
+        ) c LEFT JOIN donante d ON d.id = c.id_donante
+        GROUP BY 1, 2, 3, 4
+        HAVING sum(c.delta) <> 0
+        ORDER BY 1, 2, 3, 4
+        ON CONFLICT (id_hospital, tipo, estado, tipo_sangre) DO UPDATE SET cantidad = r.cantidad + EXCLUDED.cantidad;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tejidos_resumen_insert ON tejidos;
+CREATE TRIGGER tejidos_resumen_insert
+    AFTER INSERT ON tejidos REFERENCING NEW TABLE AS nuevos
+    FOR EACH STATEMENT EXECUTE FUNCTION actualizar_resumen_disponibilidad();
+
+DROP TRIGGER IF EXISTS tejidos_resumen_update ON tejidos;
+CREATE TRIGGER tejidos_resumen_update
+    AFTER UPDATE ON tejidos REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+    FOR EACH STATEMENT EXECUTE FUNCTION actualizar_resumen_disponibilidad();
+
+DROP TRIGGER IF EXISTS tejidos_resumen_delete ON tejidos;
+CREATE TRIGGER tejidos_resumen_delete
+    AFTER DELETE ON tejidos REFERENCING OLD TABLE AS viejos
+    FOR EACH STATEMENT EXECUTE FUNCTION actualizar_resumen_disponibilidad();
+
+-- Si se corrige el grupo sanguíneo de un donante, sus tejidos cambian de grupo
+CREATE OR REPLACE FUNCTION mover_resumen_tipo_sangre() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO resumen_disponibilidad AS r (id_hospital, tipo, estado, tipo_sangre, cantidad)
+    SELECT t.id_hospital, t.tipo, t.estado, g.tipo_sangre, g.signo * count(*)
+    FROM tejidos t
+    CROSS JOIN (VALUES (OLD.tipo_sangre, -1), (NEW.tipo_sangre, 1)) AS g (tipo_sangre, signo)
+    WHERE t.id_donante = NEW.id
+    GROUP BY 1, 2, 3, 4, g.signo
+    ORDER BY 1, 2, 3, 4
+    ON CONFLICT (id_hospital, tipo, estado, tipo_sangre) DO UPDATE SET cantidad = r.cantidad + EXCLUDED.cantidad;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS donante_resumen_tipo_sangre ON donante;
+CREATE TRIGGER donante_resumen_tipo_sangre
+    AFTER UPDATE OF tipo_sangre ON donante
+    FOR EACH ROW WHEN (OLD.tipo_sangre IS DISTINCT FROM NEW.tipo_sangre)
+    EXECUTE FUNCTION mover_resumen_tipo_sangre();
+
+CREATE INDEX IF NOT EXISTS tejidos_donante_idx ON tejidos (id_donante);
+
+-- Recalcula el resumen desde cero y descarta los grupos vacíos. Sirve para la carga inicial y
+-- como verificación periódica (p. ej. con pg_cron). Bloquea las escrituras en tejidos mientras corre.
+CREATE OR REPLACE FUNCTION refrescar_resumen_disponibilidad() RETURNS void AS $$
+BEGIN
+    LOCK TABLE tejidos IN SHARE MODE;
+    LOCK TABLE resumen_disponibilidad IN EXCLUSIVE MODE;
+    DELETE FROM resumen_disponibilidad;
+    INSERT INTO resumen_disponibilidad (id_hospital, tipo, estado, tipo_sangre, cantidad)
+    SELECT t.id_hospital, t.tipo, t.estado, d.tipo_sangre, count(*)
+    FROM tejidos t LEFT JOIN donante d ON d.id = t.id_donante
+    GROUP BY 1, 2, 3, 4;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT refrescar_resumen_disponibilidad();
@@ -0,0 +1,80 @@
+-- 0011_tejidos_eventos.sql
+-- Historial de estados de cada tejido (ver get_historial_tejido en functions.py). Cada alta y
+-- cada cambio de estado u hospital agrega un evento; las filas nunca se modifican.
+-- Los eventos los escribe un trigger en la misma transacción que el cambio, sin consultas
+-- adicionales desde la app.
+
+CREATE TABLE IF NOT EXISTS tejidos_eventos (
+    tejido_id integer NOT NULL,
+    id_hospital integer,
+    estado_anterior text,
+    estado text,
+    ts timestamptz NOT NULL DEFAULT now()
+) PARTITION BY RANGE (ts);
+
+-- Particiones mensuales. La partición por defecto recibe lo que quede fuera de las creadas,
+-- para que un cambio de estado nunca falle por falta de partición.
+CREATE TABLE IF NOT EXISTS tejidos_eventos_default PARTITION OF tejidos_eventos DEFAULT;
+
+-- Crea las particiones mensuales entre `desde` y `hasta` que falten. Conviene correrla una vez
+-- por mes (p. ej. con pg_cron) para tener siempre creados los meses siguientes.
+-- Un mes que ya tiene filas en la partición por defecto no se puede crear sin moverlas antes.
+CREATE OR REPLACE FUNCTION crear_particiones_tejidos_eventos(desde date, hasta date) RETURNS void AS $$
+DECLARE
+    mes date := date_trunc('month', desde)::date;
+BEGIN
+    WHILE mes <= hasta LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF tejidos_eventos FOR VALUES FROM (%L) TO (%L)',
+            'tejidos_eventos_' || to_char(mes, 'YYYY_MM'), mes, (mes + interval '1 month')::date
+        );
+        mes := (mes + interval '1 month')::date;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Timeline de un tejido y movimientos recientes de un hospital: un recorrido de índice por partición
+CREATE INDEX IF NOT EXISTS tejidos_eventos_tejido_ts_idx ON tejidos_eventos (tejido_id, ts);
+CREATE INDEX IF NOT EXISTS tejidos_eventos_hospital_ts_idx ON tejidos_eventos (id_hospital, ts);
+
+CREATE OR REPLACE FUNCTION registrar_eventos_tejidos() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO tejidos_eventos (tejido_id, id_hospital, estado_anterior, estado)
+        SELECT n.id, n.id_hospital, NULL, n.estado FROM nuevos n;
+    ELSE
+        INSERT INTO tejidos_eventos (tejido_id, id_hospital, estado_anterior, estado)
+        SELECT n.id, n.id_hospital, v.estado, n.estado
+        FROM nuevos n JOIN viejos v ON v.id = n.id
+        WHERE n.estado IS DISTINCT FROM v.estado OR n.id_hospital IS DISTINCT FROM v.id_hospital;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tejidos_eventos_insert ON tejidos;
+CREATE TRIGGER tejidos_eventos_insert
+    AFTER INSERT ON tejidos REFERENCING NEW TABLE AS nuevos
+    FOR EACH STATEMENT EXECUTE FUNCTION registrar_eventos_tejidos();
+
+DROP TRIGGER IF EXISTS tejidos_eventos_update ON tejidos;
+CREATE TRIGGER tejidos_eventos_update
+    AFTER UPDATE ON tejidos REFERENCING OLD TABLE AS viejos NEW TABLE AS nuevos
+    FOR EACH STATEMENT EXECUTE FUNCTION registrar_eventos_tejidos();
+
+-- Carga inicial: el historial anterior se perdió, cada tejido arranca con su estado actual.
+-- Particiones desde el tejido más antiguo hasta un año adelante.
+DO $$
+BEGIN
+    PERFORM crear_particiones_tejidos_eventos(
+        COALESCE((SELECT min(fecha_recoleccion) FROM tejidos), current_date),
+        (current_date + interval '12 months')::date
+    );
+    IF NOT EXISTS (SELECT 1 FROM tejidos_eventos) THEN
+        INSERT INTO tejidos_eventos (tejido_id, id_hospital, estado_anterior, estado, ts)
+        SELECT id, id_hospital, NULL, estado,
+               GREATEST(COALESCE(fecha_de_estado, fecha_recoleccion, now()), fecha_recoleccion)
+        FROM tejidos;
+    END IF;
+END
+$$;
@@ -0,0 +1,253 @@
+-- 0012_particiones_archivo.sql
+-- tejidos y solicitud particionadas en vigentes / archivo (ver archive_historicos en functions.py).
+--   <tabla>            PARTITION BY LIST (archivado)
+--   <tabla>_vigentes   archivado = false: todo lo que usan los portales día a día
+--   <tabla>_archivo    archivado = true, PARTITION BY RANGE por fecha en particiones anuales
+-- Las consultas de los portales filtran `NOT archivado` y solo recorren la partición vigente.
+-- Las claves únicas de una tabla particionada deben incluir la columna de partición: la clave
+-- primaria pasa a ser (id, archivado) y un trigger impide que el mismo id esté en las dos ramas.
+-- Las claves foráneas no pueden apuntar a (id) solo: las que apuntaban a estas tablas se
+-- reemplazan por triggers de integridad referencial (ver crear_referencia).
+
+-- Particiones anuales del archivo de `tabla` entre `desde` y `hasta` que falten
+CREATE OR REPLACE FUNCTION crear_particiones_archivo(tabla text, desde date, hasta date) RETURNS void AS $$
+DECLARE
+    anio date := date_trunc('year', desde)::date;
+BEGIN
+    WHILE anio <= hasta LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+            tabla || '_archivo_' || to_char(anio, 'YYYY'), tabla || '_archivo', anio, (anio + interval '1 year')::date
+        );
+        anio := (anio + interval '1 year')::date;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- id único en toda la tabla particionada (TG_ARGV[0]): la clave primaria (id, archivado) no
+-- impide que el mismo id aparezca en vigentes y en archivo. AFTER: cuando un UPDATE de
+-- `archivado` mueve la fila de partición, la fila de origen ya no es visible.
+CREATE OR REPLACE FUNCTION verificar_id_unico() RETURNS trigger AS $$
+DECLARE
+    duplicado boolean;
+BEGIN
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s WHERE id = $1 AND archivado <> $2)', TG_ARGV[0])
+        INTO duplicado USING NEW.id, NEW.archivado;
+    IF duplicado THEN
+        RAISE EXCEPTION 'Ya existe una fila con id % en %', NEW.id, TG_ARGV[0] USING ERRCODE = 'unique_violation';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Lado que referencia (TG_ARGV: columna, tabla referenciada): el id tiene que existir. Como una
+-- clave foránea, bloquea la fila referenciada (FOR KEY SHARE) hasta el final de la transacción.
+CREATE OR REPLACE FUNCTION verificar_referencia() RETURNS trigger AS $$
+DECLARE
+    valor integer := (to_jsonb(NEW) ->> TG_ARGV[0])::integer;
+    encontrado integer;
+BEGIN
+    IF valor IS NULL THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE format('SELECT 1 FROM %s WHERE id = $1 FOR KEY SHARE', TG_ARGV[1]) INTO encontrado USING valor;
+    IF encontrado IS NULL THEN
+        RAISE EXCEPTION '%.% = % no existe en %', TG_TABLE_NAME, TG_ARGV[0], valor, TG_ARGV[1]
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Lado referenciado (TG_ARGV: tabla referenciada, tabla que referencia, columna): no se puede
+-- borrar ni cambiar el id de una fila referenciada (NO ACTION). Mover la fila al archivo
+-- llega como DELETE en la partición de origen, pero el id sigue existiendo en la tabla.
+CREATE OR REPLACE FUNCTION impedir_borrado_referenciado() RETURNS trigger AS $$
+DECLARE
+    existe boolean;
+BEGIN
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s WHERE id = $1)', TG_ARGV[0]) INTO existe USING OLD.id;
+    IF existe THEN
+        RETURN NULL;
+    END IF;
+    EXECUTE format('SELECT EXISTS (SELECT 1 FROM %s WHERE %I = $1)', TG_ARGV[1], TG_ARGV[2]) INTO existe USING OLD.id;
+    IF existe THEN
+        RAISE EXCEPTION 'El id % de % sigue referenciado desde %.%', OLD.id, TG_ARGV[0], TG_ARGV[1], TG_ARGV[2]
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Integridad referencial de `tabla_hija`.`columna` hacia `tabla_padre`.id con triggers, para
+-- tablas particionadas por archivado. Como un FK NOT VALID, solo controla las escrituras nuevas.
+CREATE OR REPLACE FUNCTION crear_referencia(tabla_hija regclass, columna text, tabla_padre regclass) RETURNS void AS $$
+DECLARE
+    nombre text := left(format('%s_%s_ref', replace(tabla_hija::text, '.', '_'), columna), 60);
+BEGIN
+    EXECUTE format('DROP TRIGGER IF EXISTS %I ON %s', nombre, tabla_hija);
+    EXECUTE format(
+        'CREATE TRIGGER %I AFTER INSERT OR UPDATE OF %I ON %s FOR EACH ROW EXECUTE FUNCTION verificar_referencia(%L, %L)',
+        nombre, columna, tabla_hija, columna, tabla_padre::text
+    );
+    EXECUTE format('DROP TRIGGER IF EXISTS %I ON %s', nombre || '_r', tabla_padre);
+    EXECUTE format(
+        'CREATE TRIGGER %I AFTER DELETE OR UPDATE OF id ON %s FOR EACH ROW EXECUTE FUNCTION impedir_borrado_referenciado(%L, %L, %L)',
+        nombre || '_r', tabla_padre, tabla_padre::text, tabla_hija::text, columna
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Clave primaria (id, archivado) y trigger de id único. Se puede ejecutar más de una vez.
+CREATE OR REPLACE FUNCTION pg_temp.asegurar_id_unico(tabla text) RETURNS void AS $$
+BEGIN
+    -- Índice no único de la primera versión de esta migración
+    EXECUTE format('DROP INDEX IF EXISTS %I', tabla || '_id_idx');
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = tabla::regclass AND contype = 'p') THEN
+        EXECUTE format('ALTER TABLE %I ADD PRIMARY KEY (id, archivado)', tabla);
+    END IF;
+    EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', tabla || '_id_unico', tabla);
+    EXECUTE format(
+        'CREATE TRIGGER %I AFTER INSERT OR UPDATE OF id, archivado ON %I FOR EACH ROW EXECUTE FUNCTION verificar_id_unico(%L)',
+        tabla || '_id_unico', tabla, tabla
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reemplaza `tabla` por su versión particionada con los mismos datos, índices, triggers y
+-- claves foráneas salientes. Las entrantes pasan a triggers. No hace nada si ya está particionada.
+CREATE OR REPLACE FUNCTION pg_temp.particionar_por_archivo(tabla text, columna_fecha text) RETURNS void AS $$
+DECLARE
+    legado text := tabla || '_legado';
+    secuencia text := tabla || '_id_particion_seq';
+    indices text[];
+    triggers text[];
+    def text;
+    desde date;
+    r record;
+    entrantes text[][] := '{}';
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(tabla)) = 'p' THEN
+        RETURN;
+    END IF;
+
+    EXECUTE format('ALTER TABLE %I ADD COLUMN IF NOT EXISTS archivado boolean NOT NULL DEFAULT false', tabla);
+
+    -- Claves foráneas entrantes: se eliminan y se recrean como triggers después de la conversión.
+    -- Quedan con la semántica NO ACTION; si tenían ON DELETE CASCADE / SET NULL se avisa.
+    FOR r IN
+        SELECT c.conrelid::regclass AS origen, c.conname, c.confdeltype, a.attname AS columna
+        FROM pg_constraint c
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = c.conkey[1]
+        WHERE c.confrelid = tabla::regclass AND c.contype = 'f'
+    LOOP
+        IF r.confdeltype NOT IN ('a', 'r') THEN
+            RAISE NOTICE 'La clave foránea % de % tenía una acción ON DELETE que los triggers no replican', r.conname, r.origen;
+        END IF;
+        entrantes := entrantes || ARRAY[[r.origen::text, r.columna::text]];
+        EXECUTE format('ALTER TABLE %s DROP CONSTRAINT %I', r.origen, r.conname);
+    END LOOP;
+
+    -- Definiciones tomadas antes de renombrar: nombran a `tabla`, así que al ejecutarlas
+    -- después se crean sobre la tabla nueva. La clave primaria pasa a (id, archivado).
+    SELECT array_agg(pg_get_indexdef(indexrelid)) INTO indices
+    FROM pg_index WHERE indrelid = tabla::regclass AND NOT indisunique;
+    SELECT array_agg(pg_get_triggerdef(oid)) INTO triggers
+    FROM pg_trigger WHERE tgrelid = tabla::regclass AND NOT tgisinternal;
+
+    EXECUTE format('ALTER TABLE %I RENAME TO %I', tabla, legado);
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY LIST (archivado)', tabla, legado);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES IN (false)', tabla || '_vigentes', tabla);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES IN (true) PARTITION BY RANGE (%I)', tabla || '_archivo', tabla, columna_fecha);
+    EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', tabla || '_archivo_default', tabla || '_archivo');
+    EXECUTE format('SELECT min(%I)::date FROM %I', columna_fecha, legado) INTO desde;
+    PERFORM crear_particiones_archivo(tabla, COALESCE(desde, current_date), current_date);
+
+    -- Los datos se copian antes de recrear los triggers: el resumen y el historial ya los contemplan
+    EXECUTE format('INSERT INTO %I SELECT * FROM %I', tabla, legado);
+
+    -- Secuencia propia: sirve igual si el id era serial o identity
+    EXECUTE format('CREATE SEQUENCE IF NOT EXISTS %I', secuencia);
+    EXECUTE format('SELECT setval(%L, COALESCE((SELECT max(id) FROM %I), 0) + 1, false)', secuencia, tabla);
+    EXECUTE format('ALTER TABLE %I ALTER COLUMN id SET DEFAULT nextval(%L)', tabla, secuencia);
+    EXECUTE format('ALTER SEQUENCE %I OWNED BY %I.id', secuencia, tabla);
+
+    FOR r IN
+        SELECT conname, pg_get_constraintdef(oid) AS def FROM pg_constraint
+        WHERE conrelid = legado::regclass AND contype = 'f'
+    LOOP
+        EXECUTE format('ALTER TABLE %I ADD CONSTRAINT %I %s', tabla, r.conname, r.def);
+    END LOOP;
+
+    EXECUTE format('DROP TABLE %I', legado);
+
+    PERFORM pg_temp.asegurar_id_unico(tabla);
+    FOR i IN 1 .. COALESCE(array_length(entrantes, 1), 0) LOOP
+        PERFORM crear_referencia(entrantes[i][1]::regclass, entrantes[i][2], tabla::regclass);
+    END LOOP;
+    FOREACH def IN ARRAY COALESCE(indices, '{}') LOOP
+        EXECUTE def;
+    END LOOP;
+    FOREACH def IN ARRAY COALESCE(triggers, '{}') LOOP
+        EXECUTE def;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT pg_temp.particionar_por_archivo('tejidos', 'fecha_recoleccion');
+SELECT pg_temp.particionar_por_archivo('solicitud', 'fecha_solicitud');
+-- También en bases convertidas por una versión anterior de esta migración
+SELECT pg_temp.asegurar_id_unico('tejidos');
+SELECT pg_temp.asegurar_id_unico('solicitud');
+SELECT crear_referencia('solicitud', 'tejido_reservado_id', 'tejidos');
+
+-- Mueve al archivo, en lotes de hasta `lote` filas por tabla, los tejidos en estado final y
+-- las solicitudes resueltas de hace más de `dias` días. Retorna las filas movidas por tabla.
+-- El UPDATE de `archivado` traslada cada fila a su partición anual del archivo.
+CREATE OR REPLACE FUNCTION archivar_historicos(
+    dias integer DEFAULT 365,
+    lote integer DEFAULT 5000,
+    estados_tejido text[] DEFAULT ARRAY['Enviado', 'Rechazado'],
+    estados_solicitud text[] DEFAULT ARRAY['aprobada', 'rechazada']
+) RETURNS TABLE (tabla text, filas bigint) AS $$
+DECLARE
+    limite timestamptz := now() - make_interval(days => dias);
+BEGIN
+    PERFORM crear_particiones_archivo(
+        'tejidos',
+        COALESCE((SELECT min(t.fecha_recoleccion) FROM tejidos t
+                  WHERE NOT t.archivado AND t.estado = ANY(estados_tejido) AND t.fecha_de_estado < limite), current_date),
+        current_date
+    );
+    PERFORM crear_particiones_archivo(
+        'solicitud',
+        COALESCE((SELECT min(s.fecha_solicitud)::date FROM solicitud s
+                  WHERE NOT s.archivado AND s.estado = ANY(estados_solicitud) AND s.fecha_solicitud < limite), current_date),
+        current_date
+    );
+
+    RETURN QUERY
+    WITH movidos AS (
+        UPDATE tejidos SET archivado = true
+        WHERE NOT archivado AND id IN (
+            SELECT t.id FROM tejidos t
+            WHERE NOT t.archivado AND t.estado = ANY(estados_tejido) AND t.fecha_de_estado < limite
+            LIMIT lote
+        )
+        RETURNING 1
+    )
+    SELECT 'tejidos'::text, count(*) FROM movidos;
+
+    RETURN QUERY
+    WITH movidas AS (
+        UPDATE solicitud SET archivado = true
+        WHERE NOT archivado AND id IN (
+            SELECT s.id FROM solicitud s
+            WHERE NOT s.archivado AND s.estado = ANY(estados_solicitud) AND s.fecha_solicitud < limite
+            LIMIT lote
+        )
+        RETURNING 1
+    )
+    SELECT 'solicitud'::text, count(*) FROM movidas;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,19 @@
+-- 0013_solicitud_hospital.sql
+-- Cada solicitud referencia al hospital destino por id (y al tejido pedido), en lugar de
+-- buscarse por el nombre guardado en `ubicacion`, que se mantiene solo para mostrar.
+
+ALTER TABLE solicitud ADD COLUMN IF NOT EXISTS hospital_id integer REFERENCES hospital (id);
+ALTER TABLE solicitud ADD COLUMN IF NOT EXISTS tejido_id integer;
+-- tejidos está particionada: la referencia se controla con triggers (0012_particiones_archivo.sql)
+SELECT crear_referencia('solicitud', 'tejido_id', 'tejidos');
+
+-- Solicitudes anteriores: hospital por nombre. El tejido pedido no se guardaba y queda NULL.
+UPDATE solicitud s
+SET hospital_id = (SELECT min(h.id) FROM hospital h WHERE h.nombre = s.ubicacion)
+WHERE s.hospital_id IS NULL AND s.ubicacion IS NOT NULL;
+
+-- Cola de pendientes de un hospital, de la más antigua a la más nueva: con las columnas
+-- incluidas, la consulta de "Gestión de Solicitudes" se resuelve solo con el índice.
+CREATE INDEX IF NOT EXISTS solicitud_pendientes_hospital_idx
+    ON solicitud (hospital_id, fecha_solicitud) INCLUDE (id, tipo, medico_id)
+    WHERE estado = 'pendiente';
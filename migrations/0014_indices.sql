@@ -0,0 +1,29 @@
+-- 0014_indices.sql
+-- Índices para las consultas de los portales que no cubren las migraciones anteriores.
+-- Cada uno indica qué consulta resuelve.
+
+-- Portal hospitalario: inventario del hospital filtrado por estado y tipo
+-- (actualización de estados, stock por tipo al aprobar en lote).
+CREATE INDEX IF NOT EXISTS tejidos_hospital_estado_tipo_idx ON tejidos (id_hospital, estado, tipo);
+
+-- Portal hospitalario, depuración: últimos tejidos del hospital por fecha de estado.
+CREATE INDEX IF NOT EXISTS tejidos_hospital_fecha_estado_idx ON tejidos (id_hospital, fecha_de_estado DESC);
+
+-- Portal médico, "Solicitar Tejido Específico": disponibles de un tipo en toda la red,
+-- los más antiguos primero (ORDER BY fecha_recoleccion, id LIMIT n).
+CREATE INDEX IF NOT EXISTS tejidos_disponibles_tipo_idx
+    ON tejidos (tipo, fecha_recoleccion, id)
+    WHERE estado = 'Disponible';
+
+-- Portal médico: solicitudes del médico, las más recientes primero (inicio, historial, dashboard)
+-- y control de solicitud pendiente duplicada.
+CREATE INDEX IF NOT EXISTS solicitud_medico_fecha_idx ON solicitud (medico_id, fecha_solicitud DESC);
+
+-- Registro: control de DNI / teléfono ya registrado (WHERE dni = %s, WHERE telefono = %s) y
+-- carga masiva (dni = ANY(...)). El login usa los índices por texto de 0004_credenciales.sql.
+CREATE INDEX IF NOT EXISTS medico_dni_idx ON medico (dni);
+CREATE INDEX IF NOT EXISTS hospital_telefono_idx ON hospital (telefono);
+
+-- Estadísticas actualizadas para que el planificador tenga en cuenta los índices nuevos
+ANALYZE tejidos;
+ANALYZE solicitud;
@@ -0,0 +1,96 @@
+-- 0015_notificar_por_sentencia.sql
+-- Un NOTIFY por sentencia en lugar de uno por fila (reemplaza los triggers de
+-- 0001_notificar_cambios.sql y 0005_identidad_sesion.sql): una carga masiva con COPY o un
+-- execute_many de N filas avisa una sola vez. El payload agrupa las filas de la sentencia:
+--   tabla, op, filas           cantidad de filas afectadas
+--   ids                        ids afectados, o null si son demasiados (tratar como "todos")
+--   id                         el id, solo si la sentencia afectó una fila (formato anterior)
+--   id_hospital, ubicacion     valores distintos de esas columnas, o null si son demasiados
+-- Un NOTIFY admite hasta 8000 bytes: si no entra, las listas se reemplazan por null.
+
+CREATE OR REPLACE FUNCTION notificar_cambios_sentencia() RETURNS trigger AS $$
+DECLARE
+    cambios jsonb[];
+    filas bigint;
+    ids jsonb;
+    hospitales jsonb;
+    ubicaciones jsonb;
+    payload jsonb;
+BEGIN
+    -- Tablas de transición con el mismo nombre en todos los triggers: nuevos / viejos.
+    -- Solo se conservan las columnas que van al payload.
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(jsonb_build_object('id', f -> 'id', 'id_hospital', f -> 'id_hospital', 'ubicacion', f -> 'ubicacion'))
+        INTO cambios FROM (SELECT to_jsonb(n) AS f FROM nuevos n) c;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(jsonb_build_object('id', f -> 'id', 'id_hospital', f -> 'id_hospital', 'ubicacion', f -> 'ubicacion'))
+        INTO cambios FROM (SELECT to_jsonb(v) AS f FROM viejos v) c;
+    ELSE
+        -- UPDATE: valores anteriores y nuevos (un tejido que cambia de hospital avisa a los dos)
+        SELECT array_agg(jsonb_build_object('id', f -> 'id', 'id_hospital', f -> 'id_hospital', 'ubicacion', f -> 'ubicacion'))
+        INTO cambios FROM (
+            SELECT to_jsonb(n) AS f FROM nuevos n
+            UNION ALL
+            SELECT to_jsonb(v) AS f FROM viejos v
+        ) c;
+    END IF;
+    IF cambios IS NULL THEN
+        RETURN NULL;  -- la sentencia no afectó filas
+    END IF;
+
+    SELECT count(DISTINCT c -> 'id'),
+           jsonb_agg(DISTINCT c -> 'id'),
+           jsonb_agg(DISTINCT c -> 'id_hospital') FILTER (WHERE c -> 'id_hospital' <> 'null'),
+           jsonb_agg(DISTINCT c -> 'ubicacion') FILTER (WHERE c -> 'ubicacion' <> 'null')
+    INTO filas, ids, hospitales, ubicaciones
+    FROM unnest(cambios) AS c;
+
+    payload := jsonb_build_object(
+        'tabla', TG_TABLE_NAME, 'op', TG_OP, 'filas', filas,
+        'ids', ids, 'id', CASE WHEN filas = 1 THEN ids -> 0 END,
+        'id_hospital', hospitales, 'ubicacion', ubicaciones
+    );
+    IF length(payload::text) > 7900 THEN
+        payload := payload || jsonb_build_object('ubicacion', NULL);
+    END IF;
+    IF length(payload::text) > 7900 THEN
+        payload := payload || jsonb_build_object('id_hospital', NULL);
+    END IF;
+    IF length(payload::text) > 7900 THEN
+        payload := payload || jsonb_build_object('ids', NULL);
+    END IF;
+    PERFORM pg_notify('cambios_' || TG_TABLE_NAME, payload::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Triggers por sentencia: uno por evento, porque los que usan tablas de transición no
+-- pueden escuchar más de un evento. Cada tabla conserva los eventos que tenía.
+CREATE OR REPLACE FUNCTION pg_temp.notificar_por_sentencia(tabla text, eventos text[]) RETURNS void AS $$
+DECLARE
+    evento text;
+BEGIN
+    EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', tabla || '_notificar_cambio', tabla);
+    FOREACH evento IN ARRAY ARRAY['insert', 'update', 'delete'] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', tabla || '_notificar_' || evento, tabla);
+        CONTINUE WHEN NOT evento = ANY(eventos);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER %s ON %I REFERENCING %s FOR EACH STATEMENT EXECUTE FUNCTION notificar_cambios_sentencia()',
+            tabla || '_notificar_' || evento, upper(evento), tabla,
+            CASE evento
+                WHEN 'insert' THEN 'NEW TABLE AS nuevos'
+                WHEN 'update' THEN 'OLD TABLE AS viejos NEW TABLE AS nuevos'
+                ELSE 'OLD TABLE AS viejos'
+            END
+        );
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT pg_temp.notificar_por_sentencia('tejidos', ARRAY['insert', 'update', 'delete']);
+SELECT pg_temp.notificar_por_sentencia('solicitud', ARRAY['insert', 'update', 'delete']);
+SELECT pg_temp.notificar_por_sentencia('medico', ARRAY['update', 'delete']);
+SELECT pg_temp.notificar_por_sentencia('hospital', ARRAY['insert', 'update', 'delete']);
+
+-- La función por fila de 0001 queda sin triggers
+DROP FUNCTION IF EXISTS notificar_cambio();
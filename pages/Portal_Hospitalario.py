@@ -5,11 +5,12 @@ import pandas as pd
 from datetime import datetime
 import sys
 import os
-from math import radians, sin, cos, sqrt, atan2
 
 # --- Configuración de Path y Conexión ---
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
-from functions import connect_to_supabase, execute_query
+from functions import connect_to_supabase, execute_query, cached_query, get_change_listener, watch_tables, approve_solicitud, approve_solicitudes, reject_solicitudes, execute_many, transaction, keyset_paginator, get_hospitales, distancia_hospitales, fuentes_cercanas, hospitales_cercanos, buscar_personas, personas_por_dni, get_resumen_disponibilidad, get_historial_tejido, get_movimientos_hospital, query_metrics_panel, contains_predicate, equals_predicate, where_clause, query_csv
+from allocation import allocate
+from intake import REQUIRED_COLUMNS, OPTIONAL_COLUMNS, intake_template, read_intake_file, referenced_dnis, validate_intake, load_intake
 
 # --- Configuración de la Página ---
 st.set_page_config(page_title="TissBank - Portal Hospitalario", page_icon="🏥", layout="wide")
@@ -277,43 +278,16 @@ def load_css():
 
 
 # --- Funciones de Utilidad y Carga de Datos ---
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371; dlat = radians(lat2 - lat1); dlon = radians(lon2 - lon1)
-    a = sin(dlat / 2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a)); return R * c
-
-@st.cache_data
-def get_hospitales_principales():
-    data = [
-        {"name": "Hospital Italiano", "address": "Tte. Gral. Juan Domingo Perón 4190, CABA", "lat": -34.6066, "lon": -58.4250},
-        {"name": "Hospital Alemán", "address": "Av. Pueyrredón 1640, CABA", "lat": -34.5938, "lon": -58.4033},
-        {"name": "Hospital Británico", "address": "Perdriel 74, CABA", "lat": -34.6284, "lon": -58.3840},
-        {"name": "Hospital Garrahan", "address": "Pichincha 1890, CABA", "lat": -34.6293, "lon": -58.3908},
-        {"name": "Hospital Fernández", "address": "Av. Cerviño 3356, CABA", "lat": -34.5822, "lon": -58.4111},
-        {"name": "Hospital de Clínicas", "address": "Av. Córdoba 2351, CABA", "lat": -34.5989, "lon": -58.4005},
-        {"name": "Sanatorio Güemes", "address": "Francisco Acuña de Figueroa 1240, CABA", "lat": -34.5983, "lon": -58.4214},
-        {"name": "FLENI", "address": "Montañeses 2325, CABA", "lat": -34.5501, "lon": -58.4485},
-        {"name": "Hospital Austral", "address": "Av. J. D. Perón 1500, Pilar", "lat": -34.4528, "lon": -58.9133},
-        {"name": "Hospital Argerich", "address": "Pi y Margall 750, CABA", "lat": -34.6241, "lon": -58.3662},
-        {"name": "Hospital Rivadavia", "address": "Av. Gral. Las Heras 2670, CABA", "lat": -34.5880, "lon": -58.3990},
-        {"name": "Hospital Durand", "address": "Av. Díaz Vélez 5044, CABA", "lat": -34.6112, "lon": -58.4442},
-        {"name": "Hospital Santojanni", "address": "Pilar 950, CABA", "lat": -34.6465, "lon": -58.5134},
-        {"name": "Sanatorio Finochietto", "address": "Av. Córdoba 2678, CABA", "lat": -34.6043, "lon": -58.4045},
-        {"name": "Fundación Favaloro", "address": "Av. Belgrano 1746, CABA", "lat": -34.6120, "lon": -58.3900}
-    ]
-    return pd.DataFrame(data)
-
-@st.cache_data(ttl=300)
-def get_donantes(_conn):
-    return execute_query("SELECT id, nombre, apellido, dni FROM donante ORDER BY apellido, nombre", conn=_conn, is_select=True)
-
-@st.cache_data(ttl=300)
-def get_medicos(_conn):
-    return execute_query("SELECT id, nombre, apellido, dni FROM medico ORDER BY apellido, nombre", conn=_conn, is_select=True)
-
-@st.cache_data(ttl=300)
-def get_tipos_tejido(_conn):
-    return execute_query("SELECT tipo, descripcion FROM detalles_tejido ORDER BY descripcion", conn=_conn, is_select=True)
+# Coincidencias que se muestran en los buscadores de donante y médico
+MAX_RESULTADOS_BUSQUEDA = 20
+
+def etiquetas_personas(df):
+    """{id: "Apellido, Nombre (DNI: ...)"} para usar como format_func de un selectbox de ids."""
+    etiquetas = df["apellido"].astype(str) + ", " + df["nombre"].astype(str) + " (DNI: " + df["dni"].astype(str) + ")"
+    return dict(zip(df["id"].astype(int).tolist(), etiquetas))
+
+def get_tipos_tejido(conn):
+    return cached_query("SELECT tipo, descripcion FROM detalles_tejido ORDER BY descripcion", conn=conn, tables=("detalles_tejido",))
 
 # --- INICIO DE LA APLICACIÓN ---
 load_css()
@@ -337,6 +311,12 @@ opcion_utilidades = st.sidebar.radio(
     ["Gestión de Inventario", "Gestión de Solicitudes", "Dashboard Analítico", "Trazabilidad de Tejidos", "Red de Hospitales y Logística"]
 )
 
+# Invalidación del caché por LISTEN/NOTIFY y refresco automático opcional
+get_change_listener()
+st.sidebar.markdown("---")
+if st.sidebar.toggle("🔴 Actualización en vivo", help="Refresca la página cuando otro usuario modifica tejidos o solicitudes"):
+    watch_tables("tejidos", "solicitud")
+
 # --- CONTENIDO PRINCIPAL ---
 
 if opcion_utilidades == "Gestión de Inventario":
@@ -347,13 +327,21 @@ if opcion_utilidades == "Gestión de Inventario":
     with st.expander("➕ **Registrar Nuevo Tejido**", expanded=False):
         if "tipo_donante" not in st.session_state: st.session_state.tipo_donante = "Nuevo Donante"
         st.radio("Paso 1: Tipo de donante", ["Nuevo Donante", "Donante Existente"], key="tipo_donante", horizontal=True)
+        # Buscadores fuera del formulario: cada búsqueda consulta el índice y actualiza las opciones
+        cb1, cb2 = st.columns(2)
+        if st.session_state.tipo_donante == "Donante Existente":
+            busqueda_donante = cb1.text_input("🔎 Buscar donante", placeholder="Nombre, apellido o DNI")
+            etiquetas_donante = etiquetas_personas(buscar_personas("donante", busqueda_donante, conn, limit=MAX_RESULTADOS_BUSQUEDA))
+        busqueda_medico = cb2.text_input("🔎 Buscar médico recolector", placeholder="Nombre, apellido o DNI")
+        etiquetas_medico = etiquetas_personas(buscar_personas("medico", busqueda_medico, conn, limit=MAX_RESULTADOS_BUSQUEDA))
         with st.form("form_registro_final"):
+            donante_sel = None
             if st.session_state.tipo_donante == "Donante Existente":
                 st.subheader("Seleccionar Donante")
-                donantes_df = get_donantes(conn)
-                if not donantes_df.empty:
-                    opciones_donante = [f"{row['apellido']}, {row['nombre']} (DNI: {row['dni']})" for _, row in donantes_df.iterrows()]
-                    donante_sel = st.selectbox("Donante", opciones_donante, index=None, placeholder="Elige un donante existente...")
+                donante_sel = st.selectbox(
+                    "Donante", list(etiquetas_donante), format_func=etiquetas_donante.get, index=None,
+                    placeholder="Elige un donante..." if etiquetas_donante else "Busque el donante por nombre o DNI",
+                )
             else:
                 st.subheader("Datos del Nuevo Donante")
                 c1, c2 = st.columns(2)
@@ -375,12 +363,10 @@ if opcion_utilidades == "Gestión de Inventario":
                 
             st.markdown("---")
             st.subheader("Paso 2: Datos de Recolección")
-            medicos_df = get_medicos(conn)
-            if not medicos_df.empty:
-                opciones_medico = [f"{row['apellido']}, {row['nombre']} (DNI: {row['dni']})" for _, row in medicos_df.iterrows()]
-                medico_sel = st.selectbox("Médico Recolector", opciones_medico, index=None, placeholder="Elige un médico...")
-            else:
-                st.error("No hay médicos registrados."); medico_sel = None
+            medico_sel = st.selectbox(
+                "Médico Recolector", list(etiquetas_medico), format_func=etiquetas_medico.get, index=None,
+                placeholder="Elige un médico..." if etiquetas_medico else "Busque el médico por nombre o DNI",
+            )
             tipos_tejido_df = get_tipos_tejido(conn)
             if not tipos_tejido_df.empty:
                 opciones_tejido = [f"{row['descripcion']} ({row['tipo']})" for _, row in tipos_tejido_df.iterrows()]
@@ -394,52 +380,98 @@ if opcion_utilidades == "Gestión de Inventario":
             submitted = st.form_submit_button("Registrar Tejido", use_container_width=True)
             
             if submitted:
+                id_medico_final = medico_sel
+
+                nuevo_donante = None
                 id_donante_final = None
                 if st.session_state.tipo_donante == "Nuevo Donante":
                     if all([nombre_donante, apellido_donante, dni_donante, tipo_sangre_donante]):
                         try:
-                            dni_int = int(dni_donante)
+                            nuevo_donante = (nombre_donante, apellido_donante, int(dni_donante), sexo_donante, tipo_sangre_donante)
+                        except ValueError:
+                            st.error("El DNI del donante debe ser un número válido.")
+                    else: 
+                        st.error("Faltan datos del nuevo donante (incluyendo tipo de sangre).")
+                else:
+                    id_donante_final = donante_sel
+
+                if (nuevo_donante or id_donante_final) and id_medico_final and tejido_sel:
+                    tejido_code = tejido_sel.split('(')[-1][:-1]
+                    # Donante nuevo y tejido en una sola transacción: si falla el tejido no queda un donante suelto
+                    with transaction(conn, statement_timeout=10000) as tx:
+                        if nuevo_donante:
                             # QUERY ACTUALIZADA con tipo_sangre
                             insert_query = """
                                 INSERT INTO donante (nombre, apellido, dni, sexo, tipo_sangre) 
                                 VALUES (%s, %s, %s, %s, %s) RETURNING id
                             """
-                            new_id_df = execute_query(
-                                insert_query, 
-                                conn, 
-                                (nombre_donante, apellido_donante, dni_int, sexo_donante, tipo_sangre_donante), 
-                                is_select=True
-                            )
-                            if new_id_df is not None and not new_id_df.empty:
+                            new_id_df = execute_query(insert_query, conn, nuevo_donante, is_select=True)
+                            if not new_id_df.empty:
                                 id_donante_final = int(new_id_df.iloc[0]['id'])
-                        except Exception as e: 
-                            st.error(f"Error al registrar donante: {e}")
-                    else: 
-                        st.error("Faltan datos del nuevo donante (incluyendo tipo de sangre).")
-                else:
-                    if 'donante_sel' in locals() and donante_sel:
-                        dni_sel_val = int(donante_sel.split("DNI: ")[1][:-1])
-                        id_donante_final = int(donantes_df[donantes_df['dni'] == dni_sel_val].iloc[0]['id'])
-            
-                id_medico_final = None
-                if medico_sel:
-                    dni_medico_sel_val = int(medico_sel.split("DNI: ")[1][:-1])
-                    id_medico_final = int(medicos_df[medicos_df['dni'] == dni_medico_sel_val].iloc[0]['id'])
-
-                if id_donante_final and id_medico_final and tejido_sel:
-                    tejido_code = tejido_sel.split('(')[-1][:-1]
-                    query = "INSERT INTO tejidos (tipo, id_donante, id_medico, id_hospital, fecha_recoleccion, condicion_recoleccion, estado, fecha_de_estado) VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())"
-                    params = (tejido_code, id_donante_final, id_medico_final, hospital_id, fecha_recoleccion, condicion_recoleccion, estado_inicial)
-                    if execute_query(query, conn, params, is_select=False):
+                        query = "INSERT INTO tejidos (tipo, id_donante, id_medico, id_hospital, fecha_recoleccion, condicion_recoleccion, estado, fecha_de_estado) VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())"
+                        params = (tejido_code, id_donante_final, id_medico_final, hospital_id, fecha_recoleccion, condicion_recoleccion, estado_inicial)
+                        execute_query(query, conn, params, is_select=False)
+                    if tx.committed:
                         st.success("✅ ¡Tejido registrado exitosamente!")
-                        st.cache_data.clear(); st.rerun()
+                        st.rerun()
                 else:
-                    if not id_donante_final: st.error("Error de validación: El donante no fue definido.")
+                    if not (nuevo_donante or id_donante_final): st.error("Error de validación: El donante no fue definido.")
                     if not id_medico_final: st.error("Error de validación: El médico no fue seleccionado.")
                     if not tejido_sel: st.error("Error de validación: El tipo de tejido no fue seleccionado.")
 
+    with st.expander("📥 **Carga Masiva de Tejidos (CSV/Excel)**", expanded=False):
+        if "resultado_carga" in st.session_state:
+            resultado_carga = st.session_state.pop("resultado_carga")
+            st.success(f"✅ Se registraron {resultado_carga['tejidos']} tejidos y {resultado_carga['donantes']} donantes nuevos.")
+        st.markdown(
+            f"Columnas obligatorias: `{'`, `'.join(REQUIRED_COLUMNS)}`. "
+            f"Opcionales: `{'`, `'.join(OPTIONAL_COLUMNS)}`. "
+            "Los datos del donante solo son necesarios si su DNI no está registrado."
+        )
+        st.download_button("Descargar planilla de ejemplo", intake_template(), file_name="carga_tejidos.csv", mime="text/csv")
+        # La clave cambia después de cada carga para vaciar el selector de archivos
+        st.session_state.setdefault("carga_masiva_key", 0)
+        archivo = st.file_uploader("Archivo de carga", type=["csv", "xlsx", "xls"], key=f"carga_masiva_{st.session_state['carga_masiva_key']}")
+        if archivo is not None:
+            try:
+                archivo_df = read_intake_file(archivo)
+                validos, rechazados = validate_intake(
+                    archivo_df, get_tipos_tejido(conn),
+                    personas_por_dni("medico", referenced_dnis(archivo_df, "dni_medico"), conn),
+                    personas_por_dni("donante", referenced_dnis(archivo_df, "dni_donante"), conn),
+                )
+            except ImportError:
+                st.error("Para leer archivos Excel instale openpyxl (o suba el archivo como CSV).")
+            except ValueError as e:
+                st.error(f"No se pudo leer el archivo: {e}")
+            else:
+                c1, c2 = st.columns(2)
+                c1.metric("Filas válidas", len(validos))
+                c2.metric("Filas rechazadas", len(rechazados))
+                if not rechazados.empty:
+                    st.warning("Las filas rechazadas no se cargarán. Corrija el archivo y vuelva a subirlas.")
+                    st.dataframe(rechazados, use_container_width=True, hide_index=True)
+                    st.download_button("Descargar filas rechazadas", rechazados.to_csv(index=False),
+                                       file_name="filas_rechazadas.csv", mime="text/csv")
+                if not validos.empty and st.button(f"Cargar {len(validos)} tejidos", type="primary", use_container_width=True):
+                    resultado_carga = load_intake(validos, hospital_id, conn)
+                    if resultado_carga is not None:
+                        st.session_state["resultado_carga"] = resultado_carga
+                        st.session_state["carga_masiva_key"] += 1
+                        st.rerun()
+
     with st.expander("🔄 **Actualizar Estado de Tejido Existente**"):
-        query_inventory_update = """
+        estados_validos = ['Disponible', 'En Cuarentena', 'Reservado', 'Enviado', 'Rechazado']
+        col_f1, col_f2 = st.columns(2)
+        filtro_update_texto = col_f1.text_input("🔍 Buscar por ID o tipo de tejido", key="filtro_update_texto")
+        filtro_update_estado = col_f2.selectbox("Estado actual", [""] + estados_validos, key="filtro_update_estado")
+        filtro_update_texto = filtro_update_texto.strip()
+        filtros_update, params_update = where_clause(
+            equals_predicate("t.id", int(filtro_update_texto)) if filtro_update_texto.isdigit()
+            else contains_predicate(filtro_update_texto, "tipo", ("t.tipo", "detalles_tejido", "tipo")),
+            equals_predicate("t.estado", filtro_update_estado),
+        )
+        query_inventory_update = f"""
         SELECT 
             t.id, 
             dt.descripcion, 
@@ -450,32 +482,53 @@ if opcion_utilidades == "Gestión de Inventario":
         FROM tejidos t 
         LEFT JOIN detalles_tejido dt ON t.tipo = dt.tipo 
         LEFT JOIN donante d ON t.id_donante = d.id 
-        WHERE t.id_hospital = %s 
-        ORDER BY t.id DESC
+        WHERE t.id_hospital = %s AND NOT t.archivado {filtros_update}
         """
-        inventory_df_update = execute_query(query_inventory_update, conn=conn, params=(hospital_id,), is_select=True)
+        # Solo se trae la página visible del inventario, la más reciente primero
+        inventory_df_update, _, _, _ = keyset_paginator(
+            "pagina_actualizar_estado", query_inventory_update, ["id"], conn,
+            (hospital_id, *params_update), descending=True, page_sizes=(25, 50, 100)
+        )
         
         if not inventory_df_update.empty:
             with st.form("form_update_estado_final"):
-                opciones_tejido = [f"ID: {row['id']} - {row['descripcion']} (Donante: {row['donante']}, Rec: {row['fecha_recoleccion']})" for _, row in inventory_df_update.iterrows()]
-                tejido_sel_update = st.selectbox("Tejido a actualizar", opciones_tejido)
-                estados_validos = ['Disponible', 'En Cuarentena', 'Reservado', 'Enviado', 'Rechazado']
+                opciones_tejido = (
+                    "ID: " + inventory_df_update['id'].astype(str) + " - " + inventory_df_update['descripcion'].fillna('').astype(str)
+                    + " (Donante: " + inventory_df_update['donante'].fillna('').astype(str)
+                    + ", Rec: " + inventory_df_update['fecha_recoleccion'].astype(str) + ")"
+                ).tolist()
+                tejidos_sel_update = st.multiselect("Tejidos a actualizar", opciones_tejido, placeholder="Elija uno o más tejidos...")
                 new_estado = st.selectbox("Nuevo Estado", estados_validos)
                 submitted_update = st.form_submit_button("Actualizar Estado", use_container_width=True)
 
                 if submitted_update:
-                    # Convertir numpy.int64 a int nativo de Python
-                    id_to_update = int(tejido_sel_update.split(' ')[1])
-                    query_update = "UPDATE tejidos SET estado = %s, fecha_de_estado = NOW() WHERE id = %s"
-                    if execute_query(query_update, conn, (new_estado, id_to_update), is_select=False):
-                        st.success(f"✅ Estado del tejido ID {id_to_update} actualizado a '{new_estado}'.")
-                        st.cache_data.clear(); st.rerun()
+                    if not tejidos_sel_update:
+                        st.warning("Seleccione al menos un tejido.")
+                    else:
+                        # Convertir numpy.int64 a int nativo de Python
+                        ids_to_update = [int(opcion.split(' ')[1]) for opcion in tejidos_sel_update]
+                        # Todos los cambios en una sola sentencia por lote y un solo commit.
+                        # execute_values admite un único %s: hospital_id (entero) va en el texto.
+                        query_update = f"""
+                            UPDATE tejidos SET estado = v.estado, fecha_de_estado = NOW()
+                            FROM (VALUES %s) AS v (id, estado)
+                            WHERE tejidos.id = v.id AND tejidos.id_hospital = {hospital_id} AND NOT tejidos.archivado
+                        """
+                        resultado_update = execute_many(
+                            query_update, [(id_tejido, new_estado) for id_tejido in ids_to_update],
+                            conn, template="(%s::int, %s)"
+                        )
+                        if resultado_update is not None:
+                            st.success(f"✅ {resultado_update['filas']} tejido(s) actualizados a '{new_estado}'.")
+                            st.rerun()
+        elif filtros_update:
+            st.info("Ningún tejido coincide con la búsqueda.")
         else:
             st.info("No hay tejidos en tu inventario para actualizar.")
 
     st.markdown("---")
     st.subheader("Inventario Actual")
-    inventory_query_final = f"""
+    inventory_query_final = """
     SELECT 
         t.id, 
         dt.descripcion, 
@@ -486,36 +539,116 @@ if opcion_utilidades == "Gestión de Inventario":
     FROM tejidos t
     LEFT JOIN detalles_tejido dt ON t.tipo = dt.tipo
     LEFT JOIN donante d ON t.id_donante = d.id
-    WHERE t.id_hospital = {hospital_id}
-    ORDER BY t.id DESC
+    WHERE t.id_hospital = %s AND NOT t.archivado
     """
-    inventory_df_final = execute_query(inventory_query_final, conn, is_select=True)
-    st.dataframe(inventory_df_final, use_container_width=True, hide_index=True)
+    # Paginación por clave sobre t.id (más recientes primero): solo viaja la página visible
+    inventory_page, _, _, _ = keyset_paginator("pagina_inventario", inventory_query_final, ["id"], conn, (hospital_id,), descending=True)
+    if inventory_page.empty:
+        st.info("No hay tejidos registrados en tu inventario.")
+    else:
+        st.dataframe(inventory_page, use_container_width=True, hide_index=True)
+        # El CSV recorre todo el inventario por lotes; se arma solo a pedido, no en cada rerun
+        if st.button("Preparar CSV del inventario completo"):
+            st.session_state["inventario_csv"] = query_csv(inventory_query_final + " ORDER BY t.id DESC", conn=conn, params=(hospital_id,))
+        if st.session_state.get("inventario_csv"):
+            st.download_button("Descargar inventario (CSV)", st.session_state["inventario_csv"],
+                               file_name="inventario.csv", mime="text/csv")
 
 
 elif opcion_utilidades == "Gestión de Solicitudes":
     st.title("📬 Gestión de Solicitudes de Médicos")
     st.markdown("Revise y procese las solicitudes de tejido pendientes para su hospital.")
+
+    # Resultado del último procesamiento en lote (se guarda antes del rerun)
+    if "resultado_lote" in st.session_state:
+        resultado_lote = st.session_state.pop("resultado_lote")
+        conteo = resultado_lote['resultado'].value_counts()
+        st.success(
+            f"Lote procesado: {conteo.get('aprobada', 0)} aprobadas, {conteo.get('rechazada', 0)} rechazadas, "
+            f"{conteo.get('sin_stock', 0)} sin stock, {conteo.get('no_pendiente', 0)} ya procesadas."
+        )
+        st.dataframe(
+            resultado_lote.rename(columns={'solicitud_id': 'Solicitud', 'resultado': 'Resultado', 'tejido_id': 'Tejido Reservado'}),
+            use_container_width=True, hide_index=True
+        )
     
-    # UPDATED QUERY: Using ubicacion field instead of hospital_id (matching current DB structure)
+    # Cola de pendientes por hospital_id: recorre solicitud_pendientes_hospital_idx
     solicitudes_df = execute_query(
         """
         SELECT s.id, s.fecha_solicitud, s.tipo, m.nombre, m.apellido 
         FROM solicitud s 
         JOIN medico m ON s.medico_id = m.id 
-        WHERE s.estado = 'pendiente' AND s.ubicacion = %s
+        WHERE s.estado = 'pendiente' AND NOT s.archivado AND s.hospital_id = %s
         ORDER BY s.fecha_solicitud ASC
         """, 
         conn=conn, 
-        params=(hospital_nombre,), 
-        is_select=True
+        params=(hospital_id,), 
+        is_select=True,
+        typed=True
     )
 
     if solicitudes_df.empty:
         st.info("No hay solicitudes pendientes para revisar en su hospital.")
     else:
         st.subheader(f"Solicitudes Pendientes para su Hospital: {len(solicitudes_df)}")
+
+        with st.expander("⚡ **Procesamiento en Lote**"):
+            etiquetas_solicitud = {
+                int(row['id']): f"ID {row['id']} - {row['tipo']} - {row['nombre']} {row['apellido']} ({row['fecha_solicitud'].strftime('%d/%m/%Y')})"
+                for _, row in solicitudes_df.iterrows()
+            }
+            seleccionadas = st.multiselect(
+                "Solicitudes a procesar",
+                options=list(etiquetas_solicitud),
+                format_func=etiquetas_solicitud.get,
+                placeholder="Elija una o más solicitudes..."
+            )
+            b1, b2, b3 = st.columns(3)
+            if b1.button("✅ Aprobar seleccionadas", disabled=not seleccionadas, use_container_width=True):
+                st.session_state["resultado_lote"] = approve_solicitudes(seleccionadas, hospital_id, conn)
+                st.rerun()
+            if b2.button("❌ Rechazar seleccionadas", disabled=not seleccionadas, use_container_width=True):
+                st.session_state["resultado_lote"] = reject_solicitudes(seleccionadas, conn)
+                st.rerun()
+            if b3.button("⚡ Aprobar todas las satisfacibles", use_container_width=True,
+                         help="Asigna el stock disponible a las solicitudes más antiguas de cada tipo"):
+                st.session_state["resultado_lote"] = approve_solicitudes(list(etiquetas_solicitud), hospital_id, conn)
+                st.rerun()
+
+        with st.expander("🧭 **Sugerencias de Asignación Global**"):
+            st.markdown("Calcula la mejor asignación de todo el stock disponible de la red a todas las solicitudes pendientes, "
+                        "según tipo de tejido, compatibilidad sanguínea, antigüedad y distancia entre hospitales.")
+            if st.button("Calcular sugerencias", use_container_width=True):
+                pendientes_red = cached_query(
+                    """
+                    SELECT s.id, s.tipo, s.hospital_id, h.nombre AS ubicacion
+                    FROM solicitud s
+                    JOIN hospital h ON h.id = s.hospital_id
+                    WHERE s.estado = 'pendiente' AND NOT s.archivado
+                    """,
+                    conn=conn, typed=True
+                )
+                disponibles_red = cached_query(
+                    """
+                    SELECT t.id, t.tipo, t.id_hospital, h.nombre AS hospital, t.fecha_recoleccion, d.tipo_sangre
+                    FROM tejidos t
+                    JOIN hospital h ON t.id_hospital = h.id
+                    LEFT JOIN donante d ON t.id_donante = d.id
+                    WHERE t.estado = 'Disponible' AND NOT t.archivado
+                    """,
+                    conn=conn, typed=True
+                )
+                asignacion = allocate(pendientes_red, disponibles_red, get_hospitales(conn))
+                propias = asignacion[asignacion['hospital_destino_id'] == hospital_id]
+                st.session_state["sugerencias"] = {
+                    int(fila['solicitud_id']): fila for fila in propias.to_dict('records')
+                }
+            sugerencias = st.session_state.get("sugerencias", {})
+            if sugerencias:
+                st.success(f"Hay sugerencias para {len(sugerencias)} solicitudes. Se muestran junto a cada solicitud.")
+
         st.markdown("---")
+        sugerencias = st.session_state.get("sugerencias", {})
         for _, row in solicitudes_df.iterrows():
             with st.container(border=True):
                 st.markdown(f"**ID:** {row['id']} | **Fecha:** {row['fecha_solicitud'].strftime('%d/%m/%Y')} | **Médico:** {row['nombre']} {row['apellido']}")
@@ -525,61 +658,32 @@ elif opcion_utilidades == "Gestión de Solicitudes":
                     # Convertir numpy.int64 a int nativo de Python
                     solicitud_id = int(row['id'])
                     
-                    # PASO 1: Buscar tejido disponible del tipo solicitado en este hospital
-                    tejido_disponible_q = """
-                        SELECT id FROM tejidos 
-                        WHERE tipo = %s AND estado = 'Disponible' AND id_hospital = %s 
-                        ORDER BY fecha_recoleccion ASC
-                        LIMIT 1
-                    """
-                    tejido_disp_df = execute_query(
-                        tejido_disponible_q, 
-                        conn, 
-                        (row['tipo'], hospital_id), 
-                        is_select=True
-                    )
-                    
-                    if not tejido_disp_df.empty:
-                        id_tejido_a_reservar = int(tejido_disp_df.iloc[0]['id'])
-                        
-                        # PASO 2: Actualizar el estado del tejido a 'Reservado'
-                        update_tejido_q = """
-                            UPDATE tejidos 
-                            SET estado = 'Reservado', fecha_de_estado = NOW() 
-                            WHERE id = %s AND estado = 'Disponible'
-                        """
-                        tejido_actualizado = execute_query(
-                            update_tejido_q, 
-                            conn, 
-                            (id_tejido_a_reservar,), 
-                            is_select=False
-                        )
-                        
-                        if tejido_actualizado:
-                            # PASO 3: Solo si el tejido se actualizó correctamente, aprobar la solicitud
-                            update_solicitud_q = """
-                                UPDATE solicitud 
-                                SET estado = 'aprobada' 
-                                WHERE id = %s
-                            """
-                            solicitud_actualizada = execute_query(
-                                update_solicitud_q, 
-                                conn, 
-                                (solicitud_id,), 
-                                is_select=False
-                            )
-                            
-                            if solicitud_actualizada:
-                                st.success(f"✅ Solicitud {solicitud_id} aprobada exitosamente!")
-                                st.info(f"📦 Tejido ID {id_tejido_a_reservar} reservado para el médico.")
-                                st.cache_data.clear()
-                                st.rerun()
-                            else:
-                                st.error("❌ Error al actualizar el estado de la solicitud.")
-                        else:
-                            st.error("❌ Error al reservar el tejido. Es posible que ya no esté disponible.")
-                    else:
+                    # Reserva el tejido más antiguo disponible y aprueba la solicitud en una sola transacción
+                    resultado, id_tejido_reservado = approve_solicitud(solicitud_id, hospital_id, conn)
+                    if resultado == "aprobada":
+                        st.success(f"✅ Solicitud {solicitud_id} aprobada exitosamente!")
+                        st.info(f"📦 Tejido ID {id_tejido_reservado} reservado para el médico.")
+                        st.rerun()
+                    elif resultado == "sin_stock":
                         st.warning(f"⚠️ No hay tejidos de tipo '{row['tipo']}' disponibles en su hospital para aprobar esta solicitud.")
+                    elif resultado == "no_pendiente":
+                        st.warning(f"⚠️ La solicitud {solicitud_id} ya fue procesada por otro usuario.")
+                sugerencia = sugerencias.get(int(row['id']))
+                if sugerencia is not None:
+                    st.markdown(
+                        f"🧭 **Sugerencia:** Tejido ID {sugerencia['tejido_id']} en {sugerencia['hospital_origen']} "
+                        f"({sugerencia['distancia_km']:.1f} km, recolectado hace {sugerencia['antiguedad_dias']:.0f} días)"
+                    )
+                    if st.button("🧭 Aprobar con sugerencia", key=f"approve_suggested_{row['id']}"):
+                        resultado, id_tejido_reservado = approve_solicitud(int(row['id']), hospital_id, conn, tejido_id=int(sugerencia['tejido_id']))
+                        if resultado == "aprobada":
+                            st.session_state["sugerencias"].pop(int(row['id']), None)
+                            st.success(f"✅ Solicitud {row['id']} aprobada con el tejido ID {id_tejido_reservado}.")
+                            st.rerun()
+                        elif resultado == "sin_stock":
+                            st.warning("⚠️ El tejido sugerido ya no está disponible. Vuelva a calcular las sugerencias.")
+                        elif resultado == "no_pendiente":
+                            st.warning(f"⚠️ La solicitud {row['id']} ya fue procesada por otro usuario.")
                 if c2.button("❌ Rechazar", key=f"reject_{row['id']}"):
                     # Convertir numpy.int64 a int nativo de Python
                     solicitud_id = int(row['id'])
@@ -594,7 +698,7 @@ elif opcion_utilidades == "Gestión de Solicitudes":
         SELECT t.id, t.tipo, t.estado, t.fecha_de_estado, dt.descripcion
         FROM tejidos t
         LEFT JOIN detalles_tejido dt ON t.tipo = dt.tipo
-        WHERE t.id_hospital = %s
+        WHERE t.id_hospital = %s AND NOT t.archivado
         ORDER BY t.fecha_de_estado DESC
         LIMIT 10
         """
@@ -612,12 +716,12 @@ elif opcion_utilidades == "Gestión de Solicitudes":
                COUNT(t.id) as tejidos_disponibles_tipo
         FROM solicitud s 
         JOIN medico m ON s.medico_id = m.id 
-        LEFT JOIN tejidos t ON t.tipo = s.tipo AND t.estado = 'Disponible' AND t.id_hospital = %s
-        WHERE s.estado = 'pendiente' AND s.ubicacion = %s
+        LEFT JOIN tejidos t ON t.tipo = s.tipo AND t.estado = 'Disponible' AND NOT t.archivado AND t.id_hospital = %s
+        WHERE s.estado = 'pendiente' AND NOT s.archivado AND s.hospital_id = %s
         GROUP BY s.id, s.tipo, s.estado, s.fecha_solicitud, m.nombre, m.apellido, s.ubicacion
         ORDER BY s.fecha_solicitud ASC
         """
-        debug_solicitudes = execute_query(debug_solicitudes_query, conn, (hospital_id, hospital_nombre), is_select=True)
+        debug_solicitudes = execute_query(debug_solicitudes_query, conn, (hospital_id, hospital_id), is_select=True)
         
         if not debug_solicitudes.empty:
             st.subheader("Debug de Solicitudes Pendientes:")
@@ -627,16 +731,18 @@ elif opcion_utilidades == "Dashboard Analítico":
     st.title("📊 Dashboard Analítico")
     st.markdown("Métricas y visualizaciones clave sobre la operación.")
     
-    tejidos_df = execute_query(f"SELECT estado, tipo FROM tejidos WHERE id_hospital = {hospital_id}", conn, is_select=True)
-    if not tejidos_df.empty:
+    # Conteos por (estado, tipo) del resumen mantenido en la base: una fila por grupo, no por tejido
+    resumen_df = get_resumen_disponibilidad(conn, group_by=("estado", "tipo"), hospital_id=hospital_id)
+    if not resumen_df.empty:
+        por_estado = resumen_df.groupby('estado', observed=True)['cantidad'].sum()
         c1, c2, c3 = st.columns(3)
-        c1.metric("Total de Tejidos en Stock", len(tejidos_df))
-        c2.metric("Disponibles", len(tejidos_df[tejidos_df['estado'] == 'Disponible']))
-        c3.metric("En Cuarentena", len(tejidos_df[tejidos_df['estado'] == 'En Cuarentena']))
+        c1.metric("Total de Tejidos en Stock", int(por_estado.sum()))
+        c2.metric("Disponibles", int(por_estado.get('Disponible', 0)))
+        c3.metric("En Cuarentena", int(por_estado.get('En Cuarentena', 0)))
         
         st.markdown("---")
         st.subheader("Composición del Inventario")
-        composicion_df = tejidos_df['tipo'].value_counts().reset_index()
+        composicion_df = resumen_df.groupby('tipo', observed=True)['cantidad'].sum().sort_values(ascending=False).reset_index()
         composicion_df.columns = ['Tipo de Tejido', 'Cantidad']
         st.bar_chart(composicion_df.set_index('Tipo de Tejido'))
     else:
@@ -678,47 +784,122 @@ elif opcion_utilidades == "Trazabilidad de Tejidos":
                 with col2:
                     st.markdown(f"**Médico Recolector:** {data['m_nombre']} {data['m_apellido']}")
                     st.markdown(f"**Hospital de Registro:** {data['h_nombre']}")
+                st.markdown("---")
+                st.subheader("Historial de Estados")
+                historial_df = get_historial_tejido(data['id'], desde=data['fecha_recoleccion'], conn=conn)
+                if historial_df.empty:
+                    st.info("No hay cambios de estado registrados para este tejido.")
+                else:
+                    # Tiempo en cada estado: hasta el evento siguiente o, para el actual, hasta ahora
+                    ts = pd.to_datetime(historial_df['ts'], utc=True)
+                    historial_df['duracion'] = (ts.shift(-1).fillna(pd.Timestamp.now(tz="UTC")) - ts).dt.round("min")
+                    st.dataframe(
+                        historial_df.rename(columns={
+                            'ts': 'Fecha', 'estado_anterior': 'Estado Anterior', 'estado': 'Estado',
+                            'hospital': 'Hospital', 'duracion': 'Tiempo en el Estado'
+                        }),
+                        use_container_width=True, hide_index=True
+                    )
             else:
                 st.error("No se encontró ningún tejido con ese ID.")
         else:
             st.warning("Por favor, ingrese un ID numérico válido.")
 
+    with st.expander("🕒 Últimos movimientos del hospital"):
+        movimientos_df = get_movimientos_hospital(hospital_id, conn=conn)
+        if movimientos_df.empty:
+            st.info("Todavía no hay movimientos registrados.")
+        else:
+            st.dataframe(
+                movimientos_df.rename(columns={
+                    'ts': 'Fecha', 'tejido_id': 'ID Tejido', 'estado_anterior': 'Estado Anterior', 'estado': 'Estado'
+                }),
+                use_container_width=True, hide_index=True
+            )
+
 elif opcion_utilidades == "Red de Hospitales y Logística":
     st.title("🌐 Red de Hospitales y Logística")
     st.markdown("Visualice la red y calcule tiempos de traslado estimados.")
     st.markdown("---")
     
-    hospitales_df = get_hospitales_principales()
-    st.subheader("Ubicación de Hospitales en la Red")
-    st.map(hospitales_df, latitude='lat', longitude='lon', zoom=10)
+    hospitales_df = get_hospitales(conn)
+    if len(hospitales_df) < 2:
+        st.info("La red necesita al menos dos hospitales con coordenadas cargadas. Puede agregarlas al dar de alta un hospital.")
+    else:
+        st.subheader("Ubicación de Hospitales en la Red")
+        st.map(hospitales_df, latitude='lat', longitude='lon', zoom=10)
     
-    with st.expander("Ver lista de hospitales y direcciones"):
-        st.dataframe(hospitales_df[['name', 'address']].rename(columns={'name': 'Hospital', 'address': 'Dirección'}), use_container_width=True)
+        with st.expander("Ver lista de hospitales y direcciones"):
+            st.dataframe(hospitales_df[['name', 'address']].rename(columns={'name': 'Hospital', 'address': 'Dirección'}), use_container_width=True)
     
-    st.markdown("---")
-    st.subheader("Calculadora de Tiempo de Traslado Estimado")
+        st.markdown("---")
+        st.subheader("Calculadora de Tiempo de Traslado Estimado")
     
-    col1, col2 = st.columns(2)
-    origen = col1.selectbox("📍 Hospital de Origen", options=hospitales_df['name'], index=0)
-    destino = col2.selectbox("🏁 Hospital de Destino", options=hospitales_df['name'], index=1)
+        col1, col2 = st.columns(2)
+        origen = col1.selectbox("📍 Hospital de Origen", options=hospitales_df['name'], index=0)
+        destino = col2.selectbox("🏁 Hospital de Destino", options=hospitales_df['name'], index=1)
         
-    if st.button("Calcular Tiempo Estimado", type="secondary", use_container_width=True):
-        if origen == destino: 
-            st.warning("El hospital de origen y destino no pueden ser el mismo.")
+        if st.button("Calcular Tiempo Estimado", type="secondary", use_container_width=True):
+            if origen == destino: 
+                st.warning("El hospital de origen y destino no pueden ser el mismo.")
+            else:
+                origen_coords = hospitales_df[hospitales_df['name'] == origen].iloc[0]
+                destino_coords = hospitales_df[hospitales_df['name'] == destino].iloc[0]
+                distancia = distancia_hospitales(origen_coords['id'], destino_coords['id'], conn)
+                if distancia is None:
+                    # La consulta no devuelve fila si uno de los hospitales perdió sus coordenadas o ya no existe
+                    st.warning("No se pudo calcular la distancia: uno de los hospitales no tiene coordenadas registradas.")
+                else:
+                    velocidad_promedio_kmh = 30
+                    tiempo_horas = distancia / velocidad_promedio_kmh
+                    tiempo_minutos = tiempo_horas * 60
+                    st.success(f"**Resultados de la estimación para la ruta: {origen} ➡️ {destino}**")
+                    res_col1, res_col2 = st.columns(2)
+                    res_col1.metric(label="Distancia en línea recta", value=f"{distancia:.2f} km")
+                    res_col2.metric(label="Tiempo de traslado estimado", value=f"~ {tiempo_minutos:.0f} min")
+                    google_maps_url = f"https://www.google.com/maps/dir/?api=1&origin={origen_coords['lat']},{origen_coords['lon']}&destination={destino_coords['lat']},{destino_coords['lon']}&travelmode=driving"
+                    st.link_button("Ver Ruta en Google Maps", google_maps_url, use_container_width=True)
+                    st.info("Nota: El tiempo estimado no considera tráfico real. El enlace a Google Maps mostrará la ruta y el tiempo real.")
+
+        st.markdown("---")
+        st.subheader("Fuentes Más Cercanas por Tipo de Tejido")
+        nombres_red = hospitales_df['name'].tolist()
+        col1, col2 = st.columns(2)
+        hospital_referencia = col1.selectbox(
+            "🏥 Hospital de referencia", options=nombres_red,
+            index=nombres_red.index(hospital_nombre) if hospital_nombre in nombres_red else 0
+        )
+        radio_km = col2.slider("📏 Radio de búsqueda (km)", min_value=1, max_value=80, value=10)
+
+        referencia = hospitales_df[hospitales_df['name'] == hospital_referencia].iloc[0]
+        fuentes = fuentes_cercanas(referencia['id'], conn)
+        if fuentes.empty:
+            st.info("No hay tejidos disponibles en los hospitales de la red.")
         else:
-            origen_coords = hospitales_df[hospitales_df['name'] == origen].iloc[0]
-            destino_coords = hospitales_df[hospitales_df['name'] == destino].iloc[0]
-            distancia = haversine(origen_coords['lat'], origen_coords['lon'], destino_coords['lat'], destino_coords['lon'])
-            velocidad_promedio_kmh = 30
-            tiempo_horas = distancia / velocidad_promedio_kmh
-            tiempo_minutos = tiempo_horas * 60
-            st.success(f"**Resultados de la estimación para la ruta: {origen} ➡️ {destino}**")
-            res_col1, res_col2 = st.columns(2)
-            res_col1.metric(label="Distancia en línea recta", value=f"{distancia:.2f} km")
-            res_col2.metric(label="Tiempo de traslado estimado", value=f"~ {tiempo_minutos:.0f} min")
-            google_maps_url = f"https://www.google.com/maps/dir/?api=1&origin={origen_coords['lat']},{origen_coords['lon']}&destination={destino_coords['lat']},{destino_coords['lon']}&travelmode=driving"
-            st.link_button("Ver Ruta en Google Maps", google_maps_url, use_container_width=True)
-            st.info("Nota: El tiempo estimado no considera tráfico real. El enlace a Google Maps mostrará la ruta y el tiempo real.")
+            st.dataframe(
+                fuentes[['tipo', 'hospital', 'disponibles', 'distancia_km']].rename(columns={
+                    'tipo': 'Tipo de Tejido', 'hospital': 'Hospital Más Cercano',
+                    'disponibles': 'Disponibles', 'distancia_km': 'Distancia (km)'
+                }).round({'Distancia (km)': 1}),
+                use_container_width=True, hide_index=True
+            )
+
+        # Búsquedas por radio y de más cercanos resueltas en Postgres con el índice espacial
+        cercanos = hospitales_cercanos(referencia['lat'], referencia['lon'], conn, k=50, radius_km=radio_km)
+        cercanos = cercanos[cercanos['id'] != referencia['id']]
+        st.markdown(f"**Hospitales a menos de {radio_km} km de {hospital_referencia}:** {len(cercanos)}")
+        if cercanos.empty:
+            cercanos = hospitales_cercanos(referencia['lat'], referencia['lon'], conn, k=4)
+            cercanos = cercanos[cercanos['id'] != referencia['id']].head(3)
+            st.caption("Ninguno dentro del radio; se muestran los 3 más cercanos.")
+        st.dataframe(
+            cercanos[['name', 'address', 'distancia_km']].rename(columns={
+                'name': 'Hospital', 'address': 'Dirección', 'distancia_km': 'Distancia (km)'
+            }).round({'Distancia (km)': 1}),
+            use_container_width=True, hide_index=True
+        )
 
 # --- Cierre de conexión ---
-if conn: conn.close()
\ No newline at end of file
+if conn: conn.close()
+
+query_metrics_panel()
@@ -3,41 +3,12 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta
-from math import radians, sin, cos, sqrt, atan2
-from functions import connect_to_supabase, execute_query
+from functions import connect_to_supabase, execute_query, cached_query, keyset_paginator, fetch_one, get_change_listener, watch_tables, get_hospitales, distancia_hospitales, current_identity, start_session, get_resumen_disponibilidad, contains_predicate, equals_predicate, where_clause, query_metrics_panel
 
 st.set_page_config(page_title="Dashboard Médico", page_icon="🩺", layout="wide")
 
-# --- FUNCIÓN PARA CALCULAR DISTANCIAS ---
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371  # Radio de la Tierra en km
-    dlat = radians(lat2 - lat1)
-    dlon = radians(lon2 - lon1)
-    a = sin(dlat / 2)**2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
-    return R * c
-
-# --- FUNCIÓN PARA OBTENER HOSPITALES ---
-@st.cache_data
-def get_hospitales_principales():
-    data = [
-        {"name": "Hospital Italiano", "address": "Tte. Gral. Juan Domingo Perón 4190, CABA", "lat": -34.6066, "lon": -58.4250},
-        {"name": "Hospital Alemán", "address": "Av. Pueyrredón 1640, CABA", "lat": -34.5938, "lon": -58.4033},
-        {"name": "Hospital Británico", "address": "Perdriel 74, CABA", "lat": -34.6284, "lon": -58.3840},
-        {"name": "Hospital Garrahan", "address": "Pichincha 1890, CABA", "lat": -34.6293, "lon": -58.3908},
-        {"name": "Hospital Fernández", "address": "Av. Cerviño 3356, CABA", "lat": -34.5822, "lon": -58.4111},
-        {"name": "Hospital de Clínicas", "address": "Av. Córdoba 2351, CABA", "lat": -34.5989, "lon": -58.4005},
-        {"name": "Sanatorio Güemes", "address": "Francisco Acuña de Figueroa 1240, CABA", "lat": -34.5983, "lon": -58.4214},
-        {"name": "FLENI", "address": "Montañeses 2325, CABA", "lat": -34.5501, "lon": -58.4485},
-        {"name": "Hospital Austral", "address": "Av. J. D. Perón 1500, Pilar", "lat": -34.4528, "lon": -58.9133},
-        {"name": "Hospital Argerich", "address": "Pi y Margall 750, CABA", "lat": -34.6241, "lon": -58.3662},
-        {"name": "Hospital Rivadavia", "address": "Av. Gral. Las Heras 2670, CABA", "lat": -34.5880, "lon": -58.3990},
-        {"name": "Hospital Durand", "address": "Av. Díaz Vélez 5044, CABA", "lat": -34.6112, "lon": -58.4442},
-        {"name": "Hospital Santojanni", "address": "Pilar 950, CABA", "lat": -34.6465, "lon": -58.5134},
-        {"name": "Sanatorio Finochietto", "address": "Av. Córdoba 2678, CABA", "lat": -34.6043, "lon": -58.4045},
-        {"name": "Fundación Favaloro", "address": "Av. Belgrano 1746, CABA", "lat": -34.6120, "lon": -58.3900}
-    ]
-    return pd.DataFrame(data)
+# Máximo de tejidos ofrecidos en la lista de selección del formulario de solicitud
+MAX_OPCIONES_TEJIDO = 200
 
 # --- ESTILOS CSS MEJORADOS ---
 def load_css():
@@ -200,26 +171,26 @@ except (ValueError, TypeError):
 # Conexión
 conn = connect_to_supabase()
 
-# Verificar que el médico existe en la base de datos
-verificar_medico_query = """
-    SELECT id, nombre, apellido FROM medico WHERE id = %s
-"""
-medico_info = execute_query(
-    verificar_medico_query,
-    conn=conn,
-    params=(medico_id,),
-    is_select=True
-)
+# Identidad verificada al iniciar sesión; solo se consulta la base si venció o cambió el perfil
+identidad = current_identity()
+if identidad is None or identidad.get("rol") != "Médico" or identidad.get("id") != medico_id:
+    verificar_medico_query = """
+        SELECT id, nombre, apellido FROM medico WHERE id = %s
+    """
+    medico_info = fetch_one(verificar_medico_query, conn=conn, params=(medico_id,))
 
-if medico_info.empty:
-    st.error(f"❌ Error: Tu perfil de médico (ID: {medico_id}) no existe en el sistema. Por favor, contacta al administrador.")
-    if conn:
-        conn.close()
-    st.stop()
+    if medico_info is None:
+        st.error(f"❌ Error: Tu perfil de médico (ID: {medico_id}) no existe en el sistema. Por favor, contacta al administrador.")
+        if conn:
+            conn.close()
+        st.stop()
+
+    identidad = {"rol": "Médico", "id": medico_id, "nombre": medico_info.nombre, "apellido": medico_info.apellido}
+    start_session(identidad)
 
 # Mostrar información del médico en el sidebar
-medico_nombre = medico_info.iloc[0]['nombre']
-medico_apellido = medico_info.iloc[0]['apellido']
+medico_nombre = identidad["nombre"]
+medico_apellido = identidad["apellido"]
 
 st.sidebar.title("Portal Médico")
 st.sidebar.markdown(f"""
@@ -234,7 +205,8 @@ solicitudes_medico = execute_query(
     "SELECT estado FROM solicitud WHERE medico_id = %s",
     conn=conn,
     params=(medico_id,),
-    is_select=True
+    is_select=True,
+    typed=True
 )
 
 if not solicitudes_medico.empty:
@@ -257,6 +229,12 @@ opcion = st.sidebar.radio(
     ["🏠 Inicio", "📋 Ver Tejidos", "📦 Mis Solicitudes", "🌐 Red de Hospitales", "📊 Mi Dashboard"]
 )
 
+# Invalidación del caché por LISTEN/NOTIFY y refresco automático opcional
+get_change_listener()
+st.sidebar.markdown("---")
+if st.sidebar.toggle("🔴 Actualización en vivo", help="Refresca la página cuando cambian los tejidos o tus solicitudes"):
+    watch_tables("tejidos", "solicitud")
+
 # --------------------------------------------
 # 🏠 PÁGINA DE INICIO
 # --------------------------------------------
@@ -273,18 +251,15 @@ if opcion == "🏠 Inicio":
     col1, col2, col3, col4 = st.columns(4)
     
     # Obtener estadísticas
-    tejidos_disponibles = execute_query(
-        "SELECT COUNT(*) as count FROM tejidos WHERE estado = 'Disponible'",
-        conn=conn, is_select=True
-    )
+    tejidos_disponibles = get_resumen_disponibilidad(conn, group_by=(), estados=["Disponible"])
     
     mis_solicitudes = execute_query(
         f"SELECT estado FROM solicitud WHERE medico_id = {medico_id}",
-        conn=conn, is_select=True
+        conn=conn, is_select=True, typed=True
     )
     
     with col1:
-        total_disponibles = tejidos_disponibles.iloc[0]['count'] if not tejidos_disponibles.empty else 0
+        total_disponibles = int(tejidos_disponibles.iloc[0]['cantidad']) if not tejidos_disponibles.empty else 0
         st.markdown(f"""
         <div class="metric-card">
             <div class="metric-value">{total_disponibles}</div>
@@ -375,9 +350,9 @@ elif opcion == "📋 Ver Tejidos":
     # UPDATED QUERY: Now using hospital name as location instead of tissue location
     query = """
     SELECT 
-        t.tipo,
+        COALESCE(t.tipo, '') as tipo, -- clave de paginación: un NULL cortaría la comparación por filas
         COALESCE(dt.descripcion, '') as descripcion,
-        h.nombre as ubicacion,
+        COALESCE(h.nombre, '') as ubicacion,
         t.estado,
         t.condicion_recoleccion,
         t.fecha_recoleccion,
@@ -391,62 +366,47 @@ elif opcion == "📋 Ver Tejidos":
     LEFT JOIN detalles_tejido dt ON t.tipo = dt.tipo
     LEFT JOIN donante d ON t.id_donante = d.id
     LEFT JOIN hospital h ON t.id_hospital = h.id
-    WHERE TRUE
+    WHERE NOT t.archivado
     """
-    params = []
-
-    # Aplicar filtros existentes
-    if filtro_tipo:
-        query += " AND t.tipo ILIKE %s"
-        params.append(f"%{filtro_tipo}%")
-    if filtro_ubicacion:
-        query += " AND h.nombre ILIKE %s"
-        params.append(f"%{filtro_ubicacion}%")
-    if filtro_estado:
-        query += " AND t.estado = %s"
-        params.append(filtro_estado)
-    if filtro_descripcion:
-        query += " AND dt.descripcion ILIKE %s"
-        params.append(f"%{filtro_descripcion}%")
-    
-    # NUEVO FILTRO: Tipo de sangre
-    if filtro_sangre:
-        query += " AND d.tipo_sangre = %s"
-        params.append(filtro_sangre)
-
-    query += " ORDER BY t.tipo, h.nombre"
-
-    tejidos = execute_query(query, conn=conn, params=tuple(params), is_select=True)
+    # Los filtros de texto se resuelven en los catálogos (índices de trigramas) y tejidos se
+    # filtra por clave, sin ILIKE sobre el resultado del JOIN
+    filtros_sql, params = where_clause(
+        contains_predicate(filtro_tipo, "tipo", ("t.tipo", "detalles_tejido", "tipo")),
+        contains_predicate(filtro_ubicacion, "nombre", ("t.id_hospital", "hospital", "id")),
+        equals_predicate("t.estado", filtro_estado),
+        contains_predicate(filtro_descripcion, "descripcion", ("t.tipo", "detalles_tejido", "tipo")),
+        equals_predicate("d.tipo_sangre", filtro_sangre),
+    )
+    query += filtros_sql
+
+    # Renombrar columnas para mejor presentación
+    column_mapping = {
+        'tipo': 'Tipo de Tejido',
+        'descripcion': 'Descripción',
+        'ubicacion': 'Hospital',
+        'estado': 'Estado',
+        'condicion_recoleccion': 'Condición de Recolección',
+        'fecha_recoleccion': 'Fecha de Recolección',
+        'fecha_de_estado': 'Fecha de Estado',
+        'donante_nombre': 'Donante',
+        'tipo_sangre': '🩸 Tipo de Sangre',
+        'donante_sexo': 'Sexo del Donante'
+    }
+    # Columnas que no queremos mostrar
+    columns_to_remove = ['tejido_id', 'id_hospital']
+
+    # Paginación por clave sobre (tipo, hospital, id): solo viaja la página visible
+    pagina_tejidos, _, total_tejidos, _ = keyset_paginator(
+        "pagina_ver_tejidos", query, ["tipo", "ubicacion", "tejido_id"], conn, tuple(params)
+    )
 
-    if tejidos.empty:
+    if pagina_tejidos.empty:
         st.warning("No se encontraron tejidos con los filtros aplicados.")
     else:
-        st.success(f"Se encontraron {len(tejidos)} tejidos.")
-        
         # Preparar datos para mostrar
-        tejidos_display = tejidos.copy()
-        # Eliminar columnas que no queremos mostrar
-        columns_to_remove = ['tejido_id', 'id_hospital']
-        for col in columns_to_remove:
-            if col in tejidos_display.columns:
-                tejidos_display = tejidos_display.drop(col, axis=1)
-        
-        # Renombrar columnas para mejor presentación
-        column_mapping = {
-            'tipo': 'Tipo de Tejido',
-            'descripcion': 'Descripción',
-            'ubicacion': 'Hospital',
-            'estado': 'Estado',
-            'condicion_recoleccion': 'Condición de Recolección',
-            'fecha_recoleccion': 'Fecha de Recolección',
-            'fecha_de_estado': 'Fecha de Estado',
-            'donante_nombre': 'Donante',
-            'tipo_sangre': '🩸 Tipo de Sangre',
-            'donante_sexo': 'Sexo del Donante'
-        }
-        
+        tejidos_display = pagina_tejidos.drop(columns=[c for c in columns_to_remove if c in pagina_tejidos.columns])
         tejidos_display = tejidos_display.rename(columns=column_mapping)
-        
+
         # Mostrar tabla con información ampliada
         st.dataframe(
             tejidos_display,
@@ -471,7 +431,7 @@ elif opcion == "📋 Ver Tejidos":
                 )
             }
         )
-
+        
         # Información adicional expandible
         with st.expander("ℹ️ Información sobre Compatibilidad de Tipos de Sangre"):
             st.markdown("""
@@ -503,19 +463,25 @@ elif opcion == "📋 Ver Tejidos":
         col1, col2, col3 = st.columns([3, 3, 2])
         
         with col1:
-            # Obtener tipos únicos disponibles
-            tipos_disponibles = [""] + list(tejidos[tejidos['estado'] == 'Disponible']['tipo'].unique())
+            # Obtener tipos únicos disponibles (consulta aparte: la tabla de arriba solo trae una página)
+            tipos_df = get_resumen_disponibilidad(conn, group_by=("tipo",), estados=["Disponible"])
+            tipos_disponibles = [""] + (tipos_df['tipo'].tolist() if not tipos_df.empty else [])
             tipo_solicitud = st.selectbox("1️⃣ Tipo de Tejido a Solicitar", tipos_disponibles, key="tipo_solicitud_form")
         
         with col2:
             # Filtrar por tipo de sangre
             if tipo_solicitud:
                 # Obtener tipos de sangre disponibles para este tipo de tejido
-                tipos_sangre_disponibles = tejidos[
-                    (tejidos['tipo'] == tipo_solicitud) & 
-                    (tejidos['estado'] == 'Disponible') &
-                    (tejidos['tipo_sangre'].notna())
-                ]['tipo_sangre'].unique().tolist()
+                sangre_df = cached_query(
+                    """
+                    SELECT DISTINCT d.tipo_sangre
+                    FROM tejidos t
+                    JOIN donante d ON t.id_donante = d.id
+                    WHERE t.estado = 'Disponible' AND NOT t.archivado AND t.tipo = %s AND d.tipo_sangre IS NOT NULL
+                    """,
+                    conn=conn, params=(tipo_solicitud,)
+                )
+                tipos_sangre_disponibles = sangre_df['tipo_sangre'].tolist() if not sangre_df.empty else []
                 
                 # Agregar opción "Cualquiera"
                 tipos_sangre_opciones = ["Cualquier tipo de sangre"] + sorted(tipos_sangre_disponibles)
@@ -543,20 +509,40 @@ elif opcion == "📋 Ver Tejidos":
                 sangre_display = sangre_seleccionada if sangre_seleccionada != "Cualquier tipo de sangre" else "Todos los tipos"
                 st.info(f"🩸 **Filtro sangre:** {sangre_display}")
             
-            # Filtrar tejidos según las selecciones
-            tejidos_filtrados = tejidos[
-                (tejidos['tipo'] == tipo_solicitud) & 
-                (tejidos['estado'] == 'Disponible')
-            ].copy()
+            # Buscar en el servidor los tejidos disponibles según las selecciones
+            query_disponibles = """
+            SELECT 
+                t.tipo,
+                COALESCE(dt.descripcion, '') as descripcion,
+                COALESCE(h.nombre, '') as ubicacion,
+                t.estado,
+                t.condicion_recoleccion,
+                t.fecha_recoleccion,
+                d.nombre || ' ' || d.apellido as donante_nombre,
+                d.tipo_sangre,
+                d.sexo as donante_sexo,
+                t.id as tejido_id,
+                t.id_hospital
+            FROM tejidos t
+            LEFT JOIN detalles_tejido dt ON t.tipo = dt.tipo
+            LEFT JOIN donante d ON t.id_donante = d.id
+            LEFT JOIN hospital h ON t.id_hospital = h.id
+            WHERE t.estado = 'Disponible' AND NOT t.archivado AND t.tipo = %s
+            """
+            params_disponibles = [tipo_solicitud]
             
             # Aplicar filtro de tipo de sangre si no es "Cualquiera"
             if sangre_seleccionada and sangre_seleccionada != "Cualquier tipo de sangre":
-                tejidos_filtrados = tejidos_filtrados[
-                    tejidos_filtrados['tipo_sangre'] == sangre_seleccionada
-                ]
+                query_disponibles += " AND d.tipo_sangre = %s"
+                params_disponibles.append(sangre_seleccionada)
+            # Los más antiguos primero; la lista de selección se limita a los primeros
+            query_disponibles += f" ORDER BY t.fecha_recoleccion, t.id LIMIT {MAX_OPCIONES_TEJIDO}"
+            tejidos_filtrados = execute_query(query_disponibles, conn, tuple(params_disponibles), is_select=True)
             
             if not tejidos_filtrados.empty:
                 st.success(f"✅ **Se encontraron {len(tejidos_filtrados)} tejido(s) de tipo {tipo_solicitud}**")
+                if len(tejidos_filtrados) == MAX_OPCIONES_TEJIDO:
+                    st.caption(f"Se muestran los {MAX_OPCIONES_TEJIDO} recolectados hace más tiempo. Filtre por tipo de sangre para acotar la lista.")
                 
                 st.markdown("### 3️⃣ Tejidos Disponibles:")
                 
@@ -660,6 +646,7 @@ elif opcion == "📋 Ver Tejidos":
                 
                 if submitted:
                     hospital_destino = tejido_info_final['ubicacion']
+                    hospital_destino_id = int(tejido_info_final['id_hospital'])
                     
                     # Verificar que el tejido sigue disponible
                     verificar_query = "SELECT estado FROM tejidos WHERE id = %s"
@@ -671,12 +658,12 @@ elif opcion == "📋 Ver Tejidos":
                         # Verificar solicitud existente para este tipo de tejido en este hospital
                         verificar_solicitud_query = """
                             SELECT id FROM solicitud 
-                            WHERE medico_id = %s AND tipo = %s AND ubicacion = %s AND estado = 'pendiente'
+                            WHERE medico_id = %s AND tipo = %s AND hospital_id = %s AND estado = 'pendiente' AND NOT archivado
                         """
                         solicitud_existente = execute_query(
                             verificar_solicitud_query,
                             conn=conn,
-                            params=(medico_id, tipo_solicitud, hospital_destino),
+                            params=(medico_id, tipo_solicitud, hospital_destino_id),
                             is_select=True
                         )
                         
@@ -685,13 +672,13 @@ elif opcion == "📋 Ver Tejidos":
                         else:
                             # Crear la solicitud específica
                             solicitud_query = """
-                                INSERT INTO solicitud (medico_id, tipo, ubicacion, estado, fecha_solicitud)
-                                VALUES (%s, %s, %s, 'pendiente', NOW())
+                                INSERT INTO solicitud (medico_id, tipo, ubicacion, hospital_id, tejido_id, estado, fecha_solicitud)
+                                VALUES (%s, %s, %s, %s, %s, 'pendiente', NOW())
                             """
                             success = execute_query(
                                 solicitud_query,
                                 conn=conn,
-                                params=(medico_id, tipo_solicitud, hospital_destino),
+                                params=(medico_id, tipo_solicitud, hospital_destino, hospital_destino_id, int(tejido_id_final)),
                                 is_select=False
                             )
                             
@@ -761,7 +748,7 @@ elif opcion == "📦 Mis Solicitudes":
     ORDER BY fecha_solicitud DESC
     """
 
-    solicitudes = execute_query(solicitud_query, conn=conn, params=(medico_id,), is_select=True)
+    solicitudes = execute_query(solicitud_query, conn=conn, params=(medico_id,), is_select=True, typed=True)
 
     if solicitudes.empty:
         st.info("🔍 Aún no has realizado solicitudes.")
@@ -849,37 +836,44 @@ elif opcion == "🌐 Red de Hospitales":
     st.markdown("Visualice la red hospitalaria y calcule tiempos de traslado estimados.")
     st.markdown("---")
     
-    hospitales_df = get_hospitales_principales()
-    st.subheader("Ubicación de Hospitales en la Red")
-    st.map(hospitales_df, latitude='lat', longitude='lon', zoom=10)
+    hospitales_df = get_hospitales(conn)
+    if len(hospitales_df) < 2:
+        st.info("La red necesita al menos dos hospitales con coordenadas cargadas. Puede agregarlas al dar de alta un hospital.")
+    else:
+        st.subheader("Ubicación de Hospitales en la Red")
+        st.map(hospitales_df, latitude='lat', longitude='lon', zoom=10)
     
-    with st.expander("Ver lista de hospitales y direcciones"):
-        st.dataframe(hospitales_df[['name', 'address']].rename(columns={'name': 'Hospital', 'address': 'Dirección'}), use_container_width=True)
+        with st.expander("Ver lista de hospitales y direcciones"):
+            st.dataframe(hospitales_df[['name', 'address']].rename(columns={'name': 'Hospital', 'address': 'Dirección'}), use_container_width=True)
     
-    st.markdown("---")
-    st.subheader("Calculadora de Tiempo de Traslado Estimado")
+        st.markdown("---")
+        st.subheader("Calculadora de Tiempo de Traslado Estimado")
     
-    col1, col2 = st.columns(2)
-    origen = col1.selectbox("📍 Hospital de Origen", options=hospitales_df['name'], index=0)
-    destino = col2.selectbox("🏁 Hospital de Destino", options=hospitales_df['name'], index=1)
+        col1, col2 = st.columns(2)
+        origen = col1.selectbox("📍 Hospital de Origen", options=hospitales_df['name'], index=0)
+        destino = col2.selectbox("🏁 Hospital de Destino", options=hospitales_df['name'], index=1)
         
-    if st.button("Calcular Tiempo Estimado", type="secondary", use_container_width=True):
-        if origen == destino: 
-            st.warning("El hospital de origen y destino no pueden ser el mismo.")
-        else:
-            origen_coords = hospitales_df[hospitales_df['name'] == origen].iloc[0]
-            destino_coords = hospitales_df[hospitales_df['name'] == destino].iloc[0]
-            distancia = haversine(origen_coords['lat'], origen_coords['lon'], destino_coords['lat'], destino_coords['lon'])
-            velocidad_promedio_kmh = 30
-            tiempo_horas = distancia / velocidad_promedio_kmh
-            tiempo_minutos = tiempo_horas * 60
-            st.success(f"**Resultados de la estimación para la ruta: {origen} ➡️ {destino}**")
-            res_col1, res_col2 = st.columns(2)
-            res_col1.metric(label="Distancia en línea recta", value=f"{distancia:.2f} km")
-            res_col2.metric(label="Tiempo de traslado estimado", value=f"~ {tiempo_minutos:.0f} min")
-            google_maps_url = f"https://www.google.com/maps/dir/?api=1&origin={origen_coords['lat']},{origen_coords['lon']}&destination={destino_coords['lat']},{destino_coords['lon']}&travelmode=driving"
-            st.link_button("Ver Ruta en Google Maps", google_maps_url, use_container_width=True)
-            st.info("Nota: El tiempo estimado no considera tráfico real. El enlace a Google Maps mostrará la ruta y el tiempo real.")
+        if st.button("Calcular Tiempo Estimado", type="secondary", use_container_width=True):
+            if origen == destino: 
+                st.warning("El hospital de origen y destino no pueden ser el mismo.")
+            else:
+                origen_coords = hospitales_df[hospitales_df['name'] == origen].iloc[0]
+                destino_coords = hospitales_df[hospitales_df['name'] == destino].iloc[0]
+                distancia = distancia_hospitales(origen_coords['id'], destino_coords['id'], conn)
+                if distancia is None:
+                    # La consulta no devuelve fila si uno de los hospitales perdió sus coordenadas o ya no existe
+                    st.warning("No se pudo calcular la distancia: uno de los hospitales no tiene coordenadas registradas.")
+                else:
+                    velocidad_promedio_kmh = 30
+                    tiempo_horas = distancia / velocidad_promedio_kmh
+                    tiempo_minutos = tiempo_horas * 60
+                    st.success(f"**Resultados de la estimación para la ruta: {origen} ➡️ {destino}**")
+                    res_col1, res_col2 = st.columns(2)
+                    res_col1.metric(label="Distancia en línea recta", value=f"{distancia:.2f} km")
+                    res_col2.metric(label="Tiempo de traslado estimado", value=f"~ {tiempo_minutos:.0f} min")
+                    google_maps_url = f"https://www.google.com/maps/dir/?api=1&origin={origen_coords['lat']},{origen_coords['lon']}&destination={destino_coords['lat']},{destino_coords['lon']}&travelmode=driving"
+                    st.link_button("Ver Ruta en Google Maps", google_maps_url, use_container_width=True)
+                    st.info("Nota: El tiempo estimado no considera tráfico real. El enlace a Google Maps mostrará la ruta y el tiempo real.")
 
 # --------------------------------------------
 # 📊 SECCIÓN: MI DASHBOARD PERSONAL
@@ -899,7 +893,8 @@ elif opcion == "📊 Mi Dashboard":
         """,
         conn=conn,
         params=(medico_id,),
-        is_select=True
+        is_select=True,
+        typed=True
     )
     
     if not mis_solicitudes_detalle.empty:
@@ -996,4 +991,6 @@ elif opcion == "📊 Mi Dashboard":
 
 # Cerrar conexión al final
 if conn:
-    conn.close()
\ No newline at end of file
+    conn.close()
+
+query_metrics_panel()
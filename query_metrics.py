@@ -0,0 +1,167 @@
+# query_metrics.py
+
+import functools
+import linecache
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites (en segundos) del histograma de duración de consultas
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Módulos que ejecutan consultas en nombre de otro: el origen es el primer marco fuera de ellos
+_INTERNAL_FILES = {"functions.py", "intake.py", "query_metrics.py", "contextlib.py"}
+# Secciones de los portales: `if opcion == "📋 Ver Tejidos":` / `elif opcion_utilidades == "...":`
+_SECTION_RE = re.compile(r"""^(?:if|elif)\s+\w+\s*==\s*["'](.+?)["']\s*:""")
+_APP_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+@functools.lru_cache(maxsize=4096)
+def _section(filename, lineno):
+    """Sección del portal que contiene la línea: el último `if/elif opcion == "..."` de nivel superior."""
+    for n in range(lineno, 0, -1):
+        match = _SECTION_RE.match(linecache.getline(filename, n))
+        if match:
+            return match.group(1)
+    return ""
+
+
+def caller_location():
+    """
+    (página, sección, línea) del código de la app que originó la consulta, salteando los
+    módulos internos. Página es el nombre del script (p. ej. Portal_Médico) o del módulo.
+    """
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(_APP_ROOT) and os.path.basename(filename) not in _INTERNAL_FILES:
+            page = os.path.splitext(os.path.basename(filename))[0]
+            return page, _section(filename, frame.f_lineno), frame.f_lineno
+        frame = frame.f_back
+    return "desconocido", "", 0
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+class QueryMetrics:
+    """
+    Métricas de las consultas del proceso: contadores por página y sección, histograma de
+    duración y un registro rotativo de las consultas lentas (más de `slow_ms` ms) o fallidas.
+    `export_path`: archivo donde se escriben los contadores en formato de texto de Prometheus
+    (p. ej. para el textfile collector de node_exporter), a lo sumo cada `export_interval` s.
+    """
+
+    def __init__(self, slow_ms=500, slow_log_size=200, export_path=None, export_interval=15):
+        self.slow_ms = slow_ms
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self._lock = threading.Lock()
+        self._slow = deque(maxlen=slow_log_size)
+        self._counters = {}  # (página, sección) -> contadores
+        self._buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self._duration_sum = 0.0
+        self._last_export = 0.0
+        self._server = None
+
+    def record(self, query, seconds, rows=0, nbytes=0, caller=None, error=None):
+        """Registra una sentencia ejecutada. Retorna la entrada (dict) con sus datos."""
+        page, section, line = caller or ("desconocido", "", 0)
+        entry = {
+            "ts": time.time(), "pagina": page, "seccion": section, "linea": line,
+            "ms": seconds * 1000, "filas": rows, "bytes": nbytes,
+            "consulta": " ".join(query.split())[:500], "error": None if error is None else str(error),
+        }
+        slow = entry["ms"] >= self.slow_ms
+        with self._lock:
+            c = self._counters.setdefault((page, section), {
+                "consultas": 0, "errores": 0, "lentas": 0, "segundos": 0.0, "filas": 0, "bytes": 0
+            })
+            c["consultas"] += 1
+            c["errores"] += error is not None
+            c["lentas"] += slow
+            c["segundos"] += seconds
+            c["filas"] += rows
+            c["bytes"] += nbytes
+            self._duration_sum += seconds
+            self._buckets[next((i for i, b in enumerate(DURATION_BUCKETS) if seconds <= b), len(DURATION_BUCKETS))] += 1
+            if slow or error is not None:
+                self._slow.append(entry)
+            export = self.export_path and time.monotonic() - self._last_export >= self.export_interval
+            if export:
+                self._last_export = time.monotonic()
+        if export:
+            self.export()
+        return entry
+
+    def slow_log(self):
+        """Consultas lentas o fallidas más recientes, de la más nueva a la más vieja."""
+        with self._lock:
+            return list(reversed(self._slow))
+
+    def prometheus(self):
+        """Contadores en formato de texto de Prometheus."""
+        with self._lock:
+            counters = {k: dict(v) for k, v in self._counters.items()}
+            buckets = list(self._buckets)
+            duration_sum = self._duration_sum
+
+        lines = []
+        series = [
+            ("tissbank_queries_total", "consultas", "Consultas ejecutadas"),
+            ("tissbank_query_errors_total", "errores", "Consultas que fallaron"),
+            ("tissbank_slow_queries_total", "lentas", "Consultas por encima del umbral de lentitud"),
+            ("tissbank_query_seconds_total", "segundos", "Tiempo total en consultas"),
+            ("tissbank_query_rows_total", "filas", "Filas devueltas o afectadas"),
+            ("tissbank_query_bytes_total", "bytes", "Bytes de los resultados decodificados"),
+        ]
+        for name, key, help_text in series:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (page, section), c in sorted(counters.items()):
+                lines.append(f'{name}{{page="{_label(page)}",section="{_label(section)}"}} {c[key]}')
+
+        name = "tissbank_query_duration_seconds"
+        lines += [f"# HELP {name} Duración de las consultas", f"# TYPE {name} histogram"]
+        acumulado = 0
+        for limit, count in zip(DURATION_BUCKETS + ("+Inf",), buckets):
+            acumulado += count
+            lines.append(f'{name}_bucket{{le="{limit}"}} {acumulado}')
+        lines += [f"{name}_sum {duration_sum}", f"{name}_count {acumulado}"]
+        return "\n".join(lines) + "\n"
+
+    def export(self):
+        """Escribe `prometheus()` en `export_path` de forma atómica (archivo temporal y rename)."""
+        tmp = f"{self.export_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.prometheus())
+            os.replace(tmp, self.export_path)
+        except OSError as e:
+            print(f"No se pudieron exportar las métricas a {self.export_path}: {e}", file=sys.stderr)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Sirve `prometheus()` en http://host:port/metrics desde un hilo en segundo plano."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, name="query-metrics", daemon=True).start()
+        return self._server
@@ -0,0 +1,92 @@
+# tests/test_allocation.py
+
+from itertools import permutations
+
+import numpy as np
+import pandas as pd
+import pytest
+from allocation import allocate, blood_compatibility, min_cost_assignment
+
+
+def _fuerza_bruta(cost):
+    """Costo mínimo probando todas las asignaciones (solo para matrices chicas)."""
+    n, m = cost.shape
+    if n <= m:
+        return min(sum(cost[i, p[i]] for i in range(n)) for p in permutations(range(m), n))
+    return min(sum(cost[p[j], j] for j in range(m)) for p in permutations(range(n), m))
+
+
+@pytest.mark.parametrize("forma", [(4, 4), (3, 6), (6, 3), (1, 5), (5, 1)])
+def test_min_cost_assignment_optimo(forma):
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        # Costos enteros chicos: muchos empates, como con hospitales y fechas repetidos
+        cost = rng.integers(0, 5, size=forma).astype(float)
+        rows, cols = min_cost_assignment(cost)
+        assert len(rows) == min(forma)
+        assert len(set(rows)) == len(rows) and len(set(cols)) == len(cols)
+        assert cost[rows, cols].sum() == pytest.approx(_fuerza_bruta(cost))
+
+
+def test_min_cost_assignment_vacia():
+    rows, cols = min_cost_assignment(np.empty((0, 3)))
+    assert rows.size == 0 and cols.size == 0
+
+
+def test_blood_compatibility():
+    compatible = blood_compatibility(["O-", "AB+", None], ["AB+", "O-", None])
+    # Receptor AB+ acepta O- y AB+, pero no un donante sin tipo de sangre
+    assert compatible[0].tolist() == [True, True, False]
+    # Receptor O- solo acepta O-
+    assert compatible[1].tolist() == [True, False, False]
+    # Una solicitud sin tipo de sangre acepta cualquier tejido
+    assert compatible[2].tolist() == [True, True, True]
+
+
+def test_allocate_hospitales_con_el_mismo_nombre():
+    # Dos hospitales "Central" en ciudades distintas: la distancia se calcula por id
+    hospitales = pd.DataFrame({
+        "id": [1, 2, 3],
+        "name": ["Central", "Central", "Norte"],
+        "lat": [-34.60, -31.42, -34.59],
+        "lon": [-58.38, -64.18, -58.40],
+    })
+    solicitudes = pd.DataFrame({"id": [100], "tipo": ["PIEL"], "hospital_id": [2], "ubicacion": ["Central"]})
+    tejidos = pd.DataFrame({
+        "id": [10, 11],
+        "tipo": ["PIEL", "PIEL"],
+        "id_hospital": [1, 3],
+        "hospital": ["Central", "Norte"],
+        "fecha_recoleccion": pd.to_datetime(["2025-01-01", "2025-01-01"]),
+        "tipo_sangre": ["O+", "O+"],
+    })
+    asignacion = allocate(solicitudes, tejidos, hospitales, today="2025-02-01")
+    assert len(asignacion) == 1
+    fila = asignacion.iloc[0]
+    assert fila["hospital_destino_id"] == 2
+    # Desde Córdoba, el "Central" de Buenos Aires está a unos 650 km
+    assert fila["distancia_km"] > 600
+
+
+def test_allocate_prioriza_cantidad_y_compatibilidad():
+    hospitales = pd.DataFrame({"id": [1, 2], "name": ["A", "B"], "lat": [-34.60, -34.70], "lon": [-58.38, -58.40]})
+    solicitudes = pd.DataFrame({
+        "id": [100, 101],
+        "tipo": ["PIEL", "PIEL"],
+        "hospital_id": [1, 2],
+        "ubicacion": ["A", "B"],
+        "tipo_sangre": ["O-", "AB+"],
+    })
+    tejidos = pd.DataFrame({
+        "id": [10, 11],
+        "tipo": ["PIEL", "PIEL"],
+        "id_hospital": [1, 2],
+        "hospital": ["A", "B"],
+        "fecha_recoleccion": pd.to_datetime(["2025-01-01", "2025-01-01"]),
+        # El tejido de A solo sirve a la solicitud AB+ de B; el de B sirve a ambas
+        "tipo_sangre": ["A+", "O-"],
+    })
+    asignacion = allocate(solicitudes, tejidos, hospitales, today="2025-02-01")
+    pares = dict(zip(asignacion["solicitud_id"], asignacion["tejido_id"]))
+    assert pares == {100: 11, 101: 10}
+    assert dict(zip(asignacion["solicitud_id"], asignacion["hospital_origen_id"])) == {100: 2, 101: 1}
@@ -0,0 +1,55 @@
+# tests/test_decode_typed.py
+
+from datetime import datetime, timezone
+
+import pandas as pd
+from functions import CATEGORY_MAX_RATIO, decode_typed
+
+# (nombre, OID de tipo) como en cur.description
+INT4, INT8, TEXT, VARCHAR, TIMESTAMPTZ, BOOL, NUMERIC = 23, 20, 25, 1043, 1184, 16, 1700
+
+
+def test_enteros_nulables():
+    df = decode_typed([("id", INT4), ("total", INT8)], [(1, 10), (2, None), (None, 30)])
+    assert str(df["id"].dtype) == "Int32"
+    assert str(df["total"].dtype) == "Int64"
+    # Un NULL no convierte la columna a float
+    assert df["total"].isna().tolist() == [False, True, False]
+    assert df["id"].iloc[0] == 1
+
+
+def test_texto_con_pocos_valores_es_categoria():
+    estados = ["Disponible", "Reservado"] * 5
+    df = decode_typed([("estado", VARCHAR)], [(e,) for e in estados])
+    assert df["estado"].dtype == "category"
+    assert df["estado"].tolist() == estados
+
+
+def test_texto_con_muchos_valores_queda_object():
+    n = 10
+    distintos = int(n * CATEGORY_MAX_RATIO) + 1
+    valores = [f"v{i % distintos}" for i in range(n)]
+    df = decode_typed([("descripcion", TEXT)], [(v,) for v in valores])
+    assert df["descripcion"].dtype == object
+
+
+def test_una_fila_no_es_categoria():
+    df = decode_typed([("nombre", TEXT)], [("Ana",)])
+    assert df["nombre"].dtype == object
+
+
+def test_timestamp_y_booleano():
+    ts = datetime(2025, 3, 4, 12, 0, tzinfo=timezone.utc)
+    df = decode_typed([("fecha", TIMESTAMPTZ), ("archivado", BOOL)], [(ts, False), (None, None)])
+    assert pd.api.types.is_datetime64_any_dtype(df["fecha"])
+    assert df["fecha"].iloc[0] == pd.Timestamp(ts)
+    assert str(df["archivado"].dtype) == "boolean"
+    assert df["archivado"].isna().tolist() == [False, True]
+
+
+def test_columnas_repetidas_y_sin_filas():
+    df = decode_typed([("id", INT4), ("id", INT4), ("monto", NUMERIC)], [(1, 2, 3)])
+    assert df.columns.tolist() == ["id", "id", "monto"]
+    assert df.iloc[0].tolist() == [1, 2, 3]
+    vacio = decode_typed([("id", INT4), ("tipo", TEXT)], [])
+    assert vacio.columns.tolist() == ["id", "tipo"] and vacio.empty
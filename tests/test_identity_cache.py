@@ -0,0 +1,60 @@
+# tests/test_identity_cache.py
+
+import functions
+from functions import IdentityCache
+
+MEDICO = {"rol": "Médico", "id": 7, "nombre": "Ana"}
+HOSPITAL = {"rol": "Hospital", "id": 3, "nombre": "Central"}
+
+
+def test_token_firmado():
+    cache = IdentityCache(b"clave")
+    token = cache.issue(MEDICO)
+    assert cache.get(token) == MEDICO
+    sid, firma = token.rsplit(".", 1)
+    assert cache.get(f"{sid}.{'0' * len(firma)}") is None
+    assert cache.get(sid) is None
+    assert cache.get(None) is None
+    # Un token firmado con otra clave no sirve
+    assert IdentityCache(b"otra").get(token) is None
+
+
+def test_la_identidad_es_una_copia():
+    cache = IdentityCache(b"clave")
+    token = cache.issue(MEDICO)
+    cache.get(token)["id"] = 99
+    assert cache.get(token)["id"] == 7
+
+
+def test_expiracion(monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr(functions.time, "monotonic", lambda: ahora[0])
+    cache = IdentityCache(b"clave", ttl=60)
+    token = cache.issue(MEDICO)
+    ahora[0] += 59
+    assert cache.get(token) == MEDICO
+    ahora[0] += 1
+    assert cache.get(token) is None
+
+
+def test_revocar_e_invalidar():
+    cache = IdentityCache(b"clave")
+    medico, otro_medico, hospital = cache.issue(MEDICO), cache.issue({**MEDICO, "id": 8}), cache.issue(HOSPITAL)
+    cache.revoke(medico)
+    assert cache.get(medico) is None and cache.get(otro_medico) is not None
+
+    medico = cache.issue(MEDICO)
+    # Notificación por sentencia (0015) con los ids modificados
+    cache.on_change({"tabla": "medico", "ids": [7]})
+    assert cache.get(medico) is None and cache.get(otro_medico) is not None
+    # Formato por fila anterior
+    cache.on_change({"tabla": "medico", "id": 8})
+    assert cache.get(otro_medico) is None
+    # ids en null: demasiadas filas, se invalida todo el rol
+    medico = cache.issue(MEDICO)
+    cache.on_change({"tabla": "medico", "ids": None})
+    assert cache.get(medico) is None
+    assert cache.get(hospital) == HOSPITAL
+    # Tablas sin identidades no afectan al caché
+    cache.on_change({"tabla": "tejidos", "ids": None})
+    assert cache.get(hospital) == HOSPITAL
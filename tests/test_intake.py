@@ -0,0 +1,127 @@
+# tests/test_intake.py
+
+import pandas as pd
+import pytest
+from intake import validate_intake
+
+TIPOS = pd.DataFrame({"tipo": ["PIEL", "HUESO"]})
+MEDICOS = pd.DataFrame({"id": [10], "dni": [25123456]})
+DONANTES = pd.DataFrame({"id": [20], "dni": [30123456]})
+
+
+def _archivo(**columnas):
+    base = {"tipo": "piel", "dni_donante": "30123456", "dni_medico": "25123456", "fecha_recoleccion": "2025-01-31"}
+    base.update(columnas)
+    return pd.DataFrame([base])
+
+
+@pytest.mark.parametrize("texto, esperada", [
+    ("2025-01-12", "2025-01-12"),           # ISO con día <= 12: no se invierte día y mes
+    ("2025-03-04", "2025-03-04"),
+    ("2025-03-04 00:00:00", "2025-03-04"),  # celda de fecha de Excel convertida a texto
+    ("04/03/2025", "2025-03-04"),           # formato regional, día primero
+    ("31/01/2025", "2025-01-31"),
+])
+def test_fecha_recoleccion(texto, esperada):
+    validos, rechazados = validate_intake(_archivo(fecha_recoleccion=texto), TIPOS, MEDICOS, DONANTES, today="2025-06-01")
+    assert rechazados.empty
+    assert validos.loc[0, "fecha_recoleccion"] == pd.Timestamp(esperada)
+
+
+def test_fecha_nativa_de_excel():
+    df = _archivo()
+    df["fecha_recoleccion"] = [pd.Timestamp("2025-03-04")]
+    validos, _ = validate_intake(df, TIPOS, MEDICOS, DONANTES, today="2025-06-01")
+    assert validos.loc[0, "fecha_recoleccion"] == pd.Timestamp("2025-03-04")
+
+
+def test_rechaza_fecha_futura_e_invalida():
+    df = pd.concat([_archivo(fecha_recoleccion="2030-01-01"), _archivo(fecha_recoleccion="ayer")], ignore_index=True)
+    validos, rechazados = validate_intake(df, TIPOS, MEDICOS, DONANTES, today="2025-06-01")
+    assert validos.empty
+    assert rechazados["fila"].tolist() == [2, 3]
+    assert rechazados["motivo"].tolist() == ["Fecha de recolección futura", "Fecha de recolección inválida"]
+
+
+def test_resuelve_referencias_y_donante_nuevo():
+    df = pd.concat([
+        _archivo(tipo="hueso"),
+        _archivo(dni_donante="40111222", nombre_donante="Ana", apellido_donante="Gómez", sexo="Femenino", tipo_sangre="a+"),
+        _archivo(dni_donante="40111333"),
+    ], ignore_index=True)
+    validos, rechazados = validate_intake(df, TIPOS, MEDICOS, DONANTES, today="2025-06-01")
+    assert validos["tipo"].tolist() == ["HUESO", "PIEL"]
+    assert validos["id_medico"].tolist() == [10, 10]
+    assert validos.loc[0, "id_donante"] == 20
+    assert pd.isna(validos.loc[1, "id_donante"]) and validos.loc[1, "tipo_sangre"] == "A+"
+    assert rechazados["motivo"].str.startswith("Donante no registrado").tolist() == [True]
+
+
+def test_faltan_columnas():
+    with pytest.raises(ValueError, match="fecha_recoleccion"):
+        validate_intake(_archivo().drop(columns="fecha_recoleccion"), TIPOS, MEDICOS, DONANTES)
+
+
+class _Cursor:
+    """Cursor falso: guarda lo que se copia y responde al RETURNING de los donantes nuevos."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = 0
+        self._result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if "RETURNING dni, id" in sql:
+            self._result = self.conn.returning
+        elif "now()" in sql:
+            self._result = [(pd.Timestamp("2025-06-01 10:00", tz="UTC"),)]
+
+    def fetchall(self):
+        return self._result
+
+    def fetchone(self):
+        return self._result[0]
+
+    def copy_expert(self, sql, buffer):
+        tabla = sql.split()[1]
+        self.conn.copies[tabla] = pd.read_csv(buffer, header=None)
+        self.rowcount = len(self.conn.copies[tabla])
+
+
+class _Conn:
+    def __init__(self, returning):
+        self.returning = returning
+        self.copies = {}
+
+    def cursor(self):
+        return _Cursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+def test_load_intake_toma_ids_de_donantes_del_returning():
+    from intake import load_intake
+    df = pd.concat([
+        _archivo(),
+        _archivo(dni_donante="40111222", nombre_donante="Ana", apellido_donante="Gómez", sexo="Femenino", tipo_sangre="A+"),
+        _archivo(dni_donante="40111222", nombre_donante="Ana", apellido_donante="Gómez", sexo="Femenino", tipo_sangre="A+"),
+    ], ignore_index=True)
+    validos, _ = validate_intake(df, TIPOS, MEDICOS, DONANTES, today="2025-06-01")
+    # Ya existe otro donante (id 21) con el DNI 40111222: el id tiene que salir del RETURNING
+    conn = _Conn(returning=[(40111222, 99)])
+
+    assert load_intake(validos, hospital_id=5, conn=conn) == {"tejidos": 3, "donantes": 1}
+    assert len(conn.copies["donantes_carga"]) == 1
+    # Columnas copiadas a tejidos: tipo, id_donante, id_medico, id_hospital, ...
+    assert conn.copies["tejidos"][1].tolist() == [20, 99, 99]
+    assert conn.copies["tejidos"][3].tolist() == [5, 5, 5]
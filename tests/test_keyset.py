@@ -0,0 +1,59 @@
+# tests/test_keyset.py
+
+from functions import keyset_page
+
+
+class _Cursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.description = [("tipo", 25), ("id", 23)]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        self.conn.ejecutadas.append((query, params))
+
+    def fetchall(self):
+        return self.conn.filas
+
+
+class _Conn:
+    """Conexión falsa: registra las sentencias y responde siempre `filas`."""
+
+    def __init__(self, filas):
+        self.filas = filas
+        self.ejecutadas = []
+
+    def cursor(self, **kwargs):
+        return _Cursor(self)
+
+    def rollback(self):
+        pass
+
+
+QUERY = "SELECT tipo, id FROM tejidos WHERE id_hospital = %s"
+
+
+def test_clave_de_la_ultima_fila_con_tipos_nativos():
+    conn = _Conn([("HUESO", 9), ("PIEL", 8), ("PIEL", 7)])
+    df, siguiente = keyset_page(QUERY, ["tipo", "id"], conn=conn, params=(1,), page_size=2, typed=True)
+    assert len(df) == 2
+    assert siguiente == ("PIEL", 8)
+    # psycopg2 no adapta escalares numpy: la clave tiene que ser de tipos de Python
+    assert type(siguiente[0]) is str and type(siguiente[1]) is int
+
+
+def test_continua_desde_la_clave():
+    conn = _Conn([("PIEL", 6)])
+    df, siguiente = keyset_page(QUERY, ["tipo", "id"], conn=conn, params=(1,), after=("PIEL", 8),
+                                page_size=2, descending=True)
+    assert siguiente is None
+    sql, params = conn.ejecutadas[-1]
+    assert "WHERE (q.tipo, q.id) < (%s, %s)" in sql
+    assert sql.endswith("ORDER BY q.tipo DESC, q.id DESC LIMIT %s")
+    # Parámetros de la consulta, luego la clave y por último page_size + 1
+    assert params == (1, "PIEL", 8, 3)
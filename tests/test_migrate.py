@@ -0,0 +1,46 @@
+# tests/test_migrate.py
+
+import hashlib
+
+import pytest
+from migrate import discover
+
+
+def _escribir(directorio, nombre, contenido="SELECT 1;\n"):
+    (directorio / nombre).write_text(contenido, encoding="utf-8")
+
+
+def test_orden_y_checksum(tmp_path):
+    _escribir(tmp_path, "0002_indices.sql")
+    _escribir(tmp_path, "0000_base.sql", "CREATE TABLE t (id int);\n")
+    _escribir(tmp_path, "0001_datos.sql")
+    _escribir(tmp_path, "notas.sql")  # sin versión: se ignora
+    _escribir(tmp_path, "0003_borrador.txt")
+    migraciones = discover(tmp_path)
+    assert [(m.version, m.nombre) for m in migraciones] == [("0000", "base"), ("0001", "datos"), ("0002", "indices")]
+    assert migraciones[0].checksum == hashlib.sha256(b"CREATE TABLE t (id int);\n").hexdigest()
+
+
+def test_version_repetida(tmp_path):
+    _escribir(tmp_path, "0001_a.sql")
+    _escribir(tmp_path, "0001_b.sql")
+    with pytest.raises(ValueError, match="0001"):
+        discover(tmp_path)
+
+
+@pytest.mark.parametrize("sentencia", ["BEGIN;", "commit;", "  START TRANSACTION;", "ROLLBACK;"])
+def test_rechaza_transacciones_propias(tmp_path, sentencia):
+    _escribir(tmp_path, "0001_a.sql", f"{sentencia}\nSELECT 1;\n")
+    with pytest.raises(ValueError, match="BEGIN/COMMIT"):
+        discover(tmp_path)
+
+
+def test_acepta_bloques_plpgsql(tmp_path):
+    # BEGIN/END de un cuerpo PL/pgSQL no son sentencias de transacción
+    _escribir(tmp_path, "0001_funcion.sql", "DO $$\nBEGIN\n    PERFORM 1;\nEND;\n$$;\n")
+    assert len(discover(tmp_path)) == 1
+
+
+def test_migraciones_del_repositorio():
+    versiones = [m.version for m in discover()]
+    assert versiones == [f"{i:04d}" for i in range(len(versiones))]
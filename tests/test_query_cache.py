@@ -0,0 +1,53 @@
+# tests/test_query_cache.py
+
+from functions import QueryCache, tables_read, tables_written
+
+
+def test_invalidate_solo_las_tablas_indicadas():
+    cache = QueryCache()
+    cache.set("inventario", 1, {"tejidos", "donante"})
+    cache.set("solicitudes", 2, {"solicitud", "hospital"})
+    cache.set("hospitales", 3, {"hospital"})
+    assert cache.invalidate("tejidos") == 1
+    assert cache.get("inventario") is None
+    assert cache.get("solicitudes") == 2
+    # Una tabla compartida invalida todas las entradas que dependen de ella
+    assert cache.invalidate("hospital", "medico") == 2
+    assert cache.get("hospitales") is None and cache.get("solicitudes") is None
+    assert cache.invalidate("hospital") == 0
+
+
+def test_reemplazar_una_entrada_actualiza_sus_tablas():
+    cache = QueryCache()
+    cache.set("k", 1, {"tejidos"})
+    cache.set("k", 2, {"solicitud"})
+    assert cache.invalidate("tejidos") == 0
+    assert cache.get("k") == 2
+
+
+def test_lru_y_expiracion():
+    cache = QueryCache(maxsize=2)
+    cache.set("a", 1, {"t"})
+    cache.set("b", 2, {"t"})
+    cache.get("a")  # "b" pasa a ser la menos usada
+    cache.set("c", 3, {"t"})
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    cache.set("vencida", 4, {"t"}, ttl=-1)  # desaloja "a"
+    assert cache.get("vencida") is None  # y al leerla vencida se descarta
+    assert cache.invalidate("t") == 1
+
+
+def test_tablas_de_una_consulta():
+    query = """
+        SELECT t.id FROM public.tejidos t
+        JOIN detalles_tejido dt ON dt.tipo = t.tipo
+        LEFT JOIN LATERAL (SELECT 1 FROM donante d WHERE d.id = t.id_donante) x ON true
+        FOR UPDATE SKIP LOCKED
+    """
+    assert tables_read(query) == {"tejidos", "detalles_tejido", "donante"}
+    assert tables_written("UPDATE tejidos SET estado = 'Reservado' WHERE id = 1") == {"tejidos"}
+    assert tables_written("INSERT INTO donante (dni) VALUES (%s)") == {"donante"}
+    assert tables_written("COPY donantes_carga FROM STDIN") == {"donantes_carga"}
+    # FOR UPDATE es un bloqueo, no una escritura
+    assert tables_written("SELECT id FROM tejidos FOR UPDATE") == set()
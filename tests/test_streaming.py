@@ -0,0 +1,59 @@
+# tests/test_streaming.py
+
+import pandas as pd
+from functions import query_csv, stream_query
+
+
+class _Cursor:
+    """Cursor con nombre falso: entrega `filas` con fetchmany."""
+
+    def __init__(self, filas):
+        self.filas = list(filas)
+        self.description = None
+        self.itersize = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=None):
+        # Como en un cursor con nombre, description aparece recién después de ejecutar
+        self.description = [("id",), ("tipo",)]
+
+    def fetchmany(self, size):
+        lote, self.filas = self.filas[:size], self.filas[size:]
+        return lote
+
+
+class _Conn:
+    def __init__(self, filas):
+        self.filas = filas
+
+    def cursor(self, name=None, **kwargs):
+        return _Cursor(self.filas)
+
+    def rollback(self):
+        pass
+
+
+FILAS = [(i, "PIEL" if i % 2 else "HUESO") for i in range(1, 8)]
+
+
+def test_stream_query_por_lotes():
+    lotes = list(stream_query("SELECT id, tipo FROM tejidos", conn=_Conn(FILAS), chunk_size=3))
+    assert [len(lote) for lote in lotes] == [3, 3, 1]
+    assert pd.concat(lotes)["id"].tolist() == list(range(1, 8))
+
+
+def test_query_csv_un_solo_encabezado():
+    texto = query_csv("SELECT id, tipo FROM tejidos", conn=_Conn(FILAS), chunk_size=3)
+    lineas = texto.splitlines()
+    assert lineas[0] == "id,tipo"
+    assert len(lineas) == 1 + len(FILAS)
+    assert lineas[1] == "1,PIEL"
+
+
+def test_query_csv_sin_filas():
+    assert query_csv("SELECT id, tipo FROM tejidos", conn=_Conn([])) == ""